@@ -1,4 +1,6 @@
 import collections
+
+import dissect.bitlab as bitlab
 from dissect.bitlab import cast
 
 class OffHuffTree(Exception):pass
@@ -7,6 +9,15 @@ def bitvals(valu,bits=8):
     #HACK ugly for speed
     return [ (valu >> shft) & 0x1 for shft in range(bits-1, -1, -1) ]
 
+def bitrev(valu,bits):
+    '''
+    Reverse the order of the low "bits" bits of an integer.
+    '''
+    ret = 0
+    for i in range(bits):
+        ret = (ret << 1) | ((valu >> i) & 0x1)
+    return ret
+
 class HuffTree(object):
     '''
     A huffman encoding tree.
@@ -20,26 +31,41 @@ class HuffTree(object):
 
     # * Shorter codes lexicographically precede longer codes.
 
-    def __init__(self):
+    def __init__(self, tablebits=9):
+        self.tablebits = tablebits
         self.clear()
 
     def clear(self):
-        self.root = [None,[None,None]] # root of the huffman binary tree
+        self.root = None # root of the huffman binary tree ( built on demand )
+        self.codebook = []
         self.codebysym = {}
+        self.tables = {}
 
     def iterHuffSyms(self, bits, offset=0):
         '''
-        Use the HuffTree to decode bits yielding (bitoff,sym) tuples.
+        Use the HuffTree to decode bits yielding symbols.
+
+        If the bit source supports peek() and skip() ( such as a
+        BitStream ), the multi-bit lookup table is used to decode.
 
         Example:
 
             import dissect.bitlab as bitlab
 
             bits = bitlab.bits( byts )
-            for bit,sym in huff.iterHuffSyms( bits ):
+            for sym in huff.iterHuffSyms( bits ):
                 dostuff()
         '''
-        node = self.root
+        if hasattr(bits,'peek'):
+            try:
+                while True:
+                    yield self.getHuffSym(bits)
+            except bitlab.OffBitStream:
+                return
+
+        root = self._getHuffRoot()
+
+        node = root
         for bit in bits:
             node = node[1][bit]
             if node == None:
@@ -47,7 +73,42 @@ class HuffTree(object):
 
             if node[0] != None:
                 yield node[0]
-                node = self.root
+                node = root
+
+    def getHuffSym(self, bits):
+        '''
+        Decode a single symbol from a bit source using the lookup table.
+
+        The bit source must implement peek(n), skip(n) and declare
+        the bit order ( 'big' or 'little' ) in bits.order.
+
+        Example:
+
+            bits = bitlab.BitStream( byts, order='little' )
+            sym = huff.getHuffSym( bits )
+
+        '''
+        lookup = self.tables.get(bits.order)
+        if lookup == None:
+            lookup = self.getLookupTable(bits.order)
+
+        tbits,table = lookup
+
+        ent = table[ bits.peek(tbits) ]
+        if ent == None:
+            raise OffHuffTree('Invalid huffman code')
+
+        sym,nbits = ent
+        # negative bit counts mark a sub table for long codes
+        if nbits < 0:
+            bits.skip(tbits)
+            ent = sym[ bits.peek(-nbits) ]
+            if ent == None:
+                raise OffHuffTree('Invalid huffman code')
+            sym,nbits = ent
+
+        bits.skip(nbits)
+        return sym
 
     def getCodeBySym(self, sym):
         '''
@@ -72,7 +133,7 @@ class HuffTree(object):
             huff.addHuffNode( 'A', 3, 0b101 )
 
         '''
-        node = self.root
+        node = self._getHuffRoot()
         for bit in bitvals(code,bits):
             step = node[1][bit]
             if step == None:
@@ -84,14 +145,33 @@ class HuffTree(object):
             raise OffHuffTree('Huffman node conflict')
         node[0] = sym
         
+        self._addHuffCode(sym, bits, code)
+
+    def _addHuffCode(self, sym, bits, code):
         if self.getCodeBySym(sym):
             raise OffHuffTree('Huffman sym conflict')
+
         self.codebysym[ sym ] = (bits,code)
+        self.codebook.append( (sym,bits,code) )
+        self.tables.clear()
+
+    def _getHuffRoot(self):
+        if self.root == None:
+            self.root = [None,[None,None]]
+            codebook = self.codebook
+            self.codebook = []
+            self.codebysym = {}
+            [ self.addHuffNode(s,b,c) for (s,b,c) in codebook ]
+
+        return self.root
 
     def loadCodeBook(self, codebook):
         '''
         Load a list of (sym,bits,code) tuples into the tree.
 
+        The lookup tables used by getHuffSym() are built once
+        ( per bit order ) on first use.
+
         Example:
 
             codebook = huff.initCodeBook( symbits )
@@ -99,7 +179,82 @@ class HuffTree(object):
             huff.loadCodeBook(codebook)
 
         '''
-        [ self.addHuffNode(s,b,c) for (s,b,c) in codebook ]
+        if self.root != None:
+            [ self.addHuffNode(s,b,c) for (s,b,c) in codebook ]
+            return
+
+        [ self._addHuffCode(s,b,c) for (s,b,c) in codebook ]
+
+    def getLookupTable(self, order='big'):
+        '''
+        Return a (tbits,table) tuple for decoding in the given bit order.
+
+        The primary table is indexed by the next tbits bits of the
+        stream and contains (sym,bits) tuples.  Codes longer than
+        tbits share a primary entry of (subtable,-subbits) which is
+        indexed by the subbits following the first tbits.
+
+        Example:
+
+            tbits,table = huff.getLookupTable('little')
+
+        '''
+        ret = self.tables.get(order)
+        if ret == None:
+            ret = self._initLookupTable(order)
+            self.tables[order] = ret
+        return ret
+
+    def _initLookupTable(self, order):
+
+        maxbits = 0
+        if self.codebook:
+            maxbits = max( [ b for (s,b,c) in self.codebook ] )
+
+        tbits = min(self.tablebits, maxbits)
+        table = [ None ] * (1 << tbits)
+
+        # group the long codes by their first tbits bits
+        longs = collections.defaultdict(list)
+        for sym,bits,code in self.codebook:
+
+            if bits <= tbits:
+                self._fillTable(table, tbits, sym, bits, code, order)
+                continue
+
+            xbits = bits - tbits
+            longs[ code >> xbits ].append( (sym, xbits, code & ((1 << xbits) - 1)) )
+
+        for pref,codes in longs.items():
+            subbits = max( [ x for (s,x,c) in codes ] )
+            subtab = [ None ] * (1 << subbits)
+
+            for sym,xbits,code in codes:
+                self._fillTable(subtab, subbits, sym, xbits, code, order)
+
+            idx = pref
+            if order == 'little':
+                idx = bitrev(pref, tbits)
+
+            table[idx] = (subtab, -subbits)
+
+        return tbits,table
+
+    def _fillTable(self, table, tbits, sym, bits, code, order):
+        ent = (sym,bits)
+        pad = tbits - bits
+
+        if order == 'little':
+            base = bitrev(code, bits)
+            idxs = [ base | (i << bits) for i in range(1 << pad) ]
+        else:
+            base = code << pad
+            idxs = [ base | i for i in range(1 << pad) ]
+
+        for idx in idxs:
+            if table[idx] != None:
+                raise OffHuffTree('Huffman node conflict')
+            table[idx] = ent
 
     def initCodeBook(self, symbits):
         '''
@@ -144,4 +299,3 @@ class HuffTree(object):
                 codebook.append( (sym,bits,code) )
         
         return codebook
-
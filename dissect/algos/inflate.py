@@ -2,6 +2,25 @@
 import dissect.bitlab as bitlab
 import dissect.algos.huffman as huff
 
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+#BTYPE specifies how the data are compressed, as follows:
+# 00 - no compression
+# 01 - compressed with fixed Huffman codes
+# 10 - compressed with dynamic Huffman codes
+# 11 - reserved (error)
+TYPE_UNCOMP  = 0x0
+TYPE_FIXED   = 0x1
+TYPE_DYNAMIC = 0x2
+TYPE_INVALID = 0x3
+
+# Inflate backends
+BACKEND_ZLIB   = 'zlib'     # raw deflate via zlib.decompressobj(-15)
+BACKEND_PYTHON = 'python'   # pure python ( supports bit level access )
+
 COPY_LEN      = 16
 REP_BIG_LEN   = 17
 REP_TINY_LEN  = 18
@@ -17,20 +36,214 @@ class InflateError(Exception):pass
 def cast(bits, num):
     return bits.cast(num, 'little')
 
+def getDefBackend():
+    '''
+    Return the preferred inflate backend for this python.
+    '''
+    if zlib != None:
+        return BACKEND_ZLIB
+    return BACKEND_PYTHON
+
 # Inflate RFC1951 Compliant Decompressor
 class Inflate(object):
+    '''
+    An RFC1951 raw deflate decompressor which maintains a history
+    window across calls to inflate().
+
+    By default, streams are decoded by zlib when it is available.
+    The pure python decoder ( backend='python' ) may be used when
+    zlib is missing or bit level access to the stream is needed.
 
-    def __init__(self):
+    Example:
+
+        inf = Inflate()
+        byts = inf.inflate( rawdeflate )
+
+    '''
+
+    def __init__(self, backend=None):
         self.fix_lits  = huff.HuffTree()
         self.fix_dists = huff.HuffTree()
-        self.buff = [] # History buffer
+
+        # History ring buffer and write cursor
+        self.hist = bytearray(MAX_HIST)
+        self.histpos = 0
+        self.histlen = 0
+
+        if backend == None:
+            backend = getDefBackend()
+
+        if backend == BACKEND_ZLIB and zlib == None:
+            raise InflateError('zlib inflate backend is not available')
+
+        if backend not in (BACKEND_ZLIB, BACKEND_PYTHON):
+            raise InflateError('Invalid inflate backend: %r' % (backend,))
+
+        self.backend = backend
+
+        self.decomps = {
+            TYPE_UNCOMP:self.getUncompBlock,
+            TYPE_FIXED:self.getFixHuffBlock,
+            TYPE_DYNAMIC:self.getDynHuffBlock,
+            TYPE_INVALID:self._invalidBlock
+        }
 
         self._initFixedTrees()
-    
-    def getFixHuffBlock(self, bits):
-        return self._decHuffBlock(bits, self.fix_lits, self.fix_dists)
+
+    def inflate(self, byts, maxsize=None):
+        '''
+        Decompress a complete raw deflate stream and return bytes.
+
+        The current history is used as the preset dictionary and the
+        decompressed bytes are added to it.  If maxsize is specified,
+        streams which decompress to more than maxsize bytes raise
+        InflateError.
+
+        Example:
+
+            inf = Inflate()
+            for byts in streams:
+                fd.write( inf.inflate(byts) )
+
+        '''
+        if self.backend == BACKEND_ZLIB:
+            return self._zlibInflate(byts, maxsize=maxsize)
+
+        bits = bitlab.BitReader(byts, order='little')
+        try:
+            return self.inflateBits(bits, maxsize=maxsize)
+        except bitlab.OffBitStream:
+            raise InflateError('Truncated deflate stream')
+
+    def inflateBits(self, bits, maxsize=None):
+        '''
+        Decompress deflate blocks from a bit source up to ( and
+        including ) the final block using the pure python decoder.
+
+        If maxsize is specified, InflateError is raised as soon as
+        the output grows past maxsize bytes ( checked per block and
+        per match so hostile streams cannot balloon in memory ).
+
+        Example:
+
+            bits = bitlab.BitReader(byts, order='little')
+            byts = inf.inflateBits(bits)
+            print('ended at bit: %d' % (bits.getOffset(),))
+
+        '''
+        out = bytearray()
+
+        final = 0
+        while not final:
+            final = cast(bits, 1)
+            btype = cast(bits, 2)
+
+            limit = None
+            if maxsize != None:
+                limit = maxsize - len(out)
+
+            out += self.decomps[btype](bits, maxsize=limit)
+
+        return bytes(out)
+
+    def getHistory(self):
+        '''
+        Return the ( up to 32k ) bytes of history as bytes.
+        '''
+        if self.histlen < MAX_HIST:
+            return bytes(self.hist[:self.histpos])
+
+        return bytes(self.hist[self.histpos:] + self.hist[:self.histpos])
+
+    def setHistory(self, byts):
+        '''
+        Replace the history with ( the last 32k of ) the given bytes.
+
+        Example:
+
+            hist = inf.getHistory()
+            # ...
+            inf.setHistory(hist)
+
+        '''
+        self.histpos = 0
+        self.histlen = 0
+        self._addHistory(byts[-MAX_HIST:])
+
+    def _addHistory(self, byts):
+        '''
+        Write bytes into the history ring buffer.
+        '''
+        size = len(byts)
+        if size >= MAX_HIST:
+            self.hist[:] = byts[-MAX_HIST:]
+            self.histpos = 0
+            self.histlen = MAX_HIST
+            return
+
+        pos = self.histpos
+        first = min(size, MAX_HIST - pos)
+
+        self.hist[pos:pos + first] = byts[:first]
+        if first < size:
+            self.hist[:size - first] = byts[first:]
+
+        self.histpos = (pos + size) % MAX_HIST
+        self.histlen = min(MAX_HIST, self.histlen + size)
+
+    def _zlibInflate(self, byts, maxsize=None):
+        hist = self.getHistory()
+
+        try:
+            if hist:
+                dobj = zlib.decompressobj(-15, zdict=hist)
+            else:
+                dobj = zlib.decompressobj(-15)
+
+            if maxsize == None:
+                out = dobj.decompress(byts)
+            else:
+                # one extra byte lets us detect an oversized stream
+                out = dobj.decompress(byts, maxsize + 1)
+
+        except zlib.error as e:
+            raise InflateError('Invalid deflate stream: %s' % (e,))
+
+        if maxsize != None and len(out) > maxsize:
+            raise InflateError('Deflate stream exceeds %d bytes' % (maxsize,))
+
+        if not dobj.eof:
+            raise InflateError('Truncated deflate stream')
+
+        self._addHistory(out)
+        return out
+
+    def _invalidBlock(self, bits, maxsize=None):
+        raise InflateError('Invalid block type')
+
+    def getUncompBlock(self, bits, maxsize=None):
+        '''
+        Read a stored ( BTYPE=00 ) block.
+        '''
+        # stored blocks begin at the next byte boundary
+        bits.align()
+        dlen = cast(bits, 16)
+        clen = cast(bits, 16)
+        if (dlen ^ 0xFFFF) != clen:
+            raise InflateError('Invalid uncompressed block length')
+
+        if maxsize != None and dlen > maxsize:
+            raise InflateError('Deflate stream exceeds size limit')
+
+        out = bits.readBytes(dlen)
+
+        self._addHistory(out)
+        return out
+
+    def getFixHuffBlock(self, bits, maxsize=None):
+        return self._decHuffBlock(bits, self.fix_lits, self.fix_dists, maxsize=maxsize)
         
-    def getDynHuffBlock(self, bits):
+    def getDynHuffBlock(self, bits, maxsize=None):
         '''
 
         The Huffman codes for the two alphabets appear in the block
@@ -73,8 +286,6 @@ class Inflate(object):
         book = len_tree.initCodeBook(lens)
         len_tree.loadCodeBook(book)
 
-        it = len_tree.iterHuffSyms(bits)
- 
         i = 0
         val = -1
         vlen = 0
@@ -83,7 +294,7 @@ class Inflate(object):
                 code_lens[i] = val 
                 vlen -= 1
             else:
-                sym = next(it)
+                sym = len_tree.getHuffSym(bits)
                 if sym < COPY_LEN:
                     code_lens[i] = sym
                     val = sym
@@ -113,12 +324,12 @@ class Inflate(object):
 
         if len(dist_len) != 1 or dist_len[0] != 0:
             if 0 == sum(x > 0 for x in dist_len) and dist_len.count(1) == 1:
-                raise DecompError('Unhandled code book irregularity')
+                raise InflateError('Unhandled code book irregularity')
             dist_tree = huff.HuffTree()
             book = dist_tree.initCodeBook(dist_len)
             dist_tree.loadCodeBook(book)
 
-        dec = self._decHuffBlock(bits, lit_tree, dist_tree)
+        dec = self._decHuffBlock(bits, lit_tree, dist_tree, maxsize=maxsize)
         return dec
 
     # Get the INFLATE match length for symbols 257–285 (3-258 bytes)
@@ -150,11 +361,39 @@ class Inflate(object):
             dist = ((s % 2 + 2) << xbits) + 1 + cast(bits, xbits)
         return dist
 
-    def _updateHistBuff(self):
+    def _copyMatch(self, out, dist, mlen):
         '''
-        Roll the history buffer so it remains at its maxium size.
+        Append mlen bytes from dist bytes back in the output ( which
+        may reach back into the history from previous blocks ).
         '''
-        self.buff = self.buff[-MAX_HIST:]
+        size = len(out)
+        if dist > size:
+
+            back = dist - size
+            if back > self.histlen:
+                raise InflateError('Invalid match distance')
+
+            # the start of the match comes from the history ring
+            take = min(back, mlen)
+            start = (self.histpos - back) % MAX_HIST
+            end = start + take
+
+            if end <= MAX_HIST:
+                out += self.hist[start:end]
+            else:
+                out += self.hist[start:]
+                out += self.hist[:end - MAX_HIST]
+
+            mlen -= take
+            size += take
+
+        start = size - dist
+
+        # overlapping matches repeat the pattern in growing chunks
+        while mlen:
+            chunk = min(mlen, len(out) - start)
+            out += out[start:start + chunk]
+            mlen -= chunk
 
     def _initFixedTrees(self):
         '''
@@ -194,39 +433,39 @@ class Inflate(object):
         dist_codes = self.fix_dists.initCodeBook(distbits)
         self.fix_dists.loadCodeBook(dist_codes)
 
-    def _decHuffBlock(self, bits, lit_tree, dist_tree):
+    def _decHuffBlock(self, bits, lit_tree, dist_tree, maxsize=None):
         '''
         Decompress the huffman block using the supplied ltieral and distance trees.
+
+        ( raises InflateError once the block grows past maxsize bytes )
         '''
-        out = []
+        out = bytearray()
         if not lit_tree:
             raise InflateError('Invalid literal code tree')
 
-        dit = dist_tree.iterHuffSyms(bits)
-        for sym in lit_tree.iterHuffSyms(bits):
-            # Its a literal symbol
-            if sym < END_BLOCK:
-                out.append(sym)
-                self.buff.append(sym)
-            # End of this block return back out
-            elif sym == END_BLOCK:
-                self._updateHistBuff()
-                return out
-            else:
-                # It needs a lookup
-                mlen = self._getMatchLen(sym, bits)
-                d = next(dit)
-                dist = self._getDist(d, bits)
-                
-                while mlen > dist:
-                    out += self.buff[-dist:]
-                    self.buff += self.buff[-dist:]
-                    mlen -= dist
-                if mlen == dist:
-                    out += self.buff[-dist:]
-                    self.buff += self.buff[-dist:]
+        try:
+            while True:
+                sym = lit_tree.getHuffSym(bits)
+                # Its a literal symbol
+                if sym < END_BLOCK:
+                    out.append(sym)
+                # End of this block return back out
+                elif sym == END_BLOCK:
+                    if maxsize != None and len(out) > maxsize:
+                        raise InflateError('Deflate stream exceeds size limit')
+                    self._addHistory(out)
+                    return bytes(out)
                 else:
-                    out += self.buff[-dist:mlen-dist]
-                    self.buff += self.buff[-dist:mlen-dist]
-        # Should never get here
+                    # It needs a lookup
+                    mlen = self._getMatchLen(sym, bits)
+                    d = dist_tree.getHuffSym(bits)
+                    dist = self._getDist(d, bits)
+
+                    self._copyMatch(out, dist, mlen)
+                    if maxsize != None and len(out) > maxsize:
+                        raise InflateError('Deflate stream exceeds size limit')
+
+        except bitlab.OffBitStream:
+            pass
+
         raise InflateError('Failed to find end of block sym')
@@ -1,5 +1,5 @@
 import sys
-import ctypes
+import struct
 import dissect.algos.huffman as huffman
 import dissect.bitlab as bitlab
 from dissect.compat import iterbytes
@@ -15,8 +15,41 @@ NUM_SECONDARY_LENGTHS = 249
 NUM_PRIMARY_LENGTHS   = 7
 MIN_MATCH             = 2
 
+CALL_BYTE             = b'\xe8'
+INTEL_SLACK           = 10
+
 class LzxError(Exception):pass
 
+def decIntelFrame(buf, curpos, filesize):
+    '''
+    Undo the E8 ( intel call ) translation of one frame in place.
+
+    buf is a bytearray holding the frame, curpos is the uncompressed
+    offset of the frame start and filesize is the translation size
+    from the LZX stream header.  The last 10 bytes are never translated.
+
+    Example:
+
+        buf = bytearray(frame)
+        decIntelFrame(buf, frameoff, ifs)
+
+    '''
+    end = len(buf) - INTEL_SLACK
+    idx = buf.find(CALL_BYTE, 0, end)
+    while idx != -1:
+        absoff = struct.unpack_from('<i', buf, idx + 1)[0]
+        pos = curpos + idx
+        if -pos <= absoff < filesize:
+            if absoff >= 0:
+                reloff = absoff - pos
+            else:
+                reloff = absoff + filesize
+            struct.pack_into('<I', buf, idx + 1, reloff & 0xffffffff)
+
+        idx = buf.find(CALL_BYTE, idx + 5, end)
+
+    return buf
+
 class LzxHuffTree(huffman.HuffTree):
     '''
     Extended Huffman Tree object with LZX specific methods
@@ -68,10 +101,9 @@ class LzxHuffTree(huffman.HuffTree):
         book = ptree.initCodeBook(tlens)
         ptree.loadCodeBook(book)
 
-        it = ptree.iterHuffSyms(bits)
         i = start
         while i < stop:
-            sym = next(it)
+            sym = ptree.getHuffSym(bits)
             if sym == 17:
                run = self.cast(bits, 4) + 4
                self.lens[i:i+run] = [0]*run 
@@ -80,7 +112,7 @@ class LzxHuffTree(huffman.HuffTree):
                self.lens[i:i+run] = [0]*run 
             elif sym == 19:
                run = self.cast(bits, 1) + 4
-               nsym = next(it)
+               nsym = ptree.getHuffSym(bits)
                sym = self.lens[i] - nsym
                if sym < 0:
                    sym += 17
@@ -96,10 +128,20 @@ class LzxHuffTree(huffman.HuffTree):
 class Lzx(LzxHuffTree):
     '''
     LZX Decompressor
+
+    Frames are yielded as bytes.  If debug is True, the raw ( pre E8
+    translation ) output is also accumulated in self.dbgbytes.
+
+    Example:
+
+        lzxd = Lzx(comp_type)
+        for byts in lzxd.decompBlock( cfdatas ):
+            fd.write(byts)
+
     '''
-    def __init__(self, comp_type):
-        self.debug = []
-        self.test  = False
+    def __init__(self, comp_type, debug=False):
+        self.debug = debug
+        self.dbgbytes = bytearray()
         LzxHuffTree.__init__(self)
         self.wbits = (comp_type >> 8) & 0x1f 
         self.wsize = 1 << self.wbits
@@ -107,7 +149,6 @@ class Lzx(LzxHuffTree):
         self.frmcnt = 0
         self.ifs  = 0
         self.winpos = 0
-        self.intelbuf = [0] * LZX_FRAME_SIZE
         self.icp = 0
         self.atree = LzxHuffTree() 
         self.mtree = LzxHuffTree()
@@ -139,7 +180,13 @@ class Lzx(LzxHuffTree):
         self.offs = LzxHuffTree.slots[self.wbits - 15] << 3 
         self.ival = 0
         self.r0, self.r1, self.r2 = 1,1,1
-        self.run_num = 0
+
+        self.btype = BTYPE_INVALID
+        self.blen = 0
+        self.blkremain = 0
+        self.bitbase = None
+        self.bitskip = 0
+        self.bitoff = 0
 
     def getBlockLen(self, bits):
         '''
@@ -153,31 +200,35 @@ class Lzx(LzxHuffTree):
         '''
         Initialize parser to process an verbatim LZX block from a bitstream object
         '''
-        self.mtree.clear()
-        self.ltree.clear()
         # Create the main tree
         self.mtree.updateLengths(bits, 0, NUM_CHARS)
         self.mtree.updateLengths(bits, NUM_CHARS, NUM_CHARS + self.offs)
-        mlens = self.mtree.getLens() 
-        book = self.mtree.initCodeBook(mlens)
-        self.mtree.loadCodeBook(book)
+        self._loadTree(self.mtree)
         
-        # Check for preprocessing
-        self.ival = mlens[INSTR_CALL]
+        # Check for preprocessing ( once started, it stays on )
+        if self.mtree.lens[INSTR_CALL]:
+            self.ival = 1
         
         # Get the length tree
         self.ltree.updateLengths(bits, 0, NUM_SECONDARY_LENGTHS)
-        llens = self.ltree.getLens()
-        book = self.ltree.initCodeBook(llens)
-        self.ltree.loadCodeBook(book)
+        self._loadTree(self.ltree)
 
     def _initAlign(self, bits):
-        self.atree.clear()
-        lens = [self.cast(bits, 3) for i in range(8)]
-        book = self.atree.initCodeBook(lens)
-        self.atree.loadCodeBook(book)
+        self.atree.lens[:8] = [self.cast(bits, 3) for i in range(8)]
+        self._loadTree(self.atree, 8)
         self._initVerb(bits)
 
+    def _loadTree(self, tree, nsyms=None):
+        '''
+        Rebuild the codebook of a tree from its length array
+        '''
+        lens = tree.getLens()
+        if nsyms != None:
+            lens = lens[:nsyms]
+
+        tree.clear()
+        tree.loadCodeBook( tree.initCodeBook(lens) )
+
     def _initUncomp(self, bits):
         '''
         Initialize parser to process an uncompressed LZX block from a bitstream object
@@ -203,6 +254,9 @@ class Lzx(LzxHuffTree):
         Read bytes from a bitstream object and byte flip. The byte flip is 
         necessary because LZX words are stored as big endian
         '''
+        if isinstance(bits, bitlab.BitReader):
+            return bits.readBytes(cnt)
+
         out = []
         i = 0
 
@@ -213,29 +267,23 @@ class Lzx(LzxHuffTree):
 
         return out
 
-    def decAligned(self, bits, blen):
+    def decAligned(self, bits, need):
         '''
-        Decompress and yield LZX align frame from a bitstream object
+        Decompress at least need bytes of an LZX aligned block from a
+        bitstream object into the window and return the count.
         '''
-        run = 0
-        remains = blen
-        mit = self.mtree.iterHuffSyms(bits)
-        lit = self.ltree.iterHuffSyms(bits)
-        ait = self.atree.iterHuffSyms(bits)
-
-        # Max bytes for this run
-        maxrun = self._getFrameAlign(bits)
-
-        for sym in mit:
+        start = self.winpos
+        end = start + need
+        while self.winpos < end:
+            sym = self.mtree.getHuffSym(bits)
             if sym < NUM_CHARS:
                 self._winAppend(sym)
-                run += 1
             else:
                 sym -= NUM_CHARS
                 # Get the match len
                 mlen = sym & NUM_PRIMARY_LENGTHS
                 if mlen == NUM_PRIMARY_LENGTHS:
-                    mlen += next(lit) 
+                    mlen += self.ltree.getHuffSym(bits) 
             
                 mlen += MIN_MATCH
                 # Get the match offset
@@ -247,9 +295,9 @@ class Lzx(LzxHuffTree):
                         ext -= 3
                         vbits = self.cast(bits, ext)
                         moff += (vbits << 3)
-                        moff += next(ait)
+                        moff += self.atree.getHuffSym(bits)
                     elif ext == 3:
-                        moff += next(ait)
+                        moff += self.atree.getHuffSym(bits)
                     elif ext > 0:
                         vbits = self.cast(bits, ext)
                         moff += vbits
@@ -277,49 +325,31 @@ class Lzx(LzxHuffTree):
                         rep = self._getAbsView(mach, rem)
                         self._setWinView(0, rep)
                         self.winpos += rem
-                        run += rem
                         mach = 0 
                     rep = self._getAbsView(mach, mlen)
                     self._setWinView(0, rep)
                     self.winpos += mlen
-                    run += mlen
                 else:
-                    [ self._winAppend(self.win[self.winpos-moff]) for i in range(mlen) ]
-                    run += mlen
-
-            if self.winpos % LZX_FRAME_SIZE == 0:
-                self.alignWord(bits)
-            if run >= remains:
-                yield self._getWinView(-run, run)
-                raise StopIteration
-
-            if run >= maxrun:
-                maxrun = LZX_FRAME_SIZE
-                yield self._getWinView(-run, run)
-                remains -= run
-                run = 0
+                    self._winCopy(moff, mlen)
+
+        return self.winpos - start
         
-    def decVerbatim(self, bits, blen):
-        '''
-        Decompress and yield LZX verbatim frame from a bitstream object
-        '''
-        remains = blen
-        run = 0
-        lit = self.ltree.iterHuffSyms(bits)
-        mit = self.mtree.iterHuffSyms(bits)
-       
-        # Max bytes for this run 
-        maxrun = self._getFrameAlign(bits) 
-        for sym in mit:
-            
+    def decVerbatim(self, bits, need):
+        '''
+        Decompress at least need bytes of an LZX verbatim block from a
+        bitstream object into the window and return the count.
+        '''
+        start = self.winpos
+        end = start + need
+        while self.winpos < end:
+            sym = self.mtree.getHuffSym(bits)
             if sym < NUM_CHARS:
                 self._winAppend(sym)
-                run += 1
             else:
                 sym -= NUM_CHARS
                 mlen = sym & NUM_PRIMARY_LENGTHS
                 if mlen == NUM_PRIMARY_LENGTHS:
-                    mlen += next(lit)
+                    mlen += self.ltree.getHuffSym(bits)
                 
                 mlen += MIN_MATCH
             
@@ -356,32 +386,33 @@ class Lzx(LzxHuffTree):
                         rep = self._getAbsView(mach, rem)
                         self._setWinView(0, rep)
                         self.winpos += rem
-                        run += rem
                         mach = 0 
                     rep = self._getAbsView(mach, mlen)
                     self._setWinView(0, rep)
                     self.winpos += mlen
-                    run += mlen
                 else:
-                    [ self._winAppend(self.win[self.winpos-moff]) for i in range(mlen) ]
-                    run += mlen
+                    self._winCopy(moff, mlen)
             
-            if self.winpos % LZX_FRAME_SIZE == 0:
-                self.alignWord(bits)
-            if run >= remains:
-                yield self._getWinView(-run, run)
-                raise StopIteration
-
-            if run >= maxrun:
-                maxrun = LZX_FRAME_SIZE
-                yield self._getWinView(-run, run)
-                remains -= run
-                run = 0
+        return self.winpos - start
     
     def _winAppend(self, item):
         self.win[self.winpos] = item
         self.winpos += 1
 
+    def _winCopy(self, moff, mlen):
+        '''
+        Copy a match from moff bytes back in the window.  Overlapping
+        matches repeat the pattern, so copy in doubling chunks.
+        '''
+        src = self.winpos - moff
+        pos = self.winpos
+        end = pos + mlen
+        while pos < end:
+            size = min(end - pos, pos - src)
+            self.win[pos:pos + size] = self.win[src:src + size]
+            pos += size
+        self.winpos = end
+
     def _getAbsView(self, offset, nbytes):
         return self.win[offset : offset + nbytes]
 
@@ -389,39 +420,20 @@ class Lzx(LzxHuffTree):
         self.win[offset : offset + len(data)] = data
 
     def _getWinView(self, offset, nbytes):
-        return self.win[self.winpos + offset : self.winpos + offset + nbytes].tolist()
+        return self.win[self.winpos + offset : self.winpos + offset + nbytes]
 
     def _setWinView(self, offset, data):
         self.win[self.winpos + offset : self.winpos + offset + len(data)] = data
 
-    def decUncomp(self, bits, blen):
+    def decUncomp(self, bits, need):
         '''
-        Decodes and yields an uncompressed LZX frame
+        Copy need bytes of an uncompressed LZX block into the window
+        and return the count.
         '''
-        remains = blen
-        while remains:
-            # Get the bytes left in this frame
-            align = self._getFrameAlign(bits) 
-            # Is the window currently frame aligned?
-            if align == 0:
-                need = LZX_FRAME_SIZE
-            else:
-                need = align
-            
-            if need > remains:
-                need = remains
-
-            byts = self.readBytes(bits, need)
-            [self._winAppend(b) for b in byts]
-            yield byts
-            remains -= need
-
-    def _getFrameAlign(self, bits):
-        '''
-        Get the number of bytes needed to make the window aligned
-        on a frame boundary (32768 bytes)
-        '''
-        return LZX_FRAME_SIZE - (self.winpos % LZX_FRAME_SIZE)
+        byts = self.readBytes(bits, need)
+        self._setWinView(0, byts)
+        self.winpos += need
+        return need
 
     def alignWord(self, bits):
         '''
@@ -452,109 +464,178 @@ class Lzx(LzxHuffTree):
         blen  = self.getBlockLen(bits)
         return btype,blen
 
-    def _decIntel(self, fsize):
+    def _decIntel(self, fstart, fsize):
        '''
-       Decode intel preprocessing if necessary
+       Return the frame at fstart in the window with the intel
+       preprocessing decoded if necessary
        '''
-       self.debug += self._getWinView(-fsize, fsize)
-       if not self.ival or not self.ifs or self.frmcnt > LZX_FRAME_SIZE and fsize <= 10:
-           if self.ifs:
-               self.icp += fsize
-           return self._getWinView(-fsize, fsize)
-
-       curpos = ctypes.c_int(self.icp).value
-       ibuf =  self._getWinView(-fsize, fsize)
-
-       # Find all occurances of a 'call' byte
-       indices = [i for i, b in enumerate(ibuf) if b == INSTR_CALL]
-       if not len(indices):
-           self.icp += fsize
-           return self._getWinView(-fsize, fsize)
-
-       # Validate the markers
-       markers = [indices[0]]
-       for l in indices:
-            if l - markers[-1] >= 5 and l < (len(ibuf)-10):
-                markers.append(l)
-
-       for i, idx in enumerate(markers):
-
-            if i == 0:
-                curpos += idx
-            else:
-                curpos += (idx - markers[i-1]) 
+       view = self._getAbsView(fstart, fsize)
+       if self.debug:
+           self.dbgbytes += view
 
-            idx += 1
+       self.icp += fsize
+       if not self.ival or not self.ifs or self.frmcnt > LZX_FRAME_SIZE or fsize <= INTEL_SLACK:
+           return bytes(view)
 
-            absoff = ctypes.c_int((ibuf[idx] | (ibuf[idx+1]<<8) | 
-                                  (ibuf[idx+2]<<16) | (ibuf[idx+3]<<24) ))
-            absoff = absoff.value
-            prev = absoff
-            if absoff >= -(0xFFFFFFFF & curpos) and absoff < self.ifs:
-                if absoff >= 0:
-                    reloff = absoff - curpos 
-                else:
-                    reloff = absoff + self.ifs
+       # translate a copy; the window must keep the raw bytes for matches
+       ibuf = bytearray(view)
+       decIntelFrame(ibuf, self.icp - fsize, self.ifs)
+       return bytes(ibuf)
 
-                ibuf[idx]   = (0xFF & reloff)
-                ibuf[idx+1] = (0xFF & (reloff >> 8))
-                ibuf[idx+2] = (0xFF & (reloff >> 16))
-                ibuf[idx+3] = (0xFF & (reloff >> 24))
-    
-       self.icp += fsize
-       return ibuf
+    def decompBlock(self, iterblk, rawcb=None):
+        '''
+        Decompress and yield uncompressed byte blocks via a CFDATA iterator
 
-    def _postProcess(self, frame):
-       
-        # Check if this is the final frame
-        if len(frame) >= self.rawcb:
-            fsize = len(frame)
-        else:
-            fsize = LZX_FRAME_SIZE
+        If rawcb ( the total uncompressed size ) is not specified, the
+        CFDATA blocks are all read up front to compute it.
+        '''
+        if rawcb == None:
+            blocks = [b for b in iterblk]
+            rawcb = sum([cf.cbUncomp for cf in blocks])
+            iterblk = blocks
 
-        fix = self._decIntel(fsize)
-        return fix
+        return self.decompFrames( ( cf.ab for cf in iterblk ), rawcb )
 
-    # TODO currently expects an iterator of CFDATA objects
-    def decompBlock(self, iterblk):
+    def decompFrames(self, frames, rawcb):
         '''
-        Decompress and yield uncompressed byte blocks via a CFDATA iterator
+        Decompress and yield uncompressed frames from an iterator of
+        raw CFDATA payloads.  Payloads are consumed as they are needed.
+
+        When resuming from a setState() snapshot, frames must begin at
+        the compressed byte offset returned by getStateOffset() and
+        rawcb is the number of uncompressed bytes remaining.
+
+        Example:
+
+            frames = ( cab.readAtOff(off, cb) for off,cb,ucb in hdrs )
+            for byts in lzxd.decompFrames(frames, rawcb):
+                dostuff(byts)
+
         '''
-        blen   = 0
-        btype  = 0
-        out    = []
-        # Parse out the blocks
-        blocks = [b for b in iterblk]
-        # Get the total amount of uncompressed
-        self.rawcb = sum([cf.cbUncomp for cf in blocks])
-
-        bits = bitlab.BitStream(blocks, order='big', cb=self.getWordBytes)
-        # Read Intel Header
-        self.ifs = self.getIntelHeader(bits)
+        self.rawcb = rawcb
+
+        bits = bitlab.BitReader(frames, order='big', wordswap=True)
+        if self.bitbase == None:
+            # Read Intel Header
+            self.bitbase = 0
+            self.ifs = self.getIntelHeader(bits)
+        else:
+            bits.skip(self.bitskip)
+
         while self.rawcb:
-            # If the previous block was uncompressed and misaligned (16-bit) 
-            # realign now
-            if btype == BTYPE_UNCOMPRESSED and (blen & 1):
-                self.readBytes(bits, 1)
-           
-            btype,blen = self.getBlockHeader(bits)
-            self.decomps[btype][0](bits)
-            run = blen
-            for frame in self.decomps[btype][1](bits, blen):
-
-                out += frame
-                if len(out) == LZX_FRAME_SIZE or len(frame) == self.rawcb:
-                    self.frmcnt += 1
-                    fdata = self._postProcess(out)
-                    yield bytes(fdata)
-                    out = []
-               
-                if self.winpos >= self.wsize:
-                    self.winpos = 0
-
-                run -= len(frame)
-                self.rawcb -= len(frame)
-                if run == 0:
-                    break
+            yield self.decompFrame(bits)
+
+    def decompFrame(self, bits):
+        '''
+        Decompress and return the next frame from a bitstream object.
+        '''
+        # a match may have run over from the previous frame
+        fstart = self.winpos - (self.winpos % LZX_FRAME_SIZE)
+        fsize = min(LZX_FRAME_SIZE, self.rawcb)
+        fend = fstart + fsize
+
+        while self.winpos < fend:
+            if not self.blkremain:
+                # If the previous block was uncompressed and misaligned (16-bit) 
+                # realign now
+                if self.btype == BTYPE_UNCOMPRESSED and (self.blen & 1):
+                    self.readBytes(bits, 1)
 
+                self.btype,self.blen = self.getBlockHeader(bits)
+                if self.btype not in self.decomps:
+                    raise LzxError('Invalid block type: %d' % (self.btype,))
 
+                self.decomps[self.btype][0](bits)
+                self.blkremain = self.blen
+
+            need = min(fend - self.winpos, self.blkremain)
+            self.blkremain -= self.decomps[self.btype][1](bits, need)
+            if self.blkremain < 0:
+                raise LzxError('Match overruns block')
+
+        if self.btype != BTYPE_UNCOMPRESSED:
+            self.alignWord(bits)
+
+        self.frmcnt += 1
+        self.rawcb -= fsize
+        byts = self._decIntel(fstart, fsize)
+
+        if self.winpos >= self.wsize:
+            self.winpos -= self.wsize
+
+        self.bitoff = self.bitbase + bits.getOffset()
+        return byts
+
+    def getState(self):
+        '''
+        Return a snapshot of the decoder state at the current frame
+        boundary which may be restored with setState().
+
+        Example:
+
+            for byts in lzxd.decompFrames(frames, rawcb):
+                state = lzxd.getState()
+
+        '''
+        return {
+            'win':bytes( self.win[ :min(self.icp, self.wsize) ] ),
+            'winpos':self.winpos,
+            'bitoff':self.bitoff,
+            'r':(self.r0, self.r1, self.r2),
+            'ifs':self.ifs,
+            'ival':self.ival,
+            'icp':self.icp,
+            'frmcnt':self.frmcnt,
+            'btype':self.btype,
+            'blen':self.blen,
+            'blkremain':self.blkremain,
+            'mlens':tuple(self.mtree.lens),
+            'llens':tuple(self.ltree.lens),
+            'alens':tuple(self.atree.lens[:8]),
+        }
+
+    def setState(self, state):
+        '''
+        Restore a decoder state from getState() to resume decoding.
+
+        Example:
+
+            lzxd = Lzx(comp_type)
+            lzxd.setState(state)
+
+            frames = iterFramesAt( lzxd.getStateOffset(state) )
+            for byts in lzxd.decompFrames(frames, rawcb):
+                dostuff(byts)
+
+        '''
+        win = state['win']
+        self.win[:len(win)] = win
+        self.winpos = state['winpos']
+        self.r0, self.r1, self.r2 = state['r']
+        self.ifs = state['ifs']
+        self.ival = state['ival']
+        self.icp = state['icp']
+        self.frmcnt = state['frmcnt']
+        self.btype = state['btype']
+        self.blen = state['blen']
+        self.blkremain = state['blkremain']
+        self.mtree.lens[:] = state['mlens']
+        self.ltree.lens[:] = state['llens']
+        self.atree.lens[:8] = state['alens']
+
+        # resume from the word before the saved bit offset
+        self.bitoff = state['bitoff']
+        self.bitskip = self.bitoff % 16
+        self.bitbase = self.bitoff - self.bitskip
+
+        if self.blkremain and self.btype != BTYPE_UNCOMPRESSED:
+            self._loadTree(self.mtree)
+            self._loadTree(self.ltree)
+            if self.btype == BTYPE_ALIGNED:
+                self._loadTree(self.atree, 8)
+
+    def getStateOffset(self, state):
+        '''
+        Return the compressed byte offset a getState() snapshot resumes from.
+        '''
+        return (state['bitoff'] // 16) * 2
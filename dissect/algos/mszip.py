@@ -1,67 +1,84 @@
 import dissect.bitlab as bitlab
 import dissect.algos.inflate as inflate
 
-#BTYPE specifies how the data are compressed, as follows:
-# 00 - no compression
-# 01 - compressed with fixed Huffman codes
-# 10 - compressed with dynamic Huffman codes
-# 11 - reserved (error)
-TYPE_UNCOMP  = 0x0
-TYPE_FIXED   = 0x1
-TYPE_DYNAMIC = 0x2
-TYPE_INVALID = 0x3
+from dissect.algos.inflate import TYPE_UNCOMP, TYPE_FIXED, TYPE_DYNAMIC, TYPE_INVALID
+
+MSZIP_MAGIC     = b'CK'
+MSZIP_FRAME_MAX = 32768     # max uncompressed bytes per frame
 
 class MsZipError(Exception):pass
 
 class MsZip(inflate.Inflate):
+    '''
+    MSZIP decompressor.
+
+    Each MSZIP frame is a "CK" signature followed by a raw deflate
+    stream which may reference the previous 32k of output.
 
-    def __init__(self):
-        inflate.Inflate.__init__(self)
+    Example:
 
-        self.decomps = {
-            TYPE_UNCOMP:self._getUncompBlock,
-            TYPE_FIXED:self._deCompFixedHuffman,
-            TYPE_DYNAMIC:self._deCompDynHuffman,
-            TYPE_INVALID:self._invalidBlock
-        }
+        mszipd = MsZip()
+        for byts in mszipd.decompFrames( frames ):
+            fd.write(byts)
+
+    '''
+    def __init__(self, backend=None):
+        inflate.Inflate.__init__(self, backend=backend)
 
     def cast(self, bits, num):
         return bits.cast(num,'little')
 
-    #TODO: expects a CFDATA iterator
     def decompBlock(self, iterblk):
+        '''
+        Decompress and yield uncompressed byte blocks via a CFDATA iterator
+        '''
+        return self.decompFrames( cfd.ab for cfd in iterblk )
+
+    def decompFrames(self, frames):
+        '''
+        Decompress and yield bytes for each raw MSZIP frame buffer.
+
+        The 32k dictionary is carried from frame to frame and only
+        one frame of output is held at a time.
+
+        Example:
+
+            frames = ( cfd.ab for cfd in cfdatas )
+            for byts in mszipd.decompFrames(frames):
+                dostuff(byts)
 
-        for frame in iterblk:
-            byts = frame.ab
-            if not byts.startswith(b'CK'):
-                raise MsZipError('Invalid MsZip Block: %r' % (byts[:8],))
+        '''
+        for byts in frames:
+            yield self.decompFrame(byts)
 
-            bits = bitlab.BitStream(byts[2:], order='little')
+    def decompFrame(self, byts):
+        '''
+        Decompress a single raw MSZIP frame ( including the signature ).
+        '''
+        view = memoryview(byts)
+        if view[:2] != MSZIP_MAGIC:
+            raise MsZipError('Invalid MsZip Block: %r' % (bytes(view[:8]),))
 
-            final = 0
-            msblock = []
-            while not final:
-                final = self.cast(bits, 1)
-                bt = self.cast(bits, 2)
-                msblock.extend(self.decomps[bt](bits, byts))
-            yield bytes(msblock)
+        try:
+            return self.inflate(view[2:], maxsize=MSZIP_FRAME_MAX)
+        except inflate.InflateError as e:
+            raise MsZipError('Invalid MsZip Block: %s' % (e,))
 
-    def _invalidBlock(self, bits, byts=None):
-        raise MsZipError('Invalid block type')
+    def getDictionary(self):
+        '''
+        Return the ( up to 32k ) dictionary for the next frame.
+        '''
+        return self.getHistory()
 
-    def _deCompDynHuffman(self, bits, byts=None):
-        return self.getDynHuffBlock(bits)
+    def setDictionary(self, byts):
+        '''
+        Set the dictionary for the next frame ( to resume a folder ).
 
-    def _deCompFixedHuffman(self, bits, byts=None):
-        return self.getFixHuffBlock(bits)
+        Example:
 
-    def _getUncompBlock(self, bits, byts):
-        # TODO Assuming we are at index 3 here
-        self.cast(bits, 5)
-        dlen = self.cast(bits, 16)
-        clen = self.cast(bits, 16)
-        out = []
-        if (dlen ^ 0xFFFF) != clen:
-            raise DeflateError('Invalid uncompressed block length')
+            mszipd = MsZip()
+            mszipd.setDictionary( lastbytes )
+            byts = mszipd.decompFrame( frame )
 
-        return byts[ 5 : 5 + dlen]
\ No newline at end of file
+        '''
+        self.setHistory(byts)
@@ -3,7 +3,9 @@ A special FileLab extension to facilitate parsing and
 normalization of binary executable constructs.
 '''
 
-from dissect.common import KeyCache
+import heapq
+import bisect
+
 from dissect.filelab import FileLab
 
 
@@ -16,23 +18,79 @@ class BexLab(FileLab):
     - Memory maps
     bex:mem:maps = [ (rva,info), ... ]
 
-    #bex:relocs = [ (rva,info), ... ]
-    #bex:imports = [ (rva,info), ... ]
-    #bex:exports = [ (rva,info), ... ]
+    bex:relocs = [ (rva,type), ... ]
+    bex:imports = [ (rva,{'lib':<name>,'name':<name>,'ord':<ord>}), ... ]
+    bex:exports = [ (rva,{'name':<name>,'ord':<ord>}), ... ]
     '''
     def __init__(self, fd, off=0):
         FileLab.__init__(self, fd, off=off)
-        self._bex_rva2off = KeyCache( self._rvaToOff )
+        self.add('bex:mem:index', self._getMemIndex )
 
     def rvaToOff(self, rva):
         '''
         Translate a relative virtual address to a file offset.
         '''
-        return self._bex_rva2off[rva]
+        starts,ends,deltas = self.get('bex:mem:index')
+
+        i = bisect.bisect_right(starts, rva) - 1
+        if i < 0 or deltas[i] == None:
+            return None
+
+        return rva + deltas[i]
+
+    def rvasToOffs(self, rvas):
+        '''
+        Translate many relative virtual addresses to file offsets.
+
+        Returns a list of offsets ( None for unmapped rvas ) in the
+        same order as rvas.
+
+        Example:
+
+            for off in lab.rvasToOffs( thunkrvas ):
+                if off != None:
+                    dostuff(off)
+
+        '''
+        starts,ends,deltas = self.get('bex:mem:index')
+        bisect_right = bisect.bisect_right
+
+        # the current segment ( nearby rvas usually share one )
+        lo = hi = 0
+        delta = None
+
+        offs = []
+        for rva in rvas:
+
+            if rva < lo or rva >= hi:
+                i = bisect_right(starts, rva) - 1
+                if i < 0:
+                    offs.append(None)
+                    continue
+
+                lo = starts[i]
+                hi = ends[i]
+                delta = deltas[i]
+
+            if delta == None:
+                offs.append(None)
+                continue
 
-    def _rvaToOff(self, rva):
+            offs.append(rva + delta)
 
-        # use the genericized bex memory maps
+        return offs
+
+    def invalidate(self, name=None):
+        FileLab.invalidate(self, name)
+        # the rva index is derived from the memory maps
+        if name == 'bex:mem:maps':
+            FileLab.invalidate(self, 'bex:mem:index')
+
+    def _getMemIndex(self):
+        # compile bex:mem:maps into sorted, non-overlapping segments
+        # which cover the whole rva space ( delta None where unmapped ).
+        # where maps overlap, the first map in the list wins.
+        maps = []
         for memrva,meminfo in self.get('bex:mem:maps'):
 
             off = meminfo.get('off')
@@ -41,6 +99,54 @@ class BexLab(FileLab):
                 continue
 
             size = meminfo.get('size')
-            memmax = memrva + size
-            if rva >= memrva and rva < memmax:
-                return off + (rva - memrva)
+            if not size or size < 0:
+                continue
+
+            maps.append( (memrva, memrva + size, off - memrva) )
+
+        bounds = set([0])
+        for memrva,memmax,delta in maps:
+            bounds.add(memrva)
+            bounds.add(memmax)
+
+        bounds = sorted(bounds)
+        bounds.append( max( bounds[-1] + 1, 1 << 64 ) )
+
+        # sweep the bounds in order, keeping a heap of the active maps
+        # keyed by list position ( expired maps are dropped lazily once
+        # they reach the top ) so each segment is resolved in O(log n).
+        todo = sorted( (memrva,i) for i,(memrva,memmax,delta) in enumerate(maps) )
+        todoidx = 0
+        active = []
+
+        starts = []
+        ends = []
+        deltas = []
+
+        for i in range(len(bounds) - 1):
+            lo = bounds[i]
+            hi = bounds[i + 1]
+
+            while todoidx < len(todo) and todo[todoidx][0] <= lo:
+                mapidx = todo[todoidx][1]
+                memrva,memmax,mdelta = maps[mapidx]
+                heapq.heappush(active, (mapidx, memmax, mdelta))
+                todoidx += 1
+
+            while active and active[0][1] <= lo:
+                heapq.heappop(active)
+
+            delta = None
+            if active:
+                delta = active[0][2]
+
+            # merge with the previous segment if contiguous
+            if deltas and deltas[-1] == delta:
+                ends[-1] = hi
+                continue
+
+            starts.append(lo)
+            ends.append(hi)
+            deltas.append(delta)
+
+        return starts,ends,deltas
@@ -3,6 +3,8 @@ from dissect.compat import iterbytes
 LSB = (0,1,2,3,4,5,6,7)
 MSB = (7,6,5,4,3,2,1,0)
 
+class OffBitStream(Exception):pass
+
 def bits(byts, order='big', cb=iterbytes):
     '''
     Yield generator for bits within bytes.
@@ -41,7 +43,13 @@ def cast(bitgen,bitsize,bord='big'):
 class BitStream(object):
     def __init__(self, byts, order='big', cb=iterbytes):
         self.bitoff = 0
-        self.bits = self.getBitGen(byts, order, cb)
+        self.order = order
+        self.byts = cb(byts)
+        self.bits = self._iterBits()
+
+        # bits read from the byte source but not yet consumed
+        self.bitval = 0
+        self.bitcnt = 0
 
     def getBitGen(self, byts, order='big', cb=iterbytes):
         bord = LSB
@@ -59,9 +67,74 @@ class BitStream(object):
     def __iter__(self):
         return self.bits
 
+    def _iterBits(self):
+        while self._fill(1):
+            yield self._take(1)
+
+    def _fill(self, bitsize):
+        # pull whole bytes from the source until we have bitsize bits
+        while self.bitcnt < bitsize:
+            byte = next(self.byts, None)
+            if byte == None:
+                return False
+
+            if self.order == 'big':
+                self.bitval = (self.bitval << 8) | byte
+            else:
+                self.bitval |= byte << self.bitcnt
+
+            self.bitcnt += 8
+
+        return True
+
+    def _take(self, bitsize):
+        # consume bitsize bits ( which must be present ) in stream order
+        self.bitoff += bitsize
+        self.bitcnt -= bitsize
+
+        if self.order == 'big':
+            ret = self.bitval >> self.bitcnt
+            self.bitval &= (1 << self.bitcnt) - 1
+            return ret
+
+        ret = self.bitval & ((1 << bitsize) - 1)
+        self.bitval >>= bitsize
+        return ret
+
     def getOffset(self):
         return self.bitoff
 
+    def peek(self, bitsize):
+        '''
+        Return the next "bitsize" bits as an int without consuming them.
+
+        Bits are assembled in the stream order ( first bit is the LSB
+        for 'little' streams and the MSB for 'big' streams ) and the
+        value is zero padded if the stream runs out.
+
+        Example:
+
+            valu = bits.peek(9)
+        '''
+        self._fill(bitsize)
+
+        if self.order == 'big':
+            shft = self.bitcnt - bitsize
+            if shft < 0:
+                return self.bitval << -shft
+            return self.bitval >> shft
+
+        return self.bitval & ((1 << bitsize) - 1)
+
+    def skip(self, bitsize):
+        '''
+        Consume and discard the next "bitsize" bits.
+        '''
+        if not self._fill(bitsize):
+            raise OffBitStream('BitStream exhausted')
+
+        self._take(bitsize)
+
     def cast(self, bitsize, bord='big'):
         '''
         Consume a "bitsize" integer from a bit generator.
@@ -71,15 +144,269 @@ class BitStream(object):
             # cast the next 5 bits as an int
             valu = cast(bits,5)
         '''
+        if not self._fill(bitsize):
+            raise OffBitStream('BitStream exhausted')
+
+        ret = self._take(bitsize)
+
+        # stream order matches the requested order
+        if (bord == 'big') == (self.order == 'big'):
+            return ret
+
+        rev = 0
+        for i in range(bitsize):
+            rev = (rev << 1) | ((ret >> i) & 0x1)
+        return rev
+
+class BitReader(object):
+    '''
+    A buffered bit reader over bytes or an iterable of byte chunks.
+
+    Bits are pulled into an integer accumulator several bytes at a
+    time and may be consumed in either LSB ( order='little' ) or
+    MSB ( order='big' ) order.  The wordswap option reads MSB first
+    bits from 16 bit little endian words ( as used by LZX ).
+
+    A BitReader may be used anywhere a BitStream is accepted.
+
+    Example:
+
+        bits = BitReader(byts, order='little')
+
+        btype = bits.read(3)
+        if bits.peek(9) == 0x1ff:
+            bits.skip(9)
+
+        bits.align()
+        raw = bits.readBytes(20)
+
+    Notes:
+
+        * for chunked input with wordswap, odd sized chunks are
+          joined with the next chunk so words never straddle them
+
+    '''
+    def __init__(self, byts, order='big', wordswap=False):
+        self.order = order
+        self.wordswap = wordswap
+
+        self.chunks = None
+        if not isinstance(byts, (bytes, bytearray, memoryview)):
+            self.chunks = iter(byts)
+            byts = b''
+
+        self.base = 0           # stream offset of the current chunk
+        self.prev = b''         # the previous (raw) chunk
+        self.carry = b''        # odd byte held back for wordswap
+        self._setChunk(byts)
+
+        self.bitval = 0
+        self.bitcnt = 0
+
+    def _setChunk(self, byts):
+        self.raw = byts
+        self.buf = byts
+        self.pos = 0
+
+        if self.wordswap:
+            size = len(byts) & ~1
+            swap = bytearray(byts)
+            swap[0:size:2] = byts[1:size:2]
+            swap[1:size:2] = byts[0:size:2]
+            self.buf = swap
+
+    def _nextChunk(self):
+        if self.chunks == None:
+            return False
+
+        for byts in self.chunks:
+
+            if self.carry:
+                byts = self.carry + bytes(byts)
+                self.carry = b''
+
+            if self.wordswap and len(byts) & 1:
+                self.carry = bytes(byts[-1:])
+                byts = byts[:-1]
+
+            if not byts:
+                continue
+
+            self.base += len(self.raw)
+            self.prev = self.raw
+            self._setChunk(byts)
+            return True
+
+        # the stream ended on an odd byte
+        if self.carry:
+            self.base += len(self.raw)
+            self.prev = self.raw
+            self._setChunk(self.carry)
+            self.carry = b''
+            return True
+
+        return False
+
+    def _fill(self, bitsize):
+        # load up to 8 bytes at a time until we have bitsize bits
+        while self.bitcnt < bitsize:
+
+            pos = self.pos
+            if pos >= len(self.buf):
+                if not self._nextChunk():
+                    return False
+                continue
+
+            byts = self.buf[pos:pos + 8]
+            self.pos = pos + len(byts)
+
+            if self.order == 'big':
+                self.bitval = (self.bitval << (len(byts) << 3)) | int.from_bytes(byts, 'big')
+            else:
+                self.bitval |= int.from_bytes(byts, 'little') << self.bitcnt
+
+            self.bitcnt += len(byts) << 3
+
+        return True
+
+    def __iter__(self):
+        while self._fill(1):
+            yield self.read(1)
+
+    def getOffset(self):
+        '''
+        Return the number of bits consumed from the stream.
+        '''
+        return (self.base + self.pos) * 8 - self.bitcnt
+
+    def peek(self, bitsize):
+        '''
+        Return the next "bitsize" bits as an int without consuming them.
+
+        The value is zero padded if the stream runs out.
+
+        Example:
+
+            valu = bits.peek(9)
+        '''
+        if self.bitcnt < bitsize:
+            self._fill(bitsize)
+
+        if self.order == 'big':
+            shft = self.bitcnt - bitsize
+            if shft < 0:
+                return self.bitval << -shft
+            return self.bitval >> shft
+
+        return self.bitval & ((1 << bitsize) - 1)
+
+    def read(self, bitsize):
+        '''
+        Consume the next "bitsize" bits and return them as an int.
+
+        Example:
+
+            hlit = bits.read(5)
+        '''
+        if self.bitcnt < bitsize and not self._fill(bitsize):
+            raise OffBitStream('BitReader exhausted')
+
+        self.bitcnt -= bitsize
+
+        if self.order == 'big':
+            ret = self.bitval >> self.bitcnt
+            self.bitval &= (1 << self.bitcnt) - 1
+            return ret
 
-        ret = 0
-        if bord == 'little':
-            for i in range(bitsize):
-                b = next(self.bits)
-                ret |= b << i
-        elif bord == 'big':
-            for i in range(bitsize):
-                b = next(self.bits)
-                if b:
-                    ret |= (1 << (bitsize - 1 - i)) 
+        ret = self.bitval & ((1 << bitsize) - 1)
+        self.bitval >>= bitsize
         return ret
+
+    def skip(self, bitsize):
+        '''
+        Consume and discard the next "bitsize" bits.
+        '''
+        if self.bitcnt < bitsize and not self._fill(bitsize):
+            raise OffBitStream('BitReader exhausted')
+
+        self.bitcnt -= bitsize
+
+        if self.order == 'big':
+            self.bitval &= (1 << self.bitcnt) - 1
+        else:
+            self.bitval >>= bitsize
+
+    def cast(self, bitsize, bord='big'):
+        '''
+        Consume a "bitsize" integer ( BitStream compatible ).
+
+        Example:
+
+            valu = bits.cast(5, 'little')
+        '''
+        ret = self.read(bitsize)
+
+        # stream order matches the requested order
+        if (bord == 'big') == (self.order == 'big'):
+            return ret
+
+        rev = 0
+        for i in range(bitsize):
+            rev = (rev << 1) | ((ret >> i) & 0x1)
+        return rev
+
+    def align(self, bitsize=8):
+        '''
+        Skip to the next multiple of "bitsize" bits in the stream.
+
+        Example:
+
+            # skip to the next byte boundary
+            bits.align()
+        '''
+        pad = -self.getOffset() % bitsize
+        if pad:
+            self.read(pad)
+
+    def readBytes(self, size):
+        '''
+        Read "size" raw bytes from a byte aligned stream offset.
+
+        Example:
+
+            bits.align()
+            byts = bits.readBytes(dlen)
+        '''
+        if self.bitcnt & 7:
+            raise OffBitStream('BitReader.readBytes() requires byte alignment')
+
+        # rewind over any whole bytes held in the accumulator
+        back = self.bitcnt >> 3
+        pos = self.pos - back
+
+        self.bitval = 0
+        self.bitcnt = 0
+
+        if pos < 0:
+            self.base += pos
+            self._setChunk( bytes(self.prev[pos:]) + bytes(self.raw) )
+            pos = 0
+
+        self.pos = pos
+
+        ret = []
+        while size:
+
+            if self.pos >= len(self.raw):
+                if not self._nextChunk():
+                    raise OffBitStream('BitReader exhausted')
+                continue
+
+            byts = self.raw[self.pos:self.pos + size]
+
+            self.pos += len(byts)
+            size -= len(byts)
+
+            ret.append(byts)
+
+        return b''.join(ret)
@@ -1,5 +1,8 @@
 import collections
 
+LRU_MAX_KEYS    = 4096  # default LruKeyCache size
+ONDEM_MAX_EVICT = 16    # default number of evict=True OnDemand values kept
+
 class KeyCache(collections.defaultdict):
     '''
     A dictionary based key/val cache.
@@ -21,13 +24,92 @@ class KeyCache(collections.defaultdict):
         self[key] = valu
         return valu
 
+    def invalidate(self, key=None):
+        '''
+        Drop a cached key ( or all keys ) to be looked up again.
+        '''
+        if key == None:
+            self.clear()
+            return
+
+        self.pop(key, None)
+
+class LruKeyCache(collections.OrderedDict):
+    '''
+    A size bounded KeyCache which drops the least recently used keys.
+
+    Example:
+
+        cache = LruKeyCache( getFooThing, maxsize=1024 )
+
+        if cache['woot']:
+            dostuff()
+
+        cache.invalidate('woot')
+
+    '''
+    def __init__(self, lookmeth, maxsize=LRU_MAX_KEYS):
+        collections.OrderedDict.__init__(self)
+        self.lookmeth = lookmeth
+        self.maxsize = maxsize
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, key):
+        if key in self:
+            self.hits += 1
+            self.move_to_end(key)
+            return collections.OrderedDict.__getitem__(self, key)
+
+        self.misses += 1
+
+        valu = self.lookmeth(key)
+        self[key] = valu
+
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+            self.evictions += 1
+
+        return valu
+
+    def invalidate(self, key=None):
+        '''
+        Drop a cached key ( or all keys ) to be looked up again.
+        '''
+        if key == None:
+            self.clear()
+            return
+
+        self.pop(key, None)
+
+    def getStats(self):
+        '''
+        Return a dict of cache hits / misses / evictions / size.
+        '''
+        return {
+            'hits':self.hits,
+            'misses':self.misses,
+            'evictions':self.evictions,
+            'size':len(self),
+            'maxsize':self.maxsize,
+        }
+
 class OnDemand(collections.defaultdict):
+    '''
+    A dict of values which are parsed on first access.
 
-    def __init__(self):
+    Values registered with add(..., evict=True) are held in a
+    bounded LRU ( maxevict values ) and are re-parsed if needed
+    after being dropped.
+    '''
+    def __init__(self, maxevict=ONDEM_MAX_EVICT):
         collections.defaultdict.__init__(self)
         self._ondem_ctors = {}
+        self._ondem_evict = LruKeyCache( self._loadOnDemand, maxsize=maxevict )
 
-    def add(self, name, ctor, *args, **kwargs):
+    def add(self, name, ctor, *args, evict=False, **kwargs):
         '''
         Add on-demand parser callback.
 
@@ -45,8 +127,12 @@ class OnDemand(collections.defaultdict):
             foo = FooLab()
             for bar in foo.get('bars'):
                 dostuff()
+
+        Notes:
+
+            * evict=True values may be dropped ( LRU ) and re-parsed
         '''
-        self._ondem_ctors[name] = (ctor,args,kwargs)
+        self._ondem_ctors[name] = (ctor,args,kwargs,evict)
 
     def get(self, name, defval=None):
         '''
@@ -69,8 +155,52 @@ class OnDemand(collections.defaultdict):
         '''
         self[name] = valu
 
+    def invalidate(self, name=None):
+        '''
+        Drop a parsed value ( or all of them ) to be re-parsed on demand.
+
+        Example:
+
+            lab.invalidate('pe:sections')
+
+        Notes:
+
+            * values stored with set() are not dropped
+
+        '''
+        if name == None:
+            for name in self._ondem_ctors:
+                self.pop(name, None)
+            self._ondem_evict.invalidate()
+            return
+
+        if name in self._ondem_ctors:
+            self.pop(name, None)
+        self._ondem_evict.invalidate(name)
+
+    def getStats(self):
+        '''
+        Return a dict of stats for the evict=True value cache.
+
+        Example:
+
+            stats = lab.getStats()
+            print('evictions: %d' % (stats['evictions'],))
+
+        '''
+        stats = self._ondem_evict.getStats()
+        stats['keys'] = len(self)
+        return stats
+
+    def _loadOnDemand(self, key):
+        meth,args,kwargs,evict = self._ondem_ctors.get(key)
+        return meth(*args,**kwargs)
+
     def __missing__(self, key):
-        meth,args,kwargs = self._ondem_ctors.get(key)
+        meth,args,kwargs,evict = self._ondem_ctors.get(key)
+        if evict:
+            return self._ondem_evict[key]
+
         val = meth(*args,**kwargs)
         self[key] = val
         return val
@@ -1,7 +1,232 @@
+import io
+import os
+import mmap
+import stat
 import codecs
+import collections
 
 from dissect.common import *
 
+PAGE_SIZE       = 4096          # PageCache read granularity
+PAGE_CACHE_SIZE = 1024 * 1024   # default PageCache byte budget
+PAGE_BYPASS     = 16            # reads spanning more pages skip the cache
+
+def getNullWidth(codec):
+    '''
+    Return the width ( in bytes ) of a null terminator for the codec.
+    '''
+    name = codecs.lookup(codec).name
+    if name.startswith('utf-16'):
+        return 2
+    if name.startswith('utf-32'):
+        return 4
+    return 1
+
+def findNull(buf, width, start, end=None):
+    '''
+    Return the offset of the first null terminator in buf which is
+    aligned to width relative to start ( or -1 if not found ).
+
+    Example:
+
+        end = findNull(byts, 2, off)
+        if end != -1:
+            name = byts[off:end].decode('utf-16le')
+
+    '''
+    if end == None:
+        end = len(buf)
+
+    term = b'\x00' * width
+    pos = buf.find(term, start, end)
+    while pos != -1 and (pos - start) % width:
+        pos = buf.find(term, pos + 1, end)
+    return pos
+
+def getFileMmap(fd):
+    '''
+    Return a read-only mmap for a regular file object ( or None ).
+
+    Example:
+
+        mem = getFileMmap(fd)
+        if mem != None:
+            byts = mem[0:2]
+
+    '''
+    try:
+        fileno = fd.fileno()
+        st = os.fstat(fileno)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+
+    if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+        return None
+
+    try:
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+class PageCache(object):
+    '''
+    An LRU cache of fixed size pages read from a file object.
+
+    Pages are read on first use and the least recently used pages
+    are dropped once maxsize bytes are held.  Large reads ( more than
+    PAGE_BYPASS pages ) go straight to the file to avoid flushing
+    the cache.
+
+    Example:
+
+        cache = PageCache(fd, maxsize=64 * 1024 * 1024)
+        byts = cache.read(off, 20)
+
+        stats = cache.getStats()
+        print('hits: %d misses: %d' % (stats['hits'], stats['misses']))
+
+    '''
+    def __init__(self, fd, pagesize=PAGE_SIZE, maxsize=PAGE_CACHE_SIZE):
+        self.fd = fd
+        self.pagesize = pagesize
+        self.maxpages = max(1, maxsize // pagesize)
+
+        self.pages = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def getPage(self, idx):
+        '''
+        Return the bytes for the page index ( short at EOF ).
+        '''
+        page = self.pages.get(idx)
+        if page != None:
+            self.hits += 1
+            self.pages.move_to_end(idx)
+            return page
+
+        self.misses += 1
+
+        self.fd.seek(idx * self.pagesize)
+        page = self.fd.read(self.pagesize)
+
+        self.pages[idx] = page
+        if len(self.pages) > self.maxpages:
+            self.pages.popitem(last=False)
+
+        return page
+
+    def read(self, off, size):
+        '''
+        Read up to size bytes from the file offset.
+
+        Example:
+
+            byts = cache.read(0x3c, 4)
+
+        '''
+        if size <= 0:
+            return b''
+
+        if size > self.pagesize * PAGE_BYPASS:
+            self.fd.seek(off)
+            return self.fd.read(size)
+
+        idx,poff = divmod(off, self.pagesize)
+
+        page = self.getPage(idx)
+        if poff + size <= len(page):
+            return page[poff:poff + size]
+
+        parts = [ page[poff:] ]
+        size -= len(parts[0])
+
+        while size > 0 and len(page) == self.pagesize:
+            idx += 1
+            page = self.getPage(idx)
+            parts.append( page[:size] )
+            size -= len(page)
+
+        return b''.join(parts)
+
+    def getStats(self):
+        '''
+        Return a dict of cache hits / misses / pages / bytes.
+        '''
+        return {
+            'hits':self.hits,
+            'misses':self.misses,
+            'pages':len(self.pages),
+            'size':sum( len(p) for p in self.pages.values() ),
+        }
+
+    def clear(self):
+        '''
+        Drop all cached pages ( the counters are kept ).
+        '''
+        self.pages.clear()
+
+class PageCacheFile(object):
+    '''
+    A read-only file object which reads through a PageCache.
+
+    ( used as the backing fd for lazily loaded VStructs )
+    '''
+    def __init__(self, cache):
+        self.cache = cache
+        self.pos = 0
+
+    def seek(self, off, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            off += self.pos
+        elif whence == io.SEEK_END:
+            self.cache.fd.seek(0, io.SEEK_END)
+            off += self.cache.fd.tell()
+
+        self.pos = off
+        return off
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        if size == None or size < 0:
+            self.cache.fd.seek(0, io.SEEK_END)
+            size = max(0, self.cache.fd.tell() - self.pos)
+
+        byts = self.cache.read(self.pos, size)
+        self.pos += len(byts)
+        return byts
+
+class MemViewFile(object):
+    '''
+    A read-only file object over a memoryview ( without copying it ).
+    '''
+    def __init__(self, mem):
+        self.mem = mem
+        self.pos = 0
+
+    def seek(self, off, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            off += self.pos
+        elif whence == io.SEEK_END:
+            off += len(self.mem)
+
+        self.pos = off
+        return off
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        if size == None or size < 0:
+            size = len(self.mem) - self.pos
+
+        byts = self.mem[self.pos:self.pos + size].tobytes()
+        self.pos += len(byts)
+        return byts
+
 class FileLab(OnDemand):
     '''
     Base class for file format parsers.
@@ -30,12 +255,111 @@ class FileLab(OnDemand):
         for bar in foo.get('bars'):
             dostuff()
 
+    Notes:
+
+        * fd may be a file object or a bytes / bytearray / mmap /
+          memoryview buffer ( memoryviews are used without a copy )
+        * regular files are mmap'd ( unless usemmap=False ) and
+          readAtOff() returns memoryview slices of the mapping
+        * close() ( or a with block ) releases the buffer and any
+          mmap the lab created ( caller mmaps are left open )
+        * other file objects are read through a PageCache ( pass
+          cache=PageCache(...) to tune it or cache=False to disable )
+        * the PageCache is only used for regular files when mmap is
+          disabled: pass usemmap=False for slow or network mounted
+          files where page faults on the mapping are the cost to avoid
+
     '''
-    def __init__(self, fd, off=0):
+    def __init__(self, fd, off=0, usemmap=True, cache=None):
         OnDemand.__init__(self)
-        self.fd = fd
         self.off = off
 
+        # buf slices to bytes for struct parsing, mem for zero copy reads
+        self.buf = None
+        self.mem = None
+
+        # set if self.buf is an mmap we created ( and must close )
+        self.ownmmap = False
+
+        if isinstance(fd, memoryview):
+            self.mem = fd.cast('B')
+            fd = MemViewFile(self.mem)
+
+        elif isinstance(fd, (bytes, bytearray, mmap.mmap)):
+            self.buf = fd
+            fd = io.BytesIO(fd)
+
+        elif usemmap:
+            self.buf = getFileMmap(fd)
+            self.ownmmap = self.buf != None
+
+        if self.buf != None:
+            self.mem = memoryview(self.buf)
+
+        self.fd = fd
+
+        # the mmap / buffer is already "cached"
+        self.cache = None
+        self.cachefd = None
+
+        if self.mem == None and cache != False:
+            if cache == None:
+                cache = PageCache(fd)
+            self.cache = cache
+            self.cachefd = PageCacheFile(cache)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, cls, tb):
+        self.close()
+
+    def close(self):
+        '''
+        Release the buffer view and close any mmap created by the lab.
+
+        Example:
+
+            with PeLab(fd) as lab:
+                dostuff(lab)
+
+        Notes:
+
+            * memoryviews returned by readAtOff() must be released
+              first ( closing the mmap raises BufferError otherwise )
+            * the file object and caller provided buffers stay open
+
+        '''
+        if self.mem != None:
+            self.mem.release()
+
+        if self.ownmmap:
+            self.buf.close()
+
+    def getCacheStats(self):
+        '''
+        Return the PageCache stats dict ( or None if not cached ).
+
+        Example:
+
+            stats = lab.getCacheStats()
+            if stats != None:
+                print('misses: %d' % (stats['misses'],))
+
+        '''
+        if self.cache == None:
+            return None
+        return self.cache.getStats()
+
+    def getSize(self):
+        '''
+        Return the size of the file ( or buffer ) in bytes.
+        '''
+        if self.mem != None:
+            return len(self.mem)
+
+        return self.fd.seek(0, io.SEEK_END)
+
     def getStruct(self, off, cls, *args, **kwargs):
         '''
         Construct a VStruct and load from the file offset.
@@ -56,33 +380,97 @@ class FileLab(OnDemand):
             off = self.fd.tell()
 
         obj = cls(*args,**kwargs)
+        if self.buf != None:
+            obj.vsParse( self.buf, offset=off )
+            return obj
+
+        if self.mem != None:
+            obj.vsParse( self.mem, offset=off )
+            return obj
+
+        if self.cachefd != None:
+            obj.vsLoad( self.cachefd, offset=off )
+            return obj
+
         obj.vsLoad( self.fd, offset=off )
         return obj
 
     def readAtOff(self, off, size, shortok=False):
-        self.fd.seek(off)
-        byts = self.fd.read(size)
+        '''
+        Read size bytes from the file offset.
+
+        For mmap / buffer backed labs, a memoryview slice is returned
+        ( bytes are returned otherwise ).
+
+        Example:
+
+            byts = bytes( lab.readAtOff(off, 20) )
+
+        Notes:
+
+            * API change: buffer backed labs used to return bytes, use
+              bytes() where a bytes object ( or hashable key ) is needed
+        '''
+        if self.mem != None:
+            byts = self.mem[off:off + size]
+        elif self.cache != None:
+            byts = self.cache.read(off, size)
+        else:
+            self.fd.seek(off)
+            byts = self.fd.read(size)
+
         if len(byts) != size and not shortok:
             raise Exception('readAtOff(%d,%d) short: %d' % (off,size,len(byts)))
         return byts
 
     def strAtOff(self, off, codec='utf8'):
         '''
-        Incrementally decode and return a null terminated string.
+        Decode and return a null terminated string.
+
+        The terminator width follows the codec ( two null bytes at an
+        even offset for utf-16 ).  For file objects ( and memoryviews )
+        the string is read in pages ( via the PageCache if enabled ).
+
+        Example:
+
+            name = lab.strAtOff(off)
+            wname = lab.strAtOff(off, codec='utf-16le')
+
         '''
-        self.fd.seek(off)
-        def fdbytes():
-            while True:
-                b = self.fd.read(1)
-                if not b:
-                    break
-                yield b
+        width = getNullWidth(codec)
+        if self.buf != None:
+            end = findNull(self.buf, width, off)
+            if end == -1:
+                end = len(self.buf)
+            return self.buf[off:end].decode(codec)
+
+        psize = PAGE_SIZE
+        if self.cache != None:
+            psize = self.cache.pagesize
+
+        byts = bytearray()
+        while True:
+            page = self._getPage( (off + len(byts)) // psize, psize )
+            chunk = page[ (off + len(byts)) % psize: ]
+
+            # back up to catch a terminator split across pages
+            scan = max(0, len(byts) - width + 1)
+            scan -= scan % width
+
+            byts += chunk
+            end = findNull(byts, width, scan)
+            if end != -1:
+                return byts[:end].decode(codec)
+
+            if len(page) < psize:
+                return byts.decode(codec)
 
-        ret = []
-        for c in codecs.iterdecode(fdbytes(),codec):
-            if ord(c) == 0:
-                break
+    def _getPage(self, idx, psize):
+        if self.mem != None:
+            return self.mem[idx * psize:(idx + 1) * psize]
 
-            ret.append(c)
+        if self.cache != None:
+            return self.cache.getPage(idx)
 
-        return ''.join(ret)
+        self.fd.seek(idx * psize)
+        return self.fd.read(psize)
@@ -1,12 +1,23 @@
+import io
+import os
+import struct
+import bisect
+import shutil
 import tempfile
+import logging
+import collections
+import concurrent.futures
 from io import BytesIO
 
 from vstruct2.types import *
+from dissect.common import KeyCache, LruKeyCache
 from dissect.filelab import *
 import dissect.bitlab as bitlab
 import dissect.algos.mszip as mszip 
 import dissect.algos.lzx as lzx
 
+logger = logging.getLogger(__name__)
+
 class OffCabFile(Exception):pass
 
 #https://msdn.microsoft.com/en-us/library/bb417343.aspx
@@ -23,6 +34,28 @@ _F_PREV_CABINET       = 0x0001 # When this bit is set, the szCabinetPrev and szD
 _F_NEXT_CABINET       = 0x0002 # When this bit is set, the szCabinetNext and szDiskNext fields are present in this CFHEADER.
 _F_RESERVE_PRESENT    = 0x0004 # When this bit is set, the cbCFHeader, cbCFFolder, and cbCFData fields are present in this CFHEADER.
 
+_IFOLD_CONTINUED_FROM_PREV      = 0xFFFD # file data begins in the previous cabinet
+_IFOLD_CONTINUED_TO_NEXT        = 0xFFFE # file data continues in the next cabinet
+_IFOLD_CONTINUED_PREV_AND_NEXT  = 0xFFFF # both of the above
+
+CKPT_SIZE = 4 * 1024 * 1024 # uncompressed bytes between decoder checkpoints
+CKPT_MAX  = 8               # max checkpoints kept per folder
+CKPT_FLDRS = 4              # folders ( most recently used ) with checkpoints
+COPY_SIZE = 1024 * 1024     # read size when extracting files
+INFO_SIZE = 64 * 1024       # initial read size for the header and CFFILE table
+
+_CFHEADER_FMT = '<4sIIIIIBBHHHHH'
+_CFHEADER_SIZE = struct.calcsize(_CFHEADER_FMT)
+_CFFOLDER_FMT = '<IHH'
+_CFFILE_FMT = '<IIHHHH'
+
+# header only ( fast ) parser results
+CabInfo = collections.namedtuple('CabInfo', ('version','size','flags','setid','icab','datares','folders','files'))
+CabFolderInfo = collections.namedtuple('CabFolderInfo', ('off','cdata','comp'))
+CabFileInfo = collections.namedtuple('CabFileInfo', ('name','size','uoff','ifldr','date','time','attrs'))
+
+class ShortCabInfo(Exception):pass
+
 comp = venum()
 comp.NONE     = 0x00 # no compression
 comp.MSZIP    = 0x01 # ms decompress compression
@@ -130,12 +163,178 @@ class CFDATA(VStruct):
     def _onSetCbData(self):
         self['ab'].vsResize( self.cbData )
 
+class CabFolderStream(object):
+    '''
+    A buffered reader over the decompressed byte blocks of a folder.
+
+    Blocks are kept in a deque and consumed without concatenation.
+
+    Example:
+
+        strm = CabFolderStream( cab.iterFolderBytes(0) )
+        strm.skip(100)
+        byts = strm.read(20)
+
+    '''
+    def __init__(self, blks, off=0):
+        self.blks = iter(blks)
+        self.chunks = collections.deque()
+        self.off = off  # folder offset of the next byte
+        self.size = 0   # bytes buffered in chunks
+
+    def _fill(self, size):
+        while self.size < size:
+            byts = next(self.blks, None)
+            if byts == None:
+                return
+
+            if byts:
+                self.chunks.append( memoryview(byts) )
+                self.size += len(byts)
+
+    def _take(self, size, keep):
+        ret = []
+        while size:
+            self._fill(1)
+            if not self.chunks:
+                break
+
+            chunk = self.chunks[0]
+            if len(chunk) <= size:
+                self.chunks.popleft()
+            else:
+                self.chunks[0] = chunk[size:]
+                chunk = chunk[:size]
+
+            if keep:
+                ret.append(chunk)
+
+            size -= len(chunk)
+            self.size -= len(chunk)
+            self.off += len(chunk)
+
+        return ret
+
+    def read(self, size):
+        '''
+        Read ( up to ) size bytes from the folder stream.
+        '''
+        ret = self._take(size, True)
+        if len(ret) == 1:
+            return ret[0].tobytes()
+        return b''.join(ret)
+
+    def skip(self, size):
+        '''
+        Skip ( up to ) size bytes in the folder stream.
+        '''
+        self._take(size, False)
+
+class CabMemberFile(io.RawIOBase):
+    '''
+    A file like object which lazily reads one file from a folder stream.
+
+    Folder streams may be shared between files in the same folder;
+    reading ( or seeking ) backward past the shared stream resumes a
+    private stream from the nearest decoder checkpoint.
+    '''
+    def __init__(self, lab, ifldr, uoff, size, strm=None):
+        io.RawIOBase.__init__(self)
+        self.lab = lab
+        self.ifldr = ifldr
+        self.uoff = uoff
+        self.size = size
+        self.pos = 0
+
+        if strm == None:
+            strm = CabFolderStream( lab.iterFolderBytes(ifldr, uoff), off=uoff )
+
+        self.strm = strm
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, off, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            off += self.pos
+        elif whence == io.SEEK_END:
+            off += self.size
+
+        if off < 0:
+            raise ValueError('Negative seek offset: %d' % (off,))
+
+        self.pos = off
+        return off
+
+    def read(self, size=-1):
+        remain = self.size - self.pos
+        if size == None or size < 0 or size > remain:
+            size = remain
+
+        if size <= 0:
+            return b''
+
+        want = self.uoff + self.pos
+        if self.strm.off > want:
+            self.strm = CabFolderStream( self.lab.iterFolderBytes(self.ifldr, want), off=want )
+
+        self.strm.skip(want - self.strm.off)
+
+        byts = self.strm.read(size)
+        if len(byts) != size:
+            raise OffCabFile('Truncated folder data at: %d' % (self.strm.off,))
+
+        self.pos += size
+        return byts
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, buf):
+        byts = self.read(len(buf))
+        buf[:len(byts)] = byts
+        return len(byts)
+
+def _extractCabFolder(path, off, ifldr, dest):
+    # process pool worker for CabLab.extractAll()
+    with open(path, 'rb') as fd:
+        return CabLab(fd, off=off).extractFolder(ifldr, dest)
+
 class CabLab(FileLab):
+    '''
+    Parser for MS CAB files.
+
+    While decompressing a folder, decoder state is saved every ckptsize
+    uncompressed bytes so openCabFile() may resume from the nearest
+    checkpoint rather than the start of the folder.  For LZX each
+    checkpoint holds a copy of the window ( up to 2MB ), so at most
+    ckptmax checkpoints are kept per folder ( every other one is dropped
+    and the spacing doubled as a folder grows past that ) for the
+    CKPT_FLDRS most recently used folders.  Pass ckptsize=None to
+    disable checkpoints.
+
+    Example:
+
+        cab = CabLab(fd)
+        byts = cab.openCabFile('foo.inf').read()
 
-    def __init__(self, fd, off=0):
+    '''
+    def __init__(self, fd, off=0, ckptsize=CKPT_SIZE, ckptmax=CKPT_MAX):
         FileLab.__init__(self, fd, off=off)
         self.add('CFHEADER', self._getCabHeader )
+        self.add('cab:info', self._getCabInfo )
         self.add('filesbyname', self._loadFilesByName )
+        self.ckptsize = ckptsize
+        self.ckptmax = ckptmax
+        self._cab_fldrdata = KeyCache( self._getFolderData )
+        self._cab_fldridx = KeyCache( self._getFolderIndex )
+        self._cab_ckpts = LruKeyCache( self._getFolderCkpts, maxsize=CKPT_FLDRS )
 
         self.decomps = {
             comp.NONE:self._deCompNoneBlock,
@@ -145,21 +344,42 @@ class CabLab(FileLab):
         }
 
 
-    def _deCompNoneBlock(self, itblks, comp_type=None):
-        for d in itblks:
-            yield d.ab
+    def _deCompNoneBlock(self, ifldr, comp_type=None, ckpt=(0,0,None)):
+        uoff,coff,state = ckpt
+        return self.iterFolderFrames(ifldr, coff)
+
+    def _deCompLzxBlock(self, ifldr, comp_type, ckpt=(0,0,None)):
+        uoff,coff,state = ckpt
 
-    def _deCompLzxBlock(self, itblks, comp_type):
         lzxd = lzx.Lzx(comp_type)
-        for d in lzxd.decompBlock(itblks):
-            yield d
+        if state != None:
+            lzxd.setState(state)
 
-    def _deCompMsZipBlock(self, itblks, comp_type=None):
-        mszipd = mszip.MsZip()
-        for d in mszipd.decompBlock(itblks):
-            yield d
+        rawcb = self.getFolderSize(ifldr) - uoff
+        for byts in lzxd.decompFrames( self.iterFolderFrames(ifldr, coff), rawcb ):
+            uoff += len(byts)
+            if self._needCheckPoint(ifldr, uoff):
+                state = lzxd.getState()
+                self._addCheckPoint(ifldr, uoff, lzxd.getStateOffset(state), state)
+            yield byts
 
-    def _deCompQuantumBlock(self, itblks, comp_type=None):
+    def _deCompMsZipBlock(self, ifldr, comp_type=None, ckpt=(0,0,None)):
+        uoff,coff,state = ckpt
+
+        mszipd = mszip.MsZip()
+        if state != None:
+            mszipd.setDictionary(state)
+
+        # MSZIP frames map 1:1 onto CFDATA blocks
+        fidx = self._cab_fldridx[ifldr]
+        i = bisect.bisect_left(fidx, (uoff,coff))
+        for byts in mszipd.decompFrames( self.iterFolderFrames(ifldr, coff) ):
+            i += 1
+            if self._needCheckPoint(ifldr, fidx[i][0]):
+                self._addCheckPoint(ifldr, fidx[i][0], fidx[i][1], mszipd.getDictionary())
+            yield byts
+
+    def _deCompQuantumBlock(self, ifldr, comp_type=None, ckpt=(0,0,None)):
             raise NotImplementedError('Quantum is not support...yet')
 
     def _getCabHeader(self):
@@ -170,10 +390,94 @@ class CabLab(FileLab):
 
     def _loadFilesByName(self):
         ret = {}
-        for off,cff in self['CFHEADER'].cfFileArray:
-            ret[cff.szName] = cff
+        for info in self.getCabFileInfo():
+            ret[info.name] = info
         return ret
 
+    def _getCabInfo(self):
+        if self.buf != None:
+            try:
+                return self._parseCabInfo(self.buf)
+            except ShortCabInfo as e:
+                raise OffCabFile('Truncated CAB File: %s' % (e,))
+
+        size = INFO_SIZE
+        while True:
+            # bytes() for memoryview backed labs ( zstr uses find )
+            byts = bytes( self.readAtOff(0, size, shortok=True) )
+            try:
+                return self._parseCabInfo(byts)
+            except ShortCabInfo as e:
+                if len(byts) < size:
+                    raise OffCabFile('Truncated CAB File: %s' % (e,))
+                size *= 4
+
+    def _parseCabInfo(self, byts):
+        # parse the CFHEADER, CFFOLDER and CFFILE tables from bytes
+        def unpack(fmt, off):
+            if off + struct.calcsize(fmt) > len(byts):
+                raise ShortCabInfo('offset %d' % (off,))
+            return struct.unpack_from(fmt, byts, off)
+
+        def zstr(off):
+            end = byts.find(b'\x00', off)
+            if end == -1:
+                raise ShortCabInfo('offset %d' % (off,))
+            return byts[off:end].decode('utf8'), end + 1
+
+        hdr = unpack(_CFHEADER_FMT, 0)
+        sig,res1,cbcab,res2,cofffiles,res3,vmin,vmaj,nfldr,nfile,flags,setid,icab = hdr
+        if sig != _CAB_MAGIC:
+            raise OffCabFile('Invalid CAB File Header: %r' % (sig,))
+
+        off = _CFHEADER_SIZE
+        hdrres = fldrres = datares = 0
+        if flags & _F_RESERVE_PRESENT:
+            hdrres,fldrres,datares = unpack('<HBB', off)
+            off += 4 + hdrres
+
+        # skip the prev/next cabinet and disk names
+        for flag in (_F_PREV_CABINET, _F_NEXT_CABINET):
+            if flags & flag:
+                name,off = zstr(off)
+                name,off = zstr(off)
+
+        folders = []
+        for i in range(nfldr):
+            folders.append( CabFolderInfo( *unpack(_CFFOLDER_FMT, off) ) )
+            off += 8 + fldrres
+
+        files = []
+        off = cofffiles
+        for i in range(nfile):
+            cbfile,uoff,ifldr,date,time,attrs = unpack(_CFFILE_FMT, off)
+            name,off = zstr(off + 16)
+            files.append( CabFileInfo(name, cbfile, uoff, ifldr, date, time, attrs) )
+
+        return CabInfo( (vmaj,vmin), cbcab, flags, setid, icab, datares, folders, files )
+
+    def getCabFolderInfo(self):
+        '''
+        Return a list of CabFolderInfo (off,cdata,comp) tuples.
+        '''
+        return self['cab:info'].folders
+
+    def getCabFileInfo(self):
+        '''
+        Return a list of CabFileInfo tuples for files within the cab.
+
+        The CFHEADER and CFFILE table are parsed from a single read
+        ( which never touches CFDATA ), making this the fast way to
+        list large numbers of cabs.
+
+        Example:
+
+            for info in cab.getCabFileInfo():
+                print('%s %d %d' % (info.name, info.size, info.date))
+
+        '''
+        return self['cab:info'].files
+
     def getCabFiles(self):
        '''
         
@@ -182,26 +486,87 @@ class CabLab(FileLab):
             for filename, finfo, fd in cab.getCabFiles(self):
                 fdata = fd.read()
        ''' 
-       cfh = self['CFHEADER']
        ifldr = None
-       fdata = b''
        for fname,finfo in self.listCabFiles():
-           fsize = finfo['size']
-           uoff = finfo['uoff']
            if finfo['ifldr'] != ifldr:
                ifldr = finfo['ifldr']
-               fldr = cfh.cfDirArray[finfo['ifldr']]
-               calg = fldr.typeCompress & 3
-               icd = self.iterCabData(fldr.coffCabStart, fldr.cCFData)
-               dblk = self.decomps[calg](icd, fldr.typeCompress)
+               strm = CabFolderStream( self.iterFolderBytes(ifldr) )
+
+           cfd = CabMemberFile(self, ifldr, finfo['uoff'], finfo['size'], strm)
+           yield (fname, finfo, cfd)
 
-           while fsize > len(fdata):
-               fdata += next(dblk)
-           
-           bio = BytesIO(fdata[:fsize])
-           fdata = fdata[fsize:]
-           yield (fname, finfo, bio)
 
+    def getSpanningFiles(self):
+        '''
+        Return a list of CabFileInfo tuples for files which are continued
+        from ( or to ) another cabinet ( ifldr 0xfffd-0xffff ).  These
+        can not be extracted from a single cab.
+        '''
+        return [ info for info in self.getCabFileInfo() if info.ifldr >= _IFOLD_CONTINUED_FROM_PREV ]
+
+    def extractAll(self, dest, workers=1):
+        '''
+        Extract all files within the cab to the dest directory and
+        yield the paths written as they complete.
+
+        If workers > 1, folders are decompressed in parallel by a pool
+        of worker processes which each re-open the cab by file path
+        ( paths are yielded per folder as each folder finishes ).
+
+        Files which span cabinets ( see getSpanningFiles() ) are not
+        extracted and are logged as a warning.
+
+        Example:
+
+            for path in cab.extractAll('/tmp/out', workers=8):
+                print('extracted: %s' % (path,))
+
+        '''
+        for info in self.getSpanningFiles():
+            logger.warning('cab file spans cabinets ( not extracted ): %s', info.name)
+
+        nfldr = len( self.getCabFolderInfo() )
+        path = getattr(self.fd, 'name', None)
+        if workers <= 1 or nfldr <= 1 or not isinstance(path, str):
+            for ifldr in range(nfldr):
+                yield from self._iterExtractFolder(ifldr, dest)
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, nfldr)) as pool:
+            futs = [ pool.submit(_extractCabFolder, path, self.off, ifldr, dest) for ifldr in range(nfldr) ]
+            for fut in concurrent.futures.as_completed(futs):
+                yield from fut.result()
+
+    def extractFolder(self, ifldr, dest):
+        '''
+        Extract the files within one folder to the dest directory and
+        return a list of the paths written.  The folder is decompressed
+        once and the files are written as the bytes are produced.
+        '''
+        return list( self._iterExtractFolder(ifldr, dest) )
+
+    def _iterExtractFolder(self, ifldr, dest):
+        infos = [ info for info in self.getCabFileInfo() if info.ifldr == ifldr ]
+        infos.sort(key=lambda info: info.uoff)
+
+        strm = CabFolderStream( self.iterFolderBytes(ifldr) )
+        for info in infos:
+            path = self._getExtractPath(dest, info.name)
+            cfd = CabMemberFile(self, ifldr, info.uoff, info.size, strm)
+            with open(path, 'wb') as fd:
+                shutil.copyfileobj(cfd, fd, COPY_SIZE)
+
+            yield path
+
+    def _getExtractPath(self, dest, name):
+        # keep extracted files within dest
+        parts = [ p for p in name.replace('\\','/').split('/') if p not in ('','.','..') ]
+        if not parts:
+            raise OffCabFile('Invalid file name: %r' % (name,))
+
+        path = os.path.join(dest, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
 
     def listCabFiles(self):
         '''
@@ -213,41 +578,185 @@ class CabLab(FileLab):
                 print('filename:%s' % (filename,))
 
         '''
-        cfh = self['CFHEADER']
-        for idx,cff in cfh.cfFileArray:
-            fileinfo = dict(size=cff.cbFile,attrs=cff.attribs)
-            fileinfo['comp'] = repr( cfh.cfDirArray[cff.iFolder]['typeCompress'] )
-            fileinfo['ifldr'] = cff.iFolder
-            fileinfo['uoff'] = cff.uoffFolderStart
-            yield cff.szName, fileinfo
+        comps = [ comp[fldr.comp] or str(fldr.comp) for fldr in self.getCabFolderInfo() ]
+        for info in self.getCabFileInfo():
+            fileinfo = dict(size=info.size,attrs=info.attrs)
+            # ifldr may be a continuation value ( 0xfffd-0xffff )
+            fileinfo['comp'] = comps[info.ifldr] if info.ifldr < len(comps) else None
+            fileinfo['ifldr'] = info.ifldr
+            fileinfo['uoff'] = info.uoff
+            yield info.name, fileinfo
 
     def iterCabData(self, off, cnt):
         '''
-        Yield CFDATA blocks within the cab.
+        Yield CFDATA blocks within the cab ( parsed one at a time ).
+        '''
+        abres = self._getCabDataRes()
+        for i in range(cnt):
+            cd = self.getStruct(off, CFDATA, abres=abres)
+            yield cd
+            off += 8 + abres + cd.cbData
+
+    def iterCabDataHdrs(self, off, cnt):
+        '''
+        Yield (off,cbData,cbUncomp) tuples for CFDATA blocks within the
+        cab without reading the payloads.  The off is the file offset of
+        the compressed payload.
+
+        Example:
+
+            for off,cbdata,cbuncomp in cab.iterCabDataHdrs(fldroff, cnt):
+                byts = cab.readAtOff(off, cbdata)
+
+        '''
+        abres = self._getCabDataRes()
+        for i in range(cnt):
+            csum,cbdata,cbuncomp = struct.unpack('<IHH', self.readAtOff(off, 8))
+            off += 8 + abres
+            yield off,cbdata,cbuncomp
+            off += cbdata
+
+    def _getCabDataRes(self):
+        return self['cab:info'].datares
+
+    def getFolderData(self, ifldr):
+        '''
+        Return a list of (off,cbData,cbUncomp) tuples for the CFDATA
+        blocks of a folder ( see iterCabDataHdrs ).
+
+        Example:
+
+            for off,cbdata,cbuncomp in cab.getFolderData(0):
+                dostuff()
+
+        '''
+        return self._cab_fldrdata[ifldr]
+
+    def _getFolderData(self, ifldr):
+        fldr = self.getCabFolderInfo()[ifldr]
+        return list( self.iterCabDataHdrs(fldr.off, fldr.cdata) )
+
+    def getFolderSize(self, ifldr):
+        '''
+        Retrieve the total uncompressed size ( in bytes ) of a folder.
         '''
+        return self._cab_fldridx[ifldr][-1][0]
 
+    def _getFolderIndex(self, ifldr):
+        # (uoff,coff) for the start of each CFDATA ( and the folder end )
         uoff = 0
-        abres = 0
+        coff = 0
+        ret = []
+        for off,cbdata,cbuncomp in self.getFolderData(ifldr):
+            ret.append( (uoff,coff) )
+            uoff += cbuncomp
+            coff += cbdata
+        ret.append( (uoff,coff) )
+        return ret
 
-        cfh = self['CFHEADER']
-        if cfh.flags & _F_RESERVE_PRESENT:
-            abres = cfh.cbOptFields.cbCFData
+    def _getFolderCkpts(self, ifldr):
+        # (uoff,coff,state) tuples ordered by uoff and their spacing
+        return {'step':self.ckptsize, 'ckpts':[ (0,0,None) ]}
 
-        cda = self.getStruct(off, varray(cnt, CFDATA, abres=abres))
-        
-        for idx,cd in cda:
-            yield cd
+    def _needCheckPoint(self, ifldr, uoff):
+        if self.ckptsize == None:
+            return False
+
+        info = self._cab_ckpts[ifldr]
+        return uoff - info['ckpts'][-1][0] >= info['step'] and uoff < self.getFolderSize(ifldr)
+
+    def _addCheckPoint(self, ifldr, uoff, coff, state):
+        info = self._cab_ckpts[ifldr]
+
+        ckpts = info['ckpts']
+        ckpts.append( (uoff,coff,state) )
+
+        # thin out the checkpoints ( keeping the folder start )
+        if len(ckpts) > self.ckptmax:
+            ckpts[:] = ckpts[::2]
+            info['step'] *= 2
+
+    def _getCheckPoint(self, ifldr, uoff):
+        '''
+        Return the nearest (uoff,coff,state) resume point before uoff.
+        '''
+        fldr = self.getCabFolderInfo()[ifldr]
+        if fldr.comp & 3 == comp.NONE:
+            # uncompressed folders may resume at any CFDATA
+            fidx = self._cab_fldridx[ifldr]
+            i = bisect.bisect_right(fidx, (uoff,float('inf'))) - 1
+            return fidx[i] + (None,)
+
+        ckpts = self._cab_ckpts[ifldr]['ckpts']
+        i = bisect.bisect_right([ c[0] for c in ckpts ], uoff) - 1
+        return ckpts[i]
+
+    def iterFolderFrames(self, ifldr, coff=0):
+        '''
+        Yield the raw ( compressed ) CFDATA payloads of a folder starting
+        at the compressed byte offset coff.  Each payload is read from
+        the file as it is consumed.
+        '''
+        for off,cbdata,cbuncomp in self.getFolderData(ifldr):
+            if coff >= cbdata:
+                coff -= cbdata
+                continue
+
+            yield self.readAtOff(off + coff, cbdata - coff)
+            coff = 0
+
+    def iterFolderBytes(self, ifldr, uoff=0):
+        '''
+        Yield decompressed byte blocks for a folder starting at the
+        uncompressed offset uoff ( resuming from the nearest checkpoint ).
+
+        Example:
+
+            for byts in cab.iterFolderBytes(0):
+                fd.write(byts)
+
+        '''
+        fldr = self.getCabFolderInfo()[ifldr]
+        calg = fldr.comp & 3
+
+        ckpt = self._getCheckPoint(ifldr, uoff)
+        skip = uoff - ckpt[0]
+        for byts in self.decomps[calg](ifldr, fldr.comp, ckpt):
+            if skip >= len(byts):
+                skip -= len(byts)
+                continue
+
+            if skip:
+                byts = byts[skip:]
+                skip = 0
+
+            yield byts
+
+    def openCabFile(self, name):
+        '''
+        Return a file like object for the named file within the cab.
+
+        Example:
+
+            fd = cab.openCabFile('foo.inf')
+            byts = fd.read()
+
+        '''
+        info = self.get('filesbyname').get(name)
+        if info == None:
+            raise OffCabFile('File not found: %r' % (name,))
+
+        return CabMemberFile(self, info.ifldr, info.uoff, info.size)
 
     def getCabVersion(self):
         '''
         Retrieve a version tuple for the CAB file.
         '''
-        hdr = self['CFHEADER']
-        return ( hdr.versionMajor, hdr.versionMinor )
+        return self['cab:info'].version
 
     def getCabSize(self):
         '''
         Retrieve the size ( in bytes ) of the CAB file.
         '''
-        return self['CFHEADER'].cbCabinet
+        return self['cab:info'].size
 
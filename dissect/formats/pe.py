@@ -1,11 +1,45 @@
 '''
 The dissect module for parsing PE files.
 '''
+import sys
+import math
+import array
+import bisect
+import struct
+import hashlib
+import collections
+
 from vstruct2.types import *
+from dissect.common import LruKeyCache
+from dissect.filelab import findNull
 from dissect.bexlab import *
 
 DOS_MAGIC = 0x5a4d
 
+TABLE_CHUNK = 4096  # bytes read at a time for null terminated tables
+HEADER_READ = 1024  # initial read size for the DOS / NT headers
+SECTION_CHUNK = 1024 * 1024 # read size when streaming section data
+VERSION_MAX = 64 * 1024     # max bytes of an RT_VERSION resource to parse
+RESOURCE_DEPTH = 3          # type / name / lang
+
+_FILE_HEADER_FMT = '<HHIIIHH'
+_OPT_HEADER_FMT = '<HBBIIIIIIIII6HIIIIHHIIIIII'
+_OPT_HEADER64_FMT = '<HBBIIIIIQII6HIIIIHHQQQQII'
+_NT_HEADERS_MAX = 24 + struct.calcsize(_OPT_HEADER64_FMT) + 16 * 8
+
+# header only ( fast ) parser results
+PeHeaderInfo = collections.namedtuple('PeHeaderInfo', ('lfanew','machine','nsects','timestamp','characteristics',
+                                                       'magic','entry','imagebase','sizeofimage','sizeofheaders',
+                                                       'checksum','subsystem','dllchars','optoff','dirsoff',
+                                                       'sectoff','dirs'))
+
+PeResource = collections.namedtuple('PeResource', ('type','name','lang','rva','size','codepage'))
+PeVersionInfo = collections.namedtuple('PeVersionInfo', ('fixed','strings','translations'))
+PeUnwindInfo = collections.namedtuple('PeUnwindInfo', ('version','flags','prolog','framereg','frameoff',
+                                                       'codes','handler','chained'))
+
+class PeHeaderError(Exception):pass
+
 IMAGE_DLLCHARACTERISTICS_RESERVED_1      = 1
 IMAGE_DLLCHARACTERISTICS_RESERVED_2      = 2
 IMAGE_DLLCHARACTERISTICS_RESERVED_4      = 4
@@ -38,17 +72,23 @@ IMAGE_SUBSYSTEM_WINDOWS_BOOT_APPLICATION    = 16 #Boot application.
 IMAGE_FILE_MACHINE_I386  = 0x014c
 IMAGE_FILE_MACHINE_IA64  = 0x0200
 IMAGE_FILE_MACHINE_AMD64 = 0x8664
+IMAGE_FILE_MACHINE_ARM64 = 0xaa64
+
+IMAGE_NT_OPTIONAL_HDR32_MAGIC = 0x10b # PE32
+IMAGE_NT_OPTIONAL_HDR64_MAGIC = 0x20b # PE32+
 
 machine_names = {
     IMAGE_FILE_MACHINE_I386: 'i386',
     IMAGE_FILE_MACHINE_IA64: 'ia64',
     IMAGE_FILE_MACHINE_AMD64: 'amd64',
+    IMAGE_FILE_MACHINE_ARM64: 'arm64',
 }
 
 machine_ptr_sizes = {
     IMAGE_FILE_MACHINE_I386: 4,
     IMAGE_FILE_MACHINE_IA64: 8,
     IMAGE_FILE_MACHINE_AMD64: 8,
+    IMAGE_FILE_MACHINE_ARM64: 8,
 }
 
 IMAGE_REL_BASED_ABSOLUTE              = 0
@@ -133,6 +173,33 @@ UNW_FLAG_EHANDLER   = 0x1
 UNW_FLAG_UHANDLER   = 0x2
 UNW_FLAG_CHAININFO  = 0x4
 
+# UNWIND_CODE operations
+UWOP_PUSH_NONVOL        = 0
+UWOP_ALLOC_LARGE        = 1
+UWOP_ALLOC_SMALL        = 2
+UWOP_SET_FPREG          = 3
+UWOP_SAVE_NONVOL        = 4
+UWOP_SAVE_NONVOL_FAR    = 5
+UWOP_EPILOG             = 6     # ( UWOP_SAVE_XMM in version 1 )
+UWOP_SPARE_CODE         = 7     # ( UWOP_SAVE_XMM_FAR in version 1 )
+UWOP_SAVE_XMM128        = 8
+UWOP_SAVE_XMM128_FAR    = 9
+UWOP_PUSH_MACHFRAME     = 10
+
+# number of UNWIND_CODE slots used by each operation
+uwop_slots = {
+    UWOP_PUSH_NONVOL:1,
+    UWOP_ALLOC_SMALL:1,
+    UWOP_SET_FPREG:1,
+    UWOP_SAVE_NONVOL:2,
+    UWOP_SAVE_NONVOL_FAR:3,
+    UWOP_EPILOG:2,
+    UWOP_SPARE_CODE:3,
+    UWOP_SAVE_XMM128:2,
+    UWOP_SAVE_XMM128_FAR:3,
+    UWOP_PUSH_MACHFRAME:1,
+}
+
 # Resource Types
 RT_CURSOR           = 1
 RT_BITMAP           = 2
@@ -451,37 +518,294 @@ class SignatureEntry(VStruct):
     def _onSetSize(self, valu):
         self['pkcs7'].vsResize(valu)
 
+def _getEntropy(counts, size):
+    # shannon entropy ( bits per byte ) from a byte histogram
+    if size == 0:
+        return 0.0
+
+    ent = sum( c * math.log2(c) for c in counts.values() if c )
+    return math.log2(size) - ent / size
+
+def _iterVerBlocks(byts, off, end):
+    # yield (key,valoff,valsize,wtype,childoff,blockend) for each
+    # VS_VERSIONINFO style block in byts[off:end]
+    while off + 6 <= end:
+
+        wlen,vlen,wtype = struct.unpack_from('<HHH', byts, off)
+        if wlen < 6:
+            return
+
+        bend = min(off + wlen, end)
+
+        kend = findNull(byts, 2, off + 6, bend)
+        if kend == -1:
+            return
+
+        key = byts[off + 6:kend].decode('utf-16le', 'replace')
+
+        # text values are sized in words
+        voff = (kend + 2 + 3) & ~3
+        vsize = vlen
+        if wtype == 1:
+            vsize *= 2
+
+        yield key, voff, min(vsize, max(0, bend - voff)), wtype, (voff + vsize + 3) & ~3, bend
+
+        off = (bend + 3) & ~3
+
+def parseVersionInfo(byts):
+    '''
+    Parse the bytes of an RT_VERSION resource into a PeVersionInfo.
+
+    Example:
+
+        vinfo = parseVersionInfo(byts)
+        print( vinfo.strings.get('ProductName') )
+
+    '''
+    fixed = None
+    strings = {}
+    translations = []
+
+    for key,voff,vsize,wtype,coff,bend in _iterVerBlocks(byts, 0, len(byts)):
+
+        if key != 'VS_VERSION_INFO':
+            break
+
+        if vsize >= 52:
+            fixed = VS_FIXEDFILEINFO()
+            fixed.vsParse( byts[voff:voff + 52] )
+
+        for key,voff,vsize,wtype,coff,bend in _iterVerBlocks(byts, coff, bend):
+
+            if key == 'StringFileInfo':
+                # StringTable blocks ( one per lang / codepage )
+                for tkey,tvoff,tvsize,twtype,tcoff,tbend in _iterVerBlocks(byts, coff, bend):
+                    for skey,svoff,svsize,swtype,scoff,sbend in _iterVerBlocks(byts, tcoff, tbend):
+                        val = byts[svoff:svoff + svsize].decode('utf-16le', 'replace')
+                        strings.setdefault(skey, val.split('\x00')[0])
+
+            elif key == 'VarFileInfo':
+                for vkey,vvoff,vvsize,vwtype,vcoff,vbend in _iterVerBlocks(byts, coff, bend):
+                    if vkey == 'Translation':
+                        vals = byts[vvoff:vvoff + vvsize - vvsize % 4]
+                        translations.extend( struct.iter_unpack('<HH', vals) )
+
+        break
+
+    return PeVersionInfo(fixed, strings, translations)
+
+def parsePeHeaderInfo(read):
+    '''
+    Parse a PeHeaderInfo using read(off,size) ( or return None ).
+
+    The DOS and NT headers are usually within the first HEADER_READ
+    bytes, so this is typically one read.  The PE32 / PE32+ layout is
+    chosen by the optional header magic ( PeHeaderError is raised for
+    an unknown magic ).
+
+    Example:
+
+        info = parsePeHeaderInfo( lambda off,size: byts[off:off+size] )
+        if info != None:
+            print('sections: %d' % (info.nsects,))
+
+    '''
+    byts = read(0, HEADER_READ)
+    if len(byts) < 64 or byts[:2] != b'MZ':
+        return None
+
+    lfanew = struct.unpack_from('<I', byts, 0x3c)[0]
+
+    ntoff = lfanew
+    if lfanew + _NT_HEADERS_MAX > len(byts) and len(byts) == HEADER_READ:
+        byts = read(lfanew, _NT_HEADERS_MAX)
+        ntoff = 0
+
+    if len(byts) < ntoff + 24 or byts[ntoff:ntoff + 2] != b'PE':
+        return None
+
+    machine,nsects,timestamp,symoff,nsyms,optsize,chars = struct.unpack_from(_FILE_HEADER_FMT, byts, ntoff + 4)
+
+    optoff = ntoff + 24
+    if len(byts) < optoff + 2:
+        return None
+
+    magic = struct.unpack_from('<H', byts, optoff)[0]
+    if magic == IMAGE_NT_OPTIONAL_HDR32_MAGIC:
+        ofmt = _OPT_HEADER_FMT
+    elif magic == IMAGE_NT_OPTIONAL_HDR64_MAGIC:
+        ofmt = _OPT_HEADER64_FMT
+    else:
+        raise PeHeaderError('Invalid optional header magic: 0x%.4x' % (magic,))
+
+    dirsoff = optoff + struct.calcsize(ofmt)
+    if len(byts) < dirsoff:
+        return None
+
+    # ( PE32 has the extra BaseOfData field, so index ImageBase
+    # and the fields after it from the end )
+    opt = struct.unpack_from(ofmt, byts, optoff)
+    entry,imagebase = opt[6],opt[-21]
+    sizeofimage,sizeofheaders,checksum,subsystem,dllchars = opt[-11:-6]
+
+    ndirs = min(16, opt[-1], (len(byts) - dirsoff) // 8)
+    dirs = tuple( struct.iter_unpack('<II', byts[dirsoff:dirsoff + ndirs * 8]) )
+
+    return PeHeaderInfo(lfanew, machine, nsects, timestamp, chars,
+                        magic, entry, imagebase, sizeofimage, sizeofheaders,
+                        checksum, subsystem, dllchars, lfanew + 24, lfanew + dirsoff - ntoff,
+                        lfanew + 24 + optsize, dirs)
+
+def getPeHeaderInfo(fd, off=0):
+    '''
+    Parse a PeHeaderInfo from a file object ( or return None ).
+
+    Example:
+
+        info = getPeHeaderInfo(fd)
+        if info != None and info.machine == IMAGE_FILE_MACHINE_AMD64:
+            dostuff()
+
+    '''
+    def read(roff, size):
+        fd.seek(off + roff)
+        return fd.read(size)
+
+    return parsePeHeaderInfo(read)
+
+class PeExports(object):
+    '''
+    An array backed table of PE exports with name / rva indexes.
+
+    Example:
+
+        exps = plab.getExports()
+
+        ordinal = exps.getOrdByName('CreateFileW')
+        name = exps.getNameByRva(rva)
+
+        fwd = exps.getForwarder(ordinal)
+        if fwd != None:
+            print('forwarded to: %s' % (fwd,))
+
+    '''
+    def __init__(self, base, rvas, names, nameidxs, fwds):
+        self.base = base
+        self.rvas = rvas            # array of function rvas ( by ordinal - base )
+        self.names = names          # list of export names
+        self.nameidxs = nameidxs    # array of function index for each name
+        self.fwds = fwds            # { index:'DLL.Func' } for forwarded exports
+
+        self._ord_byname = {}
+        self._name_byrva = {}
+
+        for name,idx in zip(names,nameidxs):
+            self._ord_byname.setdefault(name, base + idx)
+            if idx not in fwds:
+                self._name_byrva.setdefault(rvas[idx], name)
+
+    def __len__(self):
+        return len(self.rvas)
+
+    def __iter__(self):
+        '''
+        Yield (rva,info) tuples for each exported function.
+        '''
+        byidx = collections.defaultdict(list)
+        for name,idx in zip(self.names,self.nameidxs):
+            byidx[idx].append(name)
+
+        for idx,rva in enumerate(self.rvas):
+            if rva == 0:
+                continue
+
+            fwd = self.fwds.get(idx)
+            for name in byidx.get(idx, (None,)):
+                yield rva, {'name':name,'ord':self.base + idx,'fwd':fwd}
+
+    def getOrdByName(self, name):
+        '''
+        Return the ordinal for an export name ( or None ).
+        '''
+        return self._ord_byname.get(name)
+
+    def getRvaByOrd(self, ordinal):
+        '''
+        Return the rva for an export ordinal ( or None ).
+        '''
+        idx = ordinal - self.base
+        if idx < 0 or idx >= len(self.rvas) or self.rvas[idx] == 0:
+            return None
+        return self.rvas[idx]
+
+    def getRvaByName(self, name):
+        '''
+        Return the rva for an export name ( or None ).
+        '''
+        ordinal = self._ord_byname.get(name)
+        if ordinal == None:
+            return None
+        return self.getRvaByOrd(ordinal)
+
+    def getNameByRva(self, rva):
+        '''
+        Return the ( first ) export name for a function rva ( or None ).
+        '''
+        return self._name_byrva.get(rva)
+
+    def getForwarder(self, ordinal):
+        '''
+        Return the forwarder string ( "DLL.Func" ) for an ordinal ( or None ).
+        '''
+        return self.fwds.get(ordinal - self.base)
+
 class PeLab(BexLab):
 
     def __init__(self, fd, off=0):
 
         BexLab.__init__(self, fd, off=off)
 
-        dos = self.getStruct(self.off,IMAGE_DOS_HEADER)
-        nt = self.getStruct(self.off + dos.e_lfanew, IMAGE_NT_HEADERS)
-
-        if nt.FileHeader.Machine in (IMAGE_FILE_MACHINE_AMD64, IMAGE_FILE_MACHINE_IA64):
-            nt = self.getStruct( dos.e_lfanew, IMAGE_NT_HEADERS64)
+        info = parsePeHeaderInfo( lambda roff,size: self.readAtOff(self.off + roff, size, shortok=True) )
+        if info == None:
+            raise PeHeaderError('Invalid PE Header')
 
         # set up some of the generic binary executable fields
 
-        self.set('pe:IMAGE_DOS_HEADER', dos )
-        self.set('pe:IMAGE_NT_HEADERS', nt )
+        self.set('pe:header', info )
 
-        self.set('bex:arch', machine_names.get(nt.FileHeader.Machine))
-        self.set('bex:ptr:size', machine_ptr_sizes.get(nt.FileHeader.Machine))
-        self.set('bex:ptr:base', nt.OptionalHeader.ImageBase )
+        self.set('bex:arch', machine_names.get(info.machine))
+        self.set('bex:ptr:size', 8 if info.magic == IMAGE_NT_OPTIONAL_HDR64_MAGIC else 4)
+        self.set('bex:ptr:base', info.imagebase )
 
         # add on-demand parsers for additional fields
+        self.add('pe:IMAGE_DOS_HEADER', self._getPeDosHdr )
+        self.add('pe:IMAGE_NT_HEADERS', self._getPeNtHdrs )
+
         self.add('pe:dllname', self._getPeDllName)
         self.add('pe:IMAGE_EXPORT_DIRECTORY', self._getPeExpDir )
+        self.add('pe:exports', self._getPeExports )
+
+        self.add('pe:runtime_functions', self._getPeRuntimeFuncs )
+        self._pe_unwinds = LruKeyCache( self._getUnwindInfo )
+
+        # materialized ( and evictable ) list of iterResources()
+        self.add('pe:resources', self._getPeResources, evict=True )
+        self.add('pe:versioninfo', self._getPeVersionInfo )
 
         self.add('pe:sections', self._getPeSects )
         self.add('pe:sections:byname', self._getPeSectsByName )
 
         self.add('bex:mem:maps', self._getMemMaps )
         #self.add('bex:mem:secs', self._getMemSecs )
-        #self.add('bex:imports', self._getPeImports )
+
+        # potentially large tables may be dropped and re-parsed.  these
+        # keys hold lists ( a cached generator could only be consumed
+        # once ), use iterImports() / iterExports() / iterRelocs() to
+        # stream them without building the list.
+        self.add('bex:imports', self._getBexImports, evict=True )
+        self.add('bex:exports', self._getBexExports, evict=True )
+        self.add('bex:relocs', self._getBexRelocs, evict=True )
 
     def getSectByName(self, name):
         '''
@@ -494,6 +818,535 @@ class PeLab(BexLab):
         '''
         return self.get('pe:sections:byname').get(name)
 
+    def iterSectionData(self, name, chunk=SECTION_CHUNK):
+        '''
+        Yield the raw data for a section ( by name ) in chunks.
+
+        Example:
+
+            for byts in plab.iterSectionData('.text'):
+                dostuff(byts)
+
+        '''
+        sect = self.getSectByName(name)
+        if sect == None:
+            return
+
+        yield from self._iterSectData(sect, chunk)
+
+    def hashSections(self, algos=('md5','sha256'), chunk=SECTION_CHUNK):
+        '''
+        Hash the raw data and compute the entropy of each section.
+
+        Each section is read once ( in chunks ) and fed to all the
+        hashlib algos and the byte histogram.  Returns a list of
+        (name,info) tuples in section table order.
+
+        Example:
+
+            for name,info in plab.hashSections():
+                print('%s %s %.2f' % (name,info['sha256'],info['entropy']))
+
+        '''
+        ret = []
+        for idx,sect in self.get('pe:sections'):
+
+            hashes = [ (algo,hashlib.new(algo)) for algo in algos ]
+            counts = collections.Counter()
+
+            size = 0
+            for byts in self._iterSectData(sect, chunk):
+                for algo,h in hashes:
+                    h.update(byts)
+
+                counts.update(byts)
+                size += len(byts)
+
+            info = { algo:h.hexdigest() for (algo,h) in hashes }
+            info['size'] = size
+            info['entropy'] = _getEntropy(counts, size)
+
+            ret.append( (sect.Name, info) )
+
+        return ret
+
+    def getAuthentihash(self, algo='sha256', chunk=SECTION_CHUNK):
+        '''
+        Return the Authenticode digest ( bytes ) of the PE file.
+
+        The file is streamed once, skipping the CheckSum field, the
+        certificate table data directory entry and the certificate
+        table itself.
+
+        Example:
+
+            digest = plab.getAuthentihash('sha1')
+
+        '''
+        info = self.get('pe:header')
+
+        skips = [ (info.optoff + 64, 4) ]
+
+        if len(info.dirs) > IMAGE_DIRECTORY_ENTRY_SECURITY:
+            skips.append( (info.dirsoff + IMAGE_DIRECTORY_ENTRY_SECURITY * 8, 8) )
+
+        # the security directory "rva" is a file offset
+        ddir = self.getDataDirectory(IMAGE_DIRECTORY_ENTRY_SECURITY)
+        if ddir != None:
+            skips.append( ddir )
+
+        h = hashlib.new(algo)
+
+        off = 0
+        for skipoff,skipsize in sorted(skips):
+            for byts in self._iterFileData(off, skipoff - off, chunk):
+                h.update(byts)
+            off = max(off, skipoff + skipsize)
+
+        for byts in self._iterFileData(off, self.getSize() - off, chunk):
+            h.update(byts)
+
+        return h.digest()
+
+    def computeChecksum(self, chunk=SECTION_CHUNK):
+        '''
+        Compute the optional header CheckSum value for the PE file.
+
+        Example:
+
+            if plab.computeChecksum() != plab.getHeaderInfo().checksum:
+                print('checksum mismatch!')
+
+        '''
+        info = self.get('pe:header')
+        size = self.getSize()
+
+        # the checksum is a ones' complement sum of 16 bit words.
+        # 2**16 % 0xffff == 1, so summing 64 bit ( little endian )
+        # words and reducing mod 0xffff gives the same result with
+        # a quarter of the python level work.
+        # chunks must hold whole words ( and at least one of them )
+        chunk = max(8, chunk - chunk % 8)
+
+        total = 0
+        for byts in self._iterFileData(0, size, chunk):
+
+            view = memoryview(byts)
+            qlen = len(view) - len(view) % 8
+
+            words = view[:qlen].cast('Q')
+            if sys.byteorder == 'big':
+                words = array.array('Q', words)
+                words.byteswap()
+
+            total += sum(words)
+            # only the last chunk may have a tail
+            total += int.from_bytes(view[qlen:], 'little')
+
+        # the CheckSum field itself is summed as zero
+        csumoff = info.optoff + 64
+        for i,b in enumerate( self.readAtOff(csumoff, 4) ):
+            total -= b << ( 8 * ((csumoff + i) % 8) )
+
+        csum = total % 0xffff
+        if csum == 0 and total:
+            csum = 0xffff
+
+        return (csum + size) & 0xffffffff
+
+    def getFunctionByRva(self, rva):
+        '''
+        Return the (begin,end,unwind) rvas of the .pdata function
+        which contains rva ( or None ).
+
+        Example:
+
+            func = plab.getFunctionByRva(rva)
+            if func != None:
+                begin,end,unwind = func
+
+        '''
+        begins,ends,unwinds = self.get('pe:runtime_functions')
+
+        i = bisect.bisect_right(begins, rva) - 1
+        if i < 0 or rva >= ends[i]:
+            return None
+
+        return begins[i],ends[i],unwinds[i]
+
+    def getUnwindInfo(self, rva):
+        '''
+        Return a PeUnwindInfo for the UNWIND_INFO at rva ( or None ).
+
+        Unwind codes are decoded to (prologoff,op,opinfo,operand)
+        tuples where operand is the allocation size / stack offset
+        ( or None ).  Decoded entries are cached ( LRU ).
+
+        Example:
+
+            begin,end,unwind = plab.getFunctionByRva(rva)
+            uinfo = plab.getUnwindInfo(unwind)
+            if uinfo.chained != None:
+                begin,end,unwind = uinfo.chained
+
+        '''
+        return self._pe_unwinds[rva]
+
+    def iterResources(self):
+        '''
+        Walk the resource directory and yield PeResource tuples.
+
+        Resource data is not read ( see iterResourceData ).  Type,
+        name and lang are integer ids or strings for named entries.
+
+        Example:
+
+            for res in plab.iterResources():
+                if res.type == RT_MANIFEST:
+                    xml = b''.join( plab.iterResourceData(res) )
+
+        Notes:
+
+            * the pe:resources key is a ( cached ) list of these tuples,
+              use iterResources() to walk them without building it
+
+        '''
+        ddir = self.getDataDirectory(IMAGE_DIRECTORY_ENTRY_RESOURCE)
+        if ddir == None:
+            return
+
+        base = self.rvaToOff(ddir[0])
+        if base == None:
+            return
+
+        yield from self._iterResDir(base, 0, (), set())
+
+    def iterResourceData(self, res, chunk=SECTION_CHUNK):
+        '''
+        Yield the bytes of a PeResource in chunks.
+
+        Example:
+
+            with open('icon.bin','wb') as fd:
+                for byts in plab.iterResourceData(res):
+                    fd.write(byts)
+
+        '''
+        off = self.rvaToOff(res.rva)
+        if off == None:
+            return
+
+        yield from self._iterFileData(off, res.size, chunk)
+
+    def getVersionInfo(self):
+        '''
+        Return a PeVersionInfo for the RT_VERSION resource ( or None ).
+
+        PeVersionInfo.fixed is a VS_FIXEDFILEINFO ( or None ), strings
+        is a dict of the StringFileInfo values and translations is a
+        list of (lang,codepage) tuples.
+
+        Example:
+
+            vinfo = plab.getVersionInfo()
+            if vinfo != None:
+                print( vinfo.strings.get('FileVersion') )
+
+        '''
+        return self.get('pe:versioninfo')
+
+    def getHeaderInfo(self):
+        '''
+        Return the PeHeaderInfo for the PE file.
+
+        Example:
+
+            info = plab.getHeaderInfo()
+            print('entry: 0x%.8x' % (info.entry,))
+
+        '''
+        return self.get('pe:header')
+
+    def getDataDirectory(self, idx):
+        '''
+        Return an (rva,size) tuple for a data directory ( or None ).
+
+        Example:
+
+            ddir = plab.getDataDirectory(IMAGE_DIRECTORY_ENTRY_IMPORT)
+            if ddir != None:
+                rva,size = ddir
+
+        '''
+        dirs = self.get('pe:header').dirs
+        if idx >= len(dirs) or dirs[idx][0] == 0:
+            return None
+
+        return dirs[idx]
+
+    def iterImports(self):
+        '''
+        Yield (rva,info) tuples for each import address table slot.
+
+        Example:
+
+            for rva,info in plab.iterImports():
+                print('%s.%s' % (info['lib'],info['name']))
+
+        Notes:
+
+            * info['name'] is None for imports by ordinal ( info['ord'] )
+            * the bex:imports key is a ( cached ) list of these tuples,
+              use iterImports() to stream them without building it
+
+        '''
+        ddir = self.getDataDirectory(IMAGE_DIRECTORY_ENTRY_IMPORT)
+        if ddir == None:
+            return
+
+        off = self.rvaToOff(ddir[0])
+        if off == None:
+            return
+
+        if self.get('bex:ptr:size') == 8:
+            tfmt = '<Q'
+            ordflag = 1 << 63
+        else:
+            tfmt = '<I'
+            ordflag = 1 << 31
+
+        descs = []
+        for desc in self._iterTable(off, '<IIIII', size=max(ddir[1], 20)):
+            oft,tds,fwd,namerva,ft = desc
+            if namerva == 0 and ft == 0:
+                break
+            descs.append(desc)
+
+        for oft,tds,fwd,namerva,ft in descs:
+
+            lib = None
+            liboff = self.rvaToOff(namerva)
+            if liboff != None:
+                lib = self.strAtOff(liboff)
+
+            # the lookup table may be missing ( use the IAT )
+            toff = self.rvaToOff(oft or ft)
+            if toff == None:
+                continue
+
+            vals = []
+            for val, in self._iterTable(toff, tfmt):
+                if val == 0:
+                    break
+                vals.append(val)
+
+            nrvas = [ (val & 0x7fffffff) + 2 for val in vals if not val & ordflag ]
+            noffs = iter( self.rvasToOffs(nrvas) )
+
+            size = struct.calcsize(tfmt)
+            for i,val in enumerate(vals):
+
+                if val & ordflag:
+                    yield ft + (i * size), {'lib':lib,'name':None,'ord':val & 0xffff}
+                    continue
+
+                name = None
+                noff = next(noffs)
+                if noff != None:
+                    name = self.strAtOff(noff)
+
+                yield ft + (i * size), {'lib':lib,'name':name,'ord':None}
+
+    def getExports(self):
+        '''
+        Return a PeExports table ( or None if there is no export directory ).
+
+        Example:
+
+            exps = plab.getExports()
+            if exps != None:
+                rva = exps.getRvaByName('foo')
+
+        '''
+        return self.get('pe:exports')
+
+    def iterExports(self):
+        '''
+        Yield (rva,info) tuples for each exported function.
+
+        Example:
+
+            for rva,info in plab.iterExports():
+                print('%d %s' % (info['ord'],info['name']))
+
+        Notes:
+
+            * functions exported by several names are yielded once per name
+            * info['name'] is None for functions exported only by ordinal
+            * info['fwd'] is the "DLL.Func" string for forwarded exports
+            * the bex:exports key is a ( cached ) list of these tuples
+
+        '''
+        exps = self.getExports()
+        if exps == None:
+            return
+
+        yield from exps
+
+    def iterRelocs(self):
+        '''
+        Yield (rva,type) tuples for each base relocation.
+
+        Example:
+
+            for rva,rtype in plab.iterRelocs():
+                if rtype == IMAGE_REL_BASED_DIR64:
+                    dostuff(rva)
+
+        Notes:
+
+            * the bex:relocs key is a ( cached ) list of these tuples,
+              use iterRelocs() to stream them without building it
+
+        '''
+        ddir = self.getDataDirectory(IMAGE_DIRECTORY_ENTRY_BASERELOC)
+        if ddir == None:
+            return
+
+        off = self.rvaToOff(ddir[0])
+        if off == None:
+            return
+
+        byts = self.readAtOff(off, ddir[1], shortok=True)
+
+        pos = 0
+        while pos + 8 <= len(byts):
+
+            pagerva,blksize = struct.unpack_from('<II', byts, pos)
+            if blksize < 8:
+                break
+
+            count = ( min(blksize, len(byts) - pos) - 8 ) // 2
+            for ent, in struct.iter_unpack('<H', byts[pos + 8:pos + 8 + count * 2]):
+                rtype = ent >> 12
+                if rtype == IMAGE_REL_BASED_ABSOLUTE:
+                    continue
+
+                yield pagerva + (ent & 0xfff), rtype
+
+            pos += blksize
+
+    def _iterSectData(self, sect, chunk):
+        return self._iterFileData(sect.PointerToRawData, sect.SizeOfRawData, chunk)
+
+    def _iterFileData(self, off, size, chunk):
+        # yield up to size bytes from off in chunk sized reads
+        while size > 0:
+            byts = self.readAtOff(off, min(size, chunk), shortok=True)
+            if not len(byts):
+                return
+
+            yield byts
+
+            off += len(byts)
+            size -= len(byts)
+
+    def _getBexImports(self):
+        # bex:imports is materialized, iterImports() streams
+        return list( self.iterImports() )
+
+    def _getBexExports(self):
+        # bex:exports is materialized, iterExports() streams
+        return list( self.iterExports() )
+
+    def _getBexRelocs(self):
+        # bex:relocs is materialized, iterRelocs() streams
+        return list( self.iterRelocs() )
+
+    def _getPeExports(self):
+        edir = self.get('pe:IMAGE_EXPORT_DIRECTORY')
+        if edir == None:
+            return None
+
+        rvas = array.array('I', self._getRvaArray(edir.AddressOfFunctions, edir.NumberOfFunctions, '<I'))
+        namervas = self._getRvaArray(edir.AddressOfNames, edir.NumberOfNames, '<I')
+        nameidxs = array.array('H', self._getRvaArray(edir.AddressOfOrdinals, edir.NumberOfNames, '<H'))
+
+        # names and forwarders are usually within the export
+        # directory, so decode them from one buffer
+        exprva,expsize = self.getDataDirectory(IMAGE_DIRECTORY_ENTRY_EXPORT)
+        expmax = exprva + expsize
+
+        expbuf = b''
+        expoff = self.rvaToOff(exprva)
+        if expoff != None:
+            expbuf = bytes( self.readAtOff(expoff, expsize, shortok=True) )
+
+        def strAtRva(rva):
+            if rva >= exprva and rva < exprva + len(expbuf):
+                off = rva - exprva
+                end = expbuf.find(b'\x00', off)
+                if end == -1:
+                    end = len(expbuf)
+                return expbuf[off:end].decode('utf8')
+
+            off = self.rvaToOff(rva)
+            if off == None:
+                return None
+
+            return self.strAtOff(off)
+
+        names = []
+        idxs = array.array('H')
+        for nrva,idx in zip(namervas,nameidxs):
+            if idx >= len(rvas):
+                continue
+
+            name = strAtRva(nrva)
+            if name == None:
+                continue
+
+            names.append(name)
+            idxs.append(idx)
+
+        # an rva within the export directory is a forwarder string
+        fwds = {}
+        for idx,rva in enumerate(rvas):
+            if rva >= exprva and rva < expmax:
+                fwds[idx] = strAtRva(rva)
+
+        return PeExports(edir.Base, rvas, names, idxs, fwds)
+
+    def _getRvaArray(self, rva, count, fmt):
+        # read an array of count fmt values at rva in one read
+        off = self.rvaToOff(rva)
+        if off == None or count == 0:
+            return []
+
+        size = struct.calcsize(fmt)
+
+        byts = self.readAtOff(off, count * size, shortok=True)
+        byts = byts[:len(byts) - len(byts) % size]
+
+        return [ v for v, in struct.iter_unpack(fmt, byts) ]
+
+    def _iterTable(self, off, fmt, size=TABLE_CHUNK):
+        # yield fmt tuples from off ( in bulk reads ) until EOF
+        esize = struct.calcsize(fmt)
+        size += esize - 1
+        size -= size % esize
+
+        while True:
+            byts = self.readAtOff(off, size, shortok=True)
+            byts = byts[:len(byts) - len(byts) % esize]
+
+            yield from struct.iter_unpack(fmt, byts)
+
+            if len(byts) < size:
+                return
+
+            off += size
+
     def _getPeDllName(self):
 
         edir = self.get('pe:IMAGE_EXPORT_DIRECTORY')
@@ -506,25 +1359,203 @@ class PeLab(BexLab):
 
         return self.strAtOff(off)
 
+    def _getPeRuntimeFuncs(self):
+        # three parallel arrays of begin / end / unwind rvas
+        begins = array.array('I')
+        ends = array.array('I')
+        unwinds = array.array('I')
+
+        ddir = self.getDataDirectory(IMAGE_DIRECTORY_ENTRY_EXCEPTION)
+        if ddir == None:
+            return begins,ends,unwinds
+
+        off = self.rvaToOff(ddir[0])
+        if off == None:
+            return begins,ends,unwinds
+
+        byts = self.readAtOff(off, ddir[1] - ddir[1] % 12, shortok=True)
+
+        ents = array.array('I')
+        ents.frombytes( byts[:len(byts) - len(byts) % 12] )
+        if sys.byteorder == 'big':
+            ents.byteswap()
+
+        begins = ents[0::3]
+        ends = ents[1::3]
+        unwinds = ents[2::3]
+
+        # the table should be sorted, but don't trust it
+        if any( begins[i] > begins[i + 1] for i in range(len(begins) - 1) ):
+            trips = sorted( zip(begins,ends,unwinds) )
+            begins = array.array('I', [ t[0] for t in trips ])
+            ends = array.array('I', [ t[1] for t in trips ])
+            unwinds = array.array('I', [ t[2] for t in trips ])
+
+        return begins,ends,unwinds
+
+    def _getUnwindInfo(self, rva):
+        off = self.rvaToOff(rva)
+        if off == None:
+            return None
+
+        byts = self.readAtOff(off, 4, shortok=True)
+        if len(byts) < 4:
+            return None
+
+        verflags,prolog,ncodes,frame = struct.unpack('<BBBB', byts)
+        version = verflags & 0x7
+        flags = verflags >> 3
+
+        # codes are padded to an even count, then chain / handler info
+        size = 4 + ( (ncodes + 1) & ~1 ) * 2
+        byts = self.readAtOff(off, size + 12, shortok=True)
+        if len(byts) < 4 + ncodes * 2:
+            return None
+
+        slots = struct.unpack_from('<%dH' % ncodes, byts, 4)
+
+        codes = []
+
+        i = 0
+        while i < ncodes:
+            prologoff = slots[i] & 0xff
+            op = (slots[i] >> 8) & 0xf
+            opinfo = slots[i] >> 12
+
+            nslots = uwop_slots.get(op, 1)
+            operand = None
+
+            if op == UWOP_ALLOC_LARGE:
+                nslots = 2 + opinfo
+
+            if i + nslots > ncodes:
+                break
+
+            if op == UWOP_ALLOC_SMALL:
+                operand = opinfo * 8 + 8
+
+            elif op == UWOP_ALLOC_LARGE:
+                if opinfo == 0:
+                    operand = slots[i + 1] * 8
+                else:
+                    operand = slots[i + 1] | (slots[i + 2] << 16)
+
+            elif op == UWOP_SAVE_NONVOL:
+                operand = slots[i + 1] * 8
+
+            elif op == UWOP_SAVE_XMM128:
+                operand = slots[i + 1] * 16
+
+            elif op in (UWOP_SAVE_NONVOL_FAR, UWOP_SAVE_XMM128_FAR):
+                operand = slots[i + 1] | (slots[i + 2] << 16)
+
+            codes.append( (prologoff, op, opinfo, operand) )
+            i += nslots
+
+        handler = None
+        chained = None
+
+        if flags & UNW_FLAG_CHAININFO:
+            if len(byts) >= size + 12:
+                chained = struct.unpack_from('<III', byts, size)
+
+        elif flags & (UNW_FLAG_EHANDLER | UNW_FLAG_UHANDLER):
+            if len(byts) >= size + 4:
+                handler = struct.unpack_from('<I', byts, size)[0]
+
+        return PeUnwindInfo(version, flags, prolog, frame & 0xf, (frame >> 4) * 16,
+                            tuple(codes), handler, chained)
+
+    def _iterResDir(self, base, doff, path, seen):
+        # guard against directory loops in malformed files
+        if doff in seen or len(path) >= RESOURCE_DEPTH:
+            return
+
+        seen.add(doff)
+
+        hdr = self.readAtOff(base + doff, 16, shortok=True)
+        if len(hdr) < 16:
+            return
+
+        nnamed,nids = struct.unpack_from('<HH', hdr, 12)
+
+        byts = self.readAtOff(base + doff + 16, (nnamed + nids) * 8, shortok=True)
+        byts = byts[:len(byts) - len(byts) % 8]
+
+        for name,data in struct.iter_unpack('<II', byts):
+
+            if name & 0x80000000:
+                name = self._getResName(base + (name & 0x7fffffff))
+
+            if data & 0x80000000:
+                yield from self._iterResDir(base, data & 0x7fffffff, path + (name,), seen)
+                continue
+
+            ent = self.readAtOff(base + data, 16, shortok=True)
+            if len(ent) < 16:
+                continue
+
+            rva,size,codepage,resvd = struct.unpack('<IIII', ent)
+
+            # ( data entries above the lang level have no lang )
+            restype,resname,reslang = ( path + (name,None,None) )[:3]
+            yield PeResource(restype, resname, reslang, rva, size, codepage)
+
+    def _getResName(self, off):
+        # IMAGE_RESOURCE_DIR_STRING_U
+        byts = self.readAtOff(off, 2, shortok=True)
+        if len(byts) < 2:
+            return None
+
+        size = struct.unpack('<H', byts)[0] * 2
+        return bytes( self.readAtOff(off + 2, size, shortok=True) ).decode('utf-16le', 'replace')
+
+    def _getPeResources(self):
+        # pe:resources is materialized, iterResources() streams
+        return list( self.iterResources() )
+
+    def _getPeVersionInfo(self):
+        for res in self.iterResources():
+            if res.type != RT_VERSION:
+                continue
+
+            off = self.rvaToOff(res.rva)
+            if off == None:
+                continue
+
+            byts = bytes( self.readAtOff(off, min(res.size, VERSION_MAX), shortok=True) )
+            return parseVersionInfo(byts)
+
+        return None
+
+    def _getPeDosHdr(self):
+        return self.getStruct(self.off, IMAGE_DOS_HEADER)
+
+    def _getPeNtHdrs(self):
+        info = self.get('pe:header')
+
+        ncls = IMAGE_NT_HEADERS
+        if info.magic == IMAGE_NT_OPTIONAL_HDR64_MAGIC:
+            ncls = IMAGE_NT_HEADERS64
+
+        return self.getStruct(self.off + info.lfanew, ncls)
+
     def _getPeExpDir(self):
-        nt = self.get('pe:IMAGE_NT_HEADERS')
-        edir = nt.OptionalHeader.DataDirectory[IMAGE_DIRECTORY_ENTRY_EXPORT]
-        if edir.VirtualAddress == 0:
+        ddir = self.getDataDirectory(IMAGE_DIRECTORY_ENTRY_EXPORT)
+        if ddir == None:
             return None
 
-        eoff = self.rvaToOff(edir.VirtualAddress)
+        eoff = self.rvaToOff(ddir[0])
         if eoff == None:
             return None
 
         return self.getStruct(eoff,IMAGE_EXPORT_DIRECTORY)
 
     def _getPeSects(self):
-        dos = self.get('pe:IMAGE_DOS_HEADER')
-        nt = self.get('pe:IMAGE_NT_HEADERS')
+        info = self.get('pe:header')
 
-        off = dos.e_lfanew + len(nt)
-        scls = varray(nt.FileHeader.NumberOfSections, IMAGE_SECTION_HEADER)
-        return self.getStruct(off,scls)
+        scls = varray(info.nsects, IMAGE_SECTION_HEADER)
+        return self.getStruct(self.off + info.sectoff, scls)
 
     def _getPeSectsByName(self):
         return { s.Name:s for (i,s) in self.get('pe:sections') }
@@ -537,14 +1568,7 @@ class PeLab(BexLab):
         return  maps
 
 def isMimePe(fd):
-
-    dos = IMAGE_DOS_HEADER()
-    dos.vsLoad(fd,offset=0)
-
-    if dos.e_magic != DOS_MAGIC:
+    try:
+        return getPeHeaderInfo(fd) != None
+    except PeHeaderError:
         return False
-
-    nt = IMAGE_NT_HEADERS()
-    nt.vsLoad(fd, offset=dos.e_lfanew)
-
-    return nt.Signature[:2] == b'PE'
@@ -326,7 +326,8 @@ class PasswordRequired(Exception):pass
 class RarLab(FileLab):
 
     def __init__(self, fd):
-        FileLab.__init__(self, fd)
+        # the rar parser reads the header stream via self.fd
+        FileLab.__init__(self, fd, usemmap=False, cache=False)
         self.add('veroff', self._getVerOff )
         self.add('header', self._getRarHeader )
 
@@ -1,5 +1,73 @@
+import zlib
+import heapq
+import bisect
+import struct
 import unittest
 
+MSZIP_FRAME = 32768
+
+def deflate(byts, level=9, zdict=None):
+    # a raw deflate stream ( optionally with a preset dictionary )
+    if zdict:
+        comp = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return comp.compress(byts) + comp.flush()
+
+def mkMsZipFrames(byts):
+    # MSZIP "CK" frames where each frame uses the last 32k as history
+    frames = []
+    for off in range(0, len(byts), MSZIP_FRAME):
+        hist = byts[max(0, off - MSZIP_FRAME):off]
+        frames.append( b'CK' + deflate(byts[off:off + MSZIP_FRAME], zdict=hist) )
+    return frames
+
+def mkMsZipData(byts):
+    # (payload,cbUncomp) tuples for the CFDATA blocks of an MSZIP folder
+    frames = mkMsZipFrames(byts)
+    sizes = [ len(byts[off:off + MSZIP_FRAME]) for off in range(0, len(byts), MSZIP_FRAME) ]
+    return list( zip(frames, sizes) )
+
+def mkCab(folders, comp=1, mkdata=mkMsZipData, reserve=(0,0,0)):
+    # a cab with one folder per list of (name,byts) files
+    hdrres,fldrres,datares = reserve
+
+    datas = []
+    cffiles = b''
+    for ifldr,files in enumerate(folders):
+        blob = b''.join( byts for name,byts in files )
+
+        blks = mkdata(blob)
+        data = b''.join( struct.pack('<IHH', 0, len(payload), cbuncomp) + b'R' * datares + payload for payload,cbuncomp in blks )
+        datas.append( (data, len(blks)) )
+
+        uoff = 0
+        for name,byts in files:
+            cffiles += struct.pack('<IIHHHH', len(byts), uoff, ifldr, 0, 0, 0x20) + name + b'\x00'
+            uoff += len(byts)
+
+    flags = 0
+    opthdr = b''
+    if hdrres or fldrres or datares:
+        flags |= 0x0004
+        opthdr = struct.pack('<HBB', hdrres, fldrres, datares) + b'R' * hdrres
+
+    coffFiles = 36 + len(opthdr) + (8 + fldrres) * len(folders)
+    coffData = coffFiles + len(cffiles)
+
+    cffolders = b''
+    for data,cnt in datas:
+        cffolders += struct.pack('<IHH', coffData, cnt, comp) + b'R' * fldrres
+        coffData += len(data)
+
+    nfiles = sum( len(files) for files in folders )
+    hdr = struct.pack('<4sIIIIIBBHHHHH', b'MSCF', 0, coffData, 0, coffFiles, 0, 3, 1, len(folders), nfiles, flags, 0, 0)
+    return hdr + opthdr + cffolders + cffiles + b''.join( data for data,cnt in datas )
+
+def mkMsZipCab(*folders, **kwargs):
+    # an MSZIP cab with one folder per list of (name,byts) files
+    return mkCab(folders, reserve=kwargs.get('reserve', (0,0,0)))
+
 class DisTest(unittest.TestCase):
 
     def eq(self, x, y):
@@ -16,3 +84,251 @@ class DisTest(unittest.TestCase):
 
     def false(self, x):
         self.assertFalse(x)
+
+LZX_FRAME = 32768
+LZX_VERBATIM = 1
+LZX_ALIGNED = 2
+LZX_SLOTS = {15:30, 16:32, 17:34, 18:36, 19:38, 20:42, 21:50}
+
+class LzxBitWriter(object):
+    # MSB first bits packed into 16 bit little endian words
+    def __init__(self):
+        self.byts = bytearray()
+        self.val = 0
+        self.cnt = 0
+
+    def write(self, val, bits):
+        for i in range(bits - 1, -1, -1):
+            self.val = (self.val << 1) | ((val >> i) & 1)
+            self.cnt += 1
+            if self.cnt == 16:
+                self.byts += struct.pack('<H', self.val)
+                self.val = 0
+                self.cnt = 0
+
+    def align(self):
+        if self.cnt:
+            self.write(0, 16 - self.cnt)
+
+def _lzxPosSlots():
+    xbits = [0, 0, 0, 0]
+    while len(xbits) < 52:
+        xbits += [ min(17, len(xbits) // 2 - 1) ] * 2
+
+    pbase = [0]
+    for x in xbits[:-1]:
+        pbase.append( pbase[-1] + (1 << x) )
+
+    return xbits,pbase
+
+def _huffLens(freqs, maxbits=16):
+    # huffman code lengths ( at least two symbols, at most maxbits )
+    freqs = list(freqs)
+    for i in range(2):
+        if sum( 1 for f in freqs if f ) < 2:
+            freqs[freqs.index(0)] = 1
+
+    while True:
+        heap = [ (f, i, (i,)) for i,f in enumerate(freqs) if f ]
+        heapq.heapify(heap)
+
+        lens = [0] * len(freqs)
+        while len(heap) > 1:
+            f1,i1,s1 = heapq.heappop(heap)
+            f2,i2,s2 = heapq.heappop(heap)
+            for s in s1 + s2:
+                lens[s] += 1
+            heapq.heappush(heap, (f1 + f2, i1, s1 + s2))
+
+        if max(lens) <= maxbits:
+            return lens
+
+        freqs = [ (f + 1) // 2 if f else 0 for f in freqs ]
+
+def _huffCodes(lens):
+    # canonical codes ( as used by deflate and lzx ) by symbol
+    codes = {}
+    code = 0
+    for bits in range(1, max(lens) + 1):
+        for sym,slen in enumerate(lens):
+            if slen == bits:
+                codes[sym] = (code,bits)
+                code += 1
+        code <<= 1
+    return codes
+
+def _lzxParse(byts, wsize):
+    # greedy LZ77 parse into literals and (mlen,off) matches which never
+    # cross a frame boundary.  repeated offsets are tried first.
+    chains = {}
+    reps = [1, 1, 1]
+    toks = []
+
+    pos = 0
+    while pos < len(byts):
+        fend = min(len(byts), (pos // LZX_FRAME + 1) * LZX_FRAME)
+        maxlen = min(257, fend - pos)
+
+        def mlen(off):
+            if off > pos or off > wsize - 3:
+                return 0
+            n = 0
+            while n < maxlen and byts[pos + n] == byts[pos + n - off]:
+                n += 1
+            return n
+
+        best = (0, 0)
+        for off in reps:
+            best = max(best, (mlen(off), off))
+
+        key = bytes(byts[pos:pos + 3])
+        if best[0] < 3:
+            for cand in reversed( chains.get(key, ())[-16:] ):
+                best = max(best, (mlen(pos - cand), pos - cand))
+
+        size = 1
+        if best[0] >= 3:
+            size,off = best
+            toks.append( (size, off) )
+        else:
+            toks.append( byts[pos] )
+
+        for i in range(pos, pos + size):
+            chains.setdefault( bytes(byts[i:i + 3]), [] ).append(i)
+
+        pos += size
+
+    return toks
+
+def lzxCompress(byts, wbits=15, btype=LZX_VERBATIM, blksize=LZX_FRAME):
+    '''
+    A simple LZX encoder for tests which returns (payload,cbUncomp)
+    tuples with one ( word aligned ) payload per 32k frame.
+    '''
+    wsize = 1 << wbits
+    xbits,pbase = _lzxPosSlots()
+    nmain = 256 + (LZX_SLOTS[wbits] << 3)
+
+    # tokens are literals or (mainsym,lensym,slot,footer)
+    reps = [1, 1, 1]
+    toks = []
+    for tok in _lzxParse(byts, wsize):
+        if isinstance(tok, int):
+            toks.append( (tok, None, 1) )
+            continue
+
+        size,off = tok
+        if off == reps[0]:
+            slot = 0
+        elif off == reps[1]:
+            slot = 1
+            reps[0],reps[1] = reps[1],reps[0]
+        elif off == reps[2]:
+            slot = 2
+            reps[0],reps[2] = reps[2],reps[0]
+        else:
+            fmt = off + 2
+            slot = bisect.bisect_right(pbase, fmt) - 1
+            reps = [off, reps[0], reps[1]]
+
+        lensym = None
+        lhdr = size - 2
+        if lhdr >= 7:
+            lensym = lhdr - 7
+            lhdr = 7
+
+        footer = None
+        if slot > 2:
+            footer = (xbits[slot], off + 2 - pbase[slot])
+
+        toks.append( (256 + (slot << 3) + lhdr, (lensym, footer), size) )
+
+    # group the tokens into blocks of ( about ) blksize bytes
+    blocks = [[]]
+    size = 0
+    for tok in toks:
+        if size >= blksize:
+            blocks.append([])
+            size = 0
+        blocks[-1].append(tok)
+        size += tok[2]
+
+    bits = LzxBitWriter()
+    bits.write(0, 1) # no intel e8 translation
+
+    prevmain = [0] * nmain
+    prevlens = [0] * 249
+
+    ptlens = [4] * 12 + [5] * 8
+    ptcodes = _huffCodes(ptlens)
+
+    def wrtree(prev, lens, start, stop):
+        for l in ptlens:
+            bits.write(l, 4)
+        for i in range(start, stop):
+            bits.write( *ptcodes[ (prev[i] - lens[i]) % 17 ] )
+            prev[i] = lens[i]
+
+    aligned = btype == LZX_ALIGNED
+
+    ret = []
+    last = 0
+    upos = 0
+    for blk in blocks:
+
+        mfreq = [0] * nmain
+        lfreq = [0] * 249
+        afreq = [1] * 8
+        for sym,extra,tsize in blk:
+            mfreq[sym] += 1
+            if extra != None:
+                lensym,footer = extra
+                if lensym != None:
+                    lfreq[lensym] += 1
+                if aligned and footer != None and footer[0] >= 3:
+                    afreq[ footer[1] & 7 ] += 1
+
+        mlens = _huffLens(mfreq)
+        llens = _huffLens(lfreq)
+        alens = _huffLens(afreq, maxbits=7)
+
+        mcodes = _huffCodes(mlens)
+        lcodes = _huffCodes(llens)
+        acodes = _huffCodes(alens)
+
+        bits.write(btype, 3)
+        blen = sum( t[2] for t in blk )
+        bits.write(blen >> 8, 16)
+        bits.write(blen & 0xff, 8)
+
+        if aligned:
+            for l in alens:
+                bits.write(l, 3)
+
+        wrtree(prevmain, mlens, 0, 256)
+        wrtree(prevmain, mlens, 256, nmain)
+        wrtree(prevlens, llens, 0, 249)
+
+        for sym,extra,tsize in blk:
+            bits.write( *mcodes[sym] )
+            if extra != None:
+                lensym,footer = extra
+                if lensym != None:
+                    bits.write( *lcodes[lensym] )
+
+                if footer != None:
+                    ext,valu = footer
+                    if aligned and ext >= 3:
+                        bits.write(valu >> 3, ext - 3)
+                        bits.write( *acodes[valu & 7] )
+                    else:
+                        bits.write(valu, ext)
+
+            upos += tsize
+            if upos % LZX_FRAME == 0 or upos == len(byts):
+                bits.align()
+                size = (upos - 1) % LZX_FRAME + 1
+                ret.append( (bytes(bits.byts[last:]), size) )
+                last = len(bits.byts)
+
+    return ret
@@ -14,3 +14,28 @@ class BitLabTest(unittest.TestCase):
         bits = bitlab.BitStream(b'A', order='little')
         self.assertEqual( bits.cast(5), 16)
         self.assertEqual( bits.cast(3), 2)
+
+    def test_bitlab_reader(self):
+
+        bits = bitlab.BitReader(b'A', order='big')
+        self.assertEqual( bits.cast(5), 8)
+        self.assertEqual( bits.cast(3), 1)
+
+        bits = bitlab.BitReader(b'A', order='little')
+        self.assertEqual( bits.read(5), 1)
+        self.assertEqual( bits.cast(3, 'little'), 2)
+        self.assertRaises( bitlab.OffBitStream, bits.read, 1 )
+
+        bits = bitlab.BitReader([b'\xff\x01\x02', b'\x03\x04'], order='little')
+        self.assertEqual( bits.peek(12), 0x1ff )
+        bits.skip(3)
+        bits.align()
+        self.assertEqual( bits.getOffset(), 8 )
+        self.assertEqual( bits.readBytes(3), b'\x01\x02\x03' )
+        self.assertEqual( bits.read(8), 4 )
+
+        # msb first bits from 16 bit little endian words
+        bits = bitlab.BitReader([b'\x34\x12\x78', b'\x56'], order='big', wordswap=True)
+        self.assertEqual( bits.read(4), 1 )
+        self.assertEqual( bits.read(16), 0x2345 )
+        self.assertEqual( bits.peek(12), 0x678 )
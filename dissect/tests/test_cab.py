@@ -1,9 +1,16 @@
+import io
+import os
+import random
+import struct
 import hashlib
+import tempfile
 import unittest
 
 import dissect.formats.cab as cab
 import dissect.tests.files as files
 
+from dissect.tests.common import mkCab, mkMsZipCab, lzxCompress, LZX_VERBATIM, LZX_ALIGNED
+
 class CabTest(unittest.TestCase):
     hash_chk = '00010548964e7bbca74da0d1764bdd70'
 
@@ -19,3 +26,175 @@ class CabTest(unittest.TestCase):
                 h.update(dec_data)
                 
                 self.assertEqual(self.hash_chk, h.hexdigest())
+
+    def test_cab_folderdata(self):
+        with files.getTestFd('test_cab.cab') as fd:
+
+            c = cab.CabLab(fd)
+            fldr = c['CFHEADER'].cfDirArray[0]
+
+            hdrs = c.getFolderData(0)
+            cfds = list( c.iterCabData(fldr.coffCabStart, fldr.cCFData) )
+            self.assertEqual( len(hdrs), fldr.cCFData )
+
+            for (off,cbdata,cbuncomp),cfd in zip(hdrs,cfds):
+                self.assertEqual( cbdata, cfd.cbData )
+                self.assertEqual( cbuncomp, cfd.cbUncomp )
+                self.assertEqual( c.readAtOff(off, cbdata), cfd.ab )
+
+            byts = b''.join( c.iterFolderBytes(0) )
+            self.assertEqual( len(byts), c.getFolderSize(0) )
+            self.assertEqual( self.hash_chk, hashlib.md5(byts).hexdigest() )
+
+    def test_cab_open(self):
+        with files.getTestFd('test_cab.cab') as fd:
+
+            c = cab.CabLab(fd)
+            byts = c.openCabFile('test_cab.txt').read()
+            self.assertEqual( self.hash_chk, hashlib.md5(byts).hexdigest() )
+
+            self.assertRaises( cab.OffCabFile, c.openCabFile, 'newp.txt' )
+
+    def test_cab_checkpoints(self):
+        cabfiles = [ (b'file%d.txt' % i, b''.join( b'%d woot %d\n' % (i,j) for j in range(3000) )) for i in range(20) ]
+
+        c = cab.CabLab( io.BytesIO(mkMsZipCab(cabfiles)), ckptsize=65536 )
+        for name,byts in reversed(cabfiles):
+            self.assertEqual( c.openCabFile(name.decode()).read(), byts )
+
+        # the first open populated the checkpoints, so resume from them
+        self.assertTrue( len(c._cab_ckpts[0]['ckpts']) > 2 )
+        for name,byts in cabfiles:
+            self.assertEqual( c.openCabFile(name.decode()).read(), byts )
+
+        # checkpoints are thinned ( and spaced further apart ) past ckptmax
+        c = cab.CabLab( io.BytesIO(mkMsZipCab(cabfiles)), ckptsize=32768, ckptmax=4 )
+        self.assertEqual( c.openCabFile('file19.txt').read(), cabfiles[-1][1] )
+
+        info = c._cab_ckpts[0]
+        self.assertTrue( len(info['ckpts']) <= 4 )
+        self.assertTrue( info['step'] > 32768 )
+        self.assertEqual( info['ckpts'][0], (0,0,None) )
+        for name,byts in cabfiles:
+            self.assertEqual( c.openCabFile(name.decode()).read(), byts )
+
+        # or disabled
+        c = cab.CabLab( io.BytesIO(mkMsZipCab(cabfiles)), ckptsize=None )
+        self.assertEqual( c.openCabFile('file19.txt').read(), cabfiles[-1][1] )
+        self.assertEqual( c._cab_ckpts[0]['ckpts'], [ (0,0,None) ] )
+
+    def test_cab_lzx_checkpoints(self):
+        rand = random.Random(0x4c5a58)
+        words = [ b'foo', b'barbaz', b'hello world ', b'xyzzy' ]
+        cabfiles = []
+        for i in range(8):
+            byts = b''.join( rand.choice(words) + bytes([rand.getrandbits(8)]) for j in range(5000) )
+            cabfiles.append( (b'file%d.txt' % i, byts) )
+
+        blob = b''.join( byts for name,byts in cabfiles )
+        for btype in (LZX_VERBATIM, LZX_ALIGNED):
+            # large blocks so the checkpoints fall within a block
+            mkdata = lambda byts: lzxCompress(byts, wbits=15, btype=btype, blksize=100000)
+            cabbyts = mkCab([cabfiles], comp=3 | (15 << 8), mkdata=mkdata)
+
+            full = b''.join( cab.CabLab(io.BytesIO(cabbyts)).iterFolderBytes(0) )
+            self.assertEqual( full, blob )
+
+            c = cab.CabLab( io.BytesIO(cabbyts), ckptsize=65536 )
+            self.assertEqual( c.openCabFile('file7.txt').read(), cabfiles[-1][1] )
+
+            ckpts = c._cab_ckpts[0]['ckpts']
+            self.assertTrue( len(ckpts) > 2 )
+            self.assertTrue( any( state['blkremain'] for uoff,coff,state in ckpts[1:] ) )
+
+            # resume past each checkpoint ( and mid file )
+            for uoff,coff,state in ckpts[1:]:
+                byts = b''.join( c.iterFolderBytes(0, uoff + 1000) )
+                self.assertEqual( byts, full[uoff + 1000:] )
+
+            for name,byts in cabfiles:
+                cfd = c.openCabFile(name.decode())
+                cfd.seek(len(byts) // 2)
+                self.assertEqual( cfd.read(), byts[len(byts) // 2:] )
+
+    def test_cab_extract(self):
+        fldrs = [ [ (b'dir\\%d\\file%d.txt' % (i,j), b'%d woot %d\n' % (i,j) * (j * 1000)) for j in range(4) ] for i in range(3) ]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cabpath = os.path.join(tmpdir, 'test.cab')
+            with open(cabpath, 'wb') as fd:
+                fd.write( mkMsZipCab(*fldrs) )
+
+            for workers in (1,2):
+                dest = os.path.join(tmpdir, 'out%d' % workers)
+                with open(cabpath, 'rb') as fd:
+                    paths = list( cab.CabLab(fd).extractAll(dest, workers=workers) )
+
+                self.assertEqual( len(paths), 12 )
+                for files in fldrs:
+                    for name,byts in files:
+                        path = os.path.join(dest, *name.decode().split('\\'))
+                        self.assertIn( path, paths )
+                        with open(path, 'rb') as fd:
+                            self.assertEqual( fd.read(), byts )
+
+            # paths are yielded as the files are written
+            dest = os.path.join(tmpdir, 'lazy')
+            with open(cabpath, 'rb') as fd:
+                paths = cab.CabLab(fd).extractAll(dest)
+                first = next(paths)
+                self.assertTrue( os.path.isfile(first) )
+                self.assertFalse( os.path.exists( os.path.join(dest, 'dir', '2') ) )
+                self.assertEqual( len(list(paths)), 11 )
+
+    def test_cab_spanning(self):
+        cabfiles = [ (b'file%d.txt' % i, b'%d woot' % i * 1000) for i in range(3) ]
+        byts = bytearray( mkMsZipCab(cabfiles) )
+
+        # mark file2.txt as continued to the next cabinet
+        off = byts.find(b'file2.txt\x00') - 16
+        struct.pack_into('<H', byts, off + 8, 0xfffe)
+
+        c = cab.CabLab( io.BytesIO(bytes(byts)) )
+        self.assertEqual( [ i.name for i in c.getSpanningFiles() ], [ 'file2.txt' ] )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertLogs('dissect.formats.cab', level='WARNING') as logs:
+                paths = list( c.extractAll(tmpdir) )
+
+            self.assertEqual( [ os.path.basename(p) for p in paths ], [ 'file0.txt', 'file1.txt' ] )
+            self.assertIn( 'file2.txt', logs.output[0] )
+
+    def test_cab_member_files(self):
+        cabfiles = [ (b'file%d.txt' % i, b''.join( b'%d woot %d\n' % (i,j) for j in range(i * 2000 + 1) )) for i in range(6) ]
+
+        c = cab.CabLab( io.BytesIO(mkMsZipCab(cabfiles)) )
+        fds = [ cfd for fname,finfo,cfd in c.getCabFiles() ]
+
+        # read out of order and in pieces
+        for (name,byts),cfd in reversed( list(zip(cabfiles,fds)) ):
+            self.assertEqual( cfd.read(10), byts[:10] )
+            self.assertEqual( cfd.read(), byts[10:] )
+            self.assertEqual( cfd.read(), b'' )
+
+            cfd.seek(-5, io.SEEK_END)
+            self.assertEqual( cfd.read(100), byts[-5:] )
+
+    def test_cab_fileinfo(self):
+        with files.getTestFd('test_cab.cab') as fd:
+            c = cab.CabLab(fd)
+            infos = c.getCabFileInfo()
+            self.assertEqual( [ (i.name,i.size,i.uoff,i.ifldr) for i in infos ], [ ('test_cab.txt',10000,0,0) ] )
+            self.assertEqual( c.getCabVersion(), (1,3) )
+
+        cabfiles = [ (b'file%d.txt' % i, b'%d woot' % i * 10000) for i in range(3) ]
+        c = cab.CabLab( io.BytesIO(mkMsZipCab(cabfiles, cabfiles[:1], reserve=(20,3,5))) )
+
+        infos = c.getCabFileInfo()
+        self.assertEqual( [ i.name for i in infos ], [ 'file0.txt','file1.txt','file2.txt','file0.txt' ] )
+        self.assertEqual( [ i.ifldr for i in infos ], [ 0,0,0,1 ] )
+        self.assertEqual( len(c.getCabFolderInfo()), 2 )
+
+        for (fname,finfo,cfd),(name,byts) in zip(c.getCabFiles(), cabfiles + cabfiles[:1]):
+            self.assertEqual( finfo['comp'], 'MSZIP' )
+            self.assertEqual( cfd.read(), byts )
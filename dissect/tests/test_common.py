@@ -40,3 +40,74 @@ class CommonTest(unittest.TestCase):
 
         self.assertEqual( cache[20], 40 )
         self.assertEqual( data['hits'], 2 )
+
+        cache.invalidate(10)
+        self.assertEqual( cache[10], 30 )
+        self.assertEqual( data['hits'], 3 )
+
+    def test_common_lrukeycache(self):
+        data = {'hits':0}
+        def woot(x):
+            data['hits'] += 1
+            return x + 20
+
+        cache = LruKeyCache(woot, maxsize=2)
+
+        self.assertEqual( cache[10], 30 )
+        self.assertEqual( cache[20], 40 )
+        self.assertEqual( cache[10], 30 )
+
+        # 20 is the least recently used
+        self.assertEqual( cache[30], 50 )
+        self.assertEqual( list(cache.keys()), [10, 30] )
+        self.assertEqual( cache[20], 40 )
+        self.assertEqual( data['hits'], 4 )
+
+        cache.invalidate(30)
+        self.assertEqual( list(cache.keys()), [20] )
+
+        stats = cache.getStats()
+        self.assertEqual( stats['hits'], 1 )
+        self.assertEqual( stats['misses'], 4 )
+        self.assertEqual( stats['evictions'], 2 )
+        self.assertEqual( stats['size'], 1 )
+
+    def test_common_ondemand_evict(self):
+        data = {'foo':0,'bar':0}
+        def foo():
+            data['foo'] += 1
+            return 'foo'
+
+        def bar(x):
+            data['bar'] += 1
+            return x + 20
+
+        ondem = OnDemand(maxevict=1)
+        ondem.add('foo',foo)
+        ondem.add('bar',bar, 10, evict=True)
+        ondem.add('baz',bar, 20, evict=True)
+        ondem.set('woot', 'hehe')
+
+        self.assertEqual( ondem['bar'], 30 )
+        self.assertEqual( ondem.get('bar'), 30 )
+        self.assertEqual( data['bar'], 1 )
+
+        # baz pushes bar out of the bounded cache
+        self.assertEqual( ondem['baz'], 40 )
+        self.assertEqual( ondem['bar'], 30 )
+        self.assertEqual( data['bar'], 3 )
+
+        self.assertEqual( ondem['foo'], 'foo' )
+        ondem.invalidate('foo')
+        self.assertEqual( ondem['foo'], 'foo' )
+        self.assertEqual( data['foo'], 2 )
+
+        ondem.invalidate()
+        self.assertEqual( ondem['woot'], 'hehe' )
+        self.assertEqual( ondem['bar'], 30 )
+        self.assertEqual( data['bar'], 4 )
+
+        stats = ondem.getStats()
+        self.assertEqual( stats['hits'], 1 )
+        self.assertEqual( stats['misses'], 4 )
+        self.assertEqual( stats['evictions'], 2 )
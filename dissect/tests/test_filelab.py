@@ -1,4 +1,6 @@
 import io
+import mmap
+import tempfile
 import unittest
 
 from vstruct2.types import *
@@ -39,3 +41,163 @@ class CommonTest(unittest.TestCase):
 
         self.assertEqual( foo['woot'].one, 0x61 )
 
+
+    def test_filelab_mmap(self):
+
+        class Woot(VStruct):
+            def __init__(self):
+                VStruct.__init__(self)
+                self.one = uint8()
+                self.two = uint16()
+                self.name = zstr()
+
+        byts = b'asdfqwer\x00zxcv'
+        with tempfile.TemporaryFile() as fd:
+            fd.write(byts)
+            fd.flush()
+
+            labs = (
+                FileLab(fd),
+                FileLab(fd, usemmap=False),
+                FileLab(byts),
+                FileLab(memoryview(byts)),
+                FileLab(io.BytesIO(byts)),
+            )
+
+            self.assertTrue( labs[0].mem != None )
+            self.assertTrue( labs[1].mem == None )
+
+            for lab in labs:
+                woot = lab.getStruct(0, Woot)
+                self.assertEqual( woot.two, 0x6473 )
+                self.assertEqual( woot.name, 'fqwer' )
+
+                self.assertEqual( bytes(lab.readAtOff(2, 4)), b'dfqw' )
+                self.assertEqual( bytes(lab.readAtOff(10, 10, shortok=True)), b'xcv' )
+                self.assertRaises( Exception, lab.readAtOff, 10, 10 )
+
+    def test_filelab_close(self):
+
+        byts = b'asdfqwer\x00zxcv'
+        with tempfile.TemporaryFile() as fd:
+            fd.write(byts)
+            fd.flush()
+
+            # an mmap created by the lab is closed with it
+            with FileLab(fd) as lab:
+                self.assertEqual( bytes(lab.readAtOff(0, 4)), b'asdf' )
+
+            self.assertTrue( lab.buf.closed )
+            self.assertRaises( ValueError, lab.readAtOff, 0, 4 )
+
+            # a caller provided mmap is left open
+            mem = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            with FileLab(mem) as lab:
+                self.assertEqual( bytes(lab.readAtOff(4, 4)), b'qwer' )
+
+            self.assertFalse( mem.closed )
+            self.assertEqual( mem[0:4], b'asdf' )
+            mem.close()
+
+        # memoryview sources are not copied
+        buf = bytearray(byts)
+        lab = FileLab(memoryview(buf)[2:])
+        self.assertEqual( lab.getSize(), len(byts) - 2 )
+        self.assertEqual( lab.strAtOff(0), 'dfqwer' )
+
+        buf[2] = 0x41
+        self.assertEqual( bytes(lab.readAtOff(0, 4)), b'Afqw' )
+        self.assertEqual( lab.fd.read(4), b'Afqw' )
+
+        # the callers view is unaffected by close()
+        view = memoryview(buf)
+        FileLab(view).close()
+        self.assertEqual( view[2:4].tobytes(), b'Af' )
+
+    def test_filelab_str(self):
+        wide = 'A䄀B'.encode('utf-16le') + b'\x00\x00'
+        byts = b'x' * 4090 + b'hello\x00' + b'z' * 4095 + wide + b'tail'
+
+        for lab in ( FileLab(io.BytesIO(byts)), FileLab(byts) ):
+            self.assertEqual( lab.strAtOff(4090), 'hello' )
+            self.assertEqual( lab.strAtOff(4093), 'lo' )
+            self.assertEqual( lab.strAtOff(4090 + 6 + 4095, codec='utf-16le'), 'A䄀B' )
+            self.assertEqual( lab.strAtOff(len(byts) - 4), 'tail' )
+            self.assertEqual( lab.strAtOff(len(byts) + 10), '' )
+
+            # a string spanning several pages
+            self.assertEqual( lab.strAtOff(0), 'x' * 4090 + 'hello' )
+
+    def test_filelab_cache(self):
+
+        class Woot(VStruct):
+            def __init__(self):
+                VStruct.__init__(self)
+                self.one = uint8()
+                self.two = uint16()
+                self.name = zstr()
+
+        byts = bytes( range(256) ) * 64 + b'asdfqwer\x00zxcv'
+
+        cache = PageCache(io.BytesIO(byts), pagesize=256, maxsize=1024)
+        self.assertEqual( cache.read(250, 12), byts[250:262] )
+        self.assertEqual( cache.read(0, 300000), byts )
+        self.assertEqual( cache.read(len(byts) - 3, 10), b'xcv' )
+        self.assertEqual( cache.read(len(byts) + 10, 10), b'' )
+
+        stats = cache.getStats()
+        self.assertEqual( stats['misses'], 3 )
+        self.assertEqual( stats['hits'], 1 )
+
+        # hits move pages to the front of the LRU
+        cache.read(0, 1)
+        cache.read(512, 300)
+        stats = cache.getStats()
+        self.assertEqual( stats['hits'], 2 )
+        self.assertEqual( stats['pages'], 4 )
+        self.assertEqual( stats['size'], 256 * 3 + 13 )
+        self.assertEqual( list(cache.pages), [64, 0, 2, 3] )
+
+        lab = FileLab(io.BytesIO(byts), cache=PageCache(io.BytesIO(byts), pagesize=512))
+        for i in range(3):
+            woot = lab.getStruct(16384, Woot)
+            self.assertEqual( woot.two, 0x6473 )
+            self.assertEqual( woot.name, 'fqwer' )
+            self.assertEqual( lab.strAtOff(16384), 'asdfqwer' )
+            self.assertEqual( bytes(lab.readAtOff(16380, 8)), byts[16380:16388] )
+
+        stats = lab.getCacheStats()
+        self.assertEqual( stats['misses'], 2 )
+        self.assertEqual( stats['pages'], 2 )
+
+        self.assertEqual( FileLab(byts).getCacheStats(), None )
+        self.assertEqual( FileLab(io.BytesIO(byts), cache=False).getCacheStats(), None )
+
+        # regular files use the PageCache only with usemmap=False
+        with tempfile.TemporaryFile() as fd:
+            fd.write(byts)
+            fd.flush()
+
+            self.assertEqual( FileLab(fd).getCacheStats(), None )
+
+            lab = FileLab(fd, usemmap=False)
+            self.assertEqual( lab.mem, None )
+            self.assertEqual( lab.strAtOff(16384), 'asdfqwer' )
+            self.assertEqual( bytes(lab.readAtOff(16380, 8)), byts[16380:16388] )
+            self.assertEqual( lab.getCacheStats()['misses'], 2 )
+
+    def test_filelab_cachefile(self):
+        byts = b'asdfqwer\x00zxcv'
+
+        cfd = PageCacheFile( PageCache(io.BytesIO(byts), pagesize=4) )
+        cfd.seek(3)
+        self.assertEqual( cfd.read(), byts[3:] )
+        self.assertEqual( cfd.tell(), len(byts) )
+
+        cfd.seek(-4, io.SEEK_END)
+        self.assertEqual( cfd.read(-1), b'zxcv' )
+        self.assertEqual( cfd.read(), b'' )
+        self.assertEqual( cfd.tell(), len(byts) )
+
+        cfd.seek(len(byts) + 10)
+        self.assertEqual( cfd.read(), b'' )
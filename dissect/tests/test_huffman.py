@@ -18,4 +18,30 @@ class HuffTest(unittest.TestCase):
         syms = tuple( huff.iterHuffSyms( bits ) )
         
         # self.assertEqual( tuple(book), huffbook )
-        # self.assertEqual( tuple(syms), huffsyms )
\ No newline at end of file
+        # self.assertEqual( tuple(syms), huffsyms )
+
+    def test_huff_table(self):
+
+        huff = huffman.HuffTree(tablebits=2)
+        book = huff.initCodeBook( (3, 3, 3, 3, 3, 2, 4, 4) )
+        huff.loadCodeBook(book)
+
+        # F=00 G=1110 A=010 H=1111 ( msb first )
+        bits = bitlab.BitStream( b'\x39\x78', order='big' )
+        syms = [ huff.getHuffSym(bits) for i in range(4) ]
+        self.assertEqual( syms, [5, 6, 0, 7] )
+        self.assertEqual( bits.getOffset(), 13 )
+
+        # the same codes packed lsb first ( as in deflate )
+        bits = bitlab.BitStream( b'\x9c\x1e', order='little' )
+        syms = [ huff.getHuffSym(bits) for i in range(4) ]
+        self.assertEqual( syms, [5, 6, 0, 7] )
+
+        # table decoding agrees with walking the tree
+        tree = huffman.HuffTree()
+        tree.loadCodeBook(book)
+        syms = tuple( tree.iterHuffSyms( bitlab.bits( b'\x39\x78' ) ) )
+        self.assertEqual( syms[:4], (5, 6, 0, 7) )
+
+        syms = tuple( huff.iterHuffSyms( bitlab.BitStream( b'\x39\x78' ) ) )
+        self.assertEqual( syms, (5, 6, 0, 7, 5) )
@@ -0,0 +1,95 @@
+import unittest
+
+import dissect.bitlab as bitlab
+import dissect.algos.inflate as inflate
+
+from dissect.tests.common import deflate
+
+class InflateTest(unittest.TestCase):
+
+    text = b''.join( b'woot %d hehe haha %d\n' % (i, i * 7) for i in range(3000) )
+
+    def test_inflate_backends(self):
+
+        tests = (
+            b'hi',                      # fixed huffman
+            self.text,                  # dynamic huffman
+        )
+
+        for byts in tests:
+            for level in (0, 9):
+                comp = deflate(byts, level=level)
+                for backend in (inflate.BACKEND_PYTHON, inflate.BACKEND_ZLIB):
+                    inf = inflate.Inflate(backend=backend)
+                    self.assertEqual( inf.inflate(comp), byts )
+
+    def test_inflate_history(self):
+        one = self.text[:20000]
+        two = self.text[20000:40000]
+
+        comp1 = deflate(one)
+        comp2 = deflate(two, zdict=one)
+
+        for backend in (inflate.BACKEND_PYTHON, inflate.BACKEND_ZLIB):
+            inf = inflate.Inflate(backend=backend)
+            self.assertEqual( inf.inflate(comp1), one )
+            self.assertEqual( inf.inflate(comp2), two )
+            self.assertEqual( inf.getHistory(), (one + two)[-inflate.MAX_HIST:] )
+
+    def test_inflate_bits(self):
+        comp = deflate(b'hi')
+        bits = bitlab.BitReader(comp + b'\xff', order='little')
+
+        inf = inflate.Inflate(backend=inflate.BACKEND_PYTHON)
+        self.assertEqual( inf.inflateBits(bits), b'hi' )
+
+        bits.align()
+        self.assertEqual( bits.getOffset(), len(comp) * 8 )
+
+    def test_inflate_errors(self):
+        comp = deflate(self.text)
+        for backend in (inflate.BACKEND_PYTHON, inflate.BACKEND_ZLIB):
+            inf = inflate.Inflate(backend=backend)
+            self.assertRaises( inflate.InflateError, inf.inflate, comp[:100] )
+
+        self.assertRaises( inflate.InflateError, inflate.Inflate, backend='woot' )
+
+    def test_inflate_ring(self):
+        # overlapping matches and history which wraps the ring buffer
+        byts = b'A' * 50000 + self.text[:30000] + b'AB' * 20000
+
+        inf = inflate.Inflate(backend=inflate.BACKEND_PYTHON)
+
+        hist = b''
+        for i in range(0, len(byts), 16384):
+            chunk = byts[i:i + 16384]
+            comp = deflate(chunk, zdict=hist[-inflate.MAX_HIST:])
+            self.assertEqual( inf.inflate(comp), chunk )
+            hist += chunk
+
+        self.assertEqual( inf.getHistory(), byts[-inflate.MAX_HIST:] )
+
+    def test_inflate_maxsize(self):
+        byts = self.text[:30000]
+        for level in (0, 9):
+            comp = deflate(byts, level=level)
+            for backend in (inflate.BACKEND_PYTHON, inflate.BACKEND_ZLIB):
+                inf = inflate.Inflate(backend=backend)
+                self.assertEqual( inf.inflate(comp, maxsize=len(byts)), byts )
+
+                inf = inflate.Inflate(backend=backend)
+                self.assertRaises( inflate.InflateError, inf.inflate, comp, maxsize=len(byts) - 1 )
+
+        # a bomb is stopped at the limit rather than decoded in full
+        bomb = deflate(b'\x00' * 20000000)
+
+        inf = inflate.Inflate(backend=inflate.BACKEND_PYTHON)
+        out = []
+        copymatch = inf._copyMatch
+        def copyMatch(out_, dist, mlen):
+            copymatch(out_, dist, mlen)
+            out.append(len(out_))
+
+        inf._copyMatch = copyMatch
+        self.assertRaises( inflate.InflateError, inf.inflate, bomb, maxsize=32768 )
+        self.assertTrue( max(out) <= 32768 + 258 )
@@ -0,0 +1,194 @@
+import os
+import time
+import ctypes
+import random
+import struct
+import unittest
+
+import dissect.algos.lzx as lzx
+
+from dissect.tests.common import lzxCompress, LZX_VERBATIM, LZX_ALIGNED
+
+def refIntelFrame(buf, curpos, filesize):
+    # byte at a time reference translation
+    i = 0
+    while i < len(buf) - 10:
+        if buf[i] != 0xE8:
+            i += 1
+            continue
+
+        absoff = struct.unpack('<i', bytes(buf[i + 1:i + 5]))[0]
+        pos = curpos + i
+        if absoff >= -pos and absoff < filesize:
+            if absoff >= 0:
+                reloff = absoff - pos
+            else:
+                reloff = absoff + filesize
+            buf[i + 1:i + 5] = struct.pack('<I', reloff & 0xffffffff)
+
+        i += 5
+
+    return buf
+
+def oldIntelFrame(ibuf, icp, ifs):
+    # the list/ctypes translation decIntelFrame replaced ( benchmark only )
+    curpos = ctypes.c_int(icp).value
+
+    indices = [i for i, b in enumerate(ibuf) if b == lzx.INSTR_CALL]
+    if not len(indices):
+        return ibuf
+
+    markers = [indices[0]]
+    for l in indices:
+        if l - markers[-1] >= 5 and l < (len(ibuf)-10):
+            markers.append(l)
+
+    for i, idx in enumerate(markers):
+
+        if i == 0:
+            curpos += idx
+        else:
+            curpos += (idx - markers[i-1])
+
+        idx += 1
+
+        absoff = ctypes.c_int((ibuf[idx] | (ibuf[idx+1]<<8) |
+                              (ibuf[idx+2]<<16) | (ibuf[idx+3]<<24) ))
+        absoff = absoff.value
+        if absoff >= -(0xFFFFFFFF & curpos) and absoff < ifs:
+            if absoff >= 0:
+                reloff = absoff - curpos
+            else:
+                reloff = absoff + ifs
+
+            ibuf[idx]   = (0xFF & reloff)
+            ibuf[idx+1] = (0xFF & (reloff >> 8))
+            ibuf[idx+2] = (0xFF & (reloff >> 16))
+            ibuf[idx+3] = (0xFF & (reloff >> 24))
+
+    return ibuf
+
+class LzxTest(unittest.TestCase):
+
+    def test_lzx_intel(self):
+        rand = random.Random(0x4c5a58)
+        for i in range(20):
+            fsize = rand.choice((11, 100, 4096, lzx.LZX_FRAME_SIZE))
+            frame = bytearray( rand.choice((0xe8, 0x00, 0xff, 0x41)) for j in range(fsize) )
+            curpos = rand.randrange(0, 1 << 20)
+
+            want = refIntelFrame(bytearray(frame), curpos, 1 << 20)
+            self.assertEqual( lzx.decIntelFrame(frame, curpos, 1 << 20), want )
+
+    def test_lzx_intel_edges(self):
+        # negative offsets in range map back above the file size
+        buf = bytearray(b'\xe8' + struct.pack('<i', -4) + b'\x00' * 16)
+        lzx.decIntelFrame(buf, 100, 1000)
+        self.assertEqual( struct.unpack_from('<I', buf, 1)[0], 996 )
+
+        # out of range offsets and the last 10 bytes are left alone
+        buf = bytearray(b'\xe8' + struct.pack('<i', 5000) + b'\x00' * 5 + b'\xe8\x01\x00\x00\x00' + b'\x00' * 5)
+        self.assertEqual( lzx.decIntelFrame(bytearray(buf), 0, 1000), buf )
+
+        # operands are skipped over rather than rescanned
+        buf = bytearray(b'\xe8\xe8\x00\x00\x00' + b'\x00' * 16)
+        want = refIntelFrame(bytearray(buf), 0, 1000)
+        self.assertEqual( lzx.decIntelFrame(buf, 0, 1000), want )
+
+    def _getLzxText(self):
+        # repeats at several distances ( and runs ) so matches use the
+        # repeated offsets, the length tree and ( aligned ) offset bits
+        rand = random.Random(0x4c5a58)
+        words = [ b'foo', b'barbaz', b'hello world ', b'xyzzy', b'\xe8\x00\x01' ]
+        byts = b''.join( rand.choice(words) + bytes([rand.getrandbits(8)]) for i in range(12000) )
+        byts += b'A' * 3000 + bytes( rand.getrandbits(8) for i in range(2000) )
+
+        # copies which cycle through a few distances ( R0 / R1 / R2 )
+        byts = bytearray(byts)
+        for i in range(6000):
+            dist = rand.choice( (100, 1000, 5000) )
+            for j in range(rand.randint(3, 12)):
+                byts.append( byts[-dist] )
+            byts.append( rand.getrandbits(8) )
+
+        return bytes(byts)
+
+    def _checkLzx(self, btype, wbits):
+        byts = self._getLzxText()
+        frames = lzxCompress(byts, wbits=wbits, btype=btype, blksize=20000)
+        self.assertTrue( len(frames) > 2 )
+
+        lzxd = lzx.Lzx( 3 | (wbits << 8) )
+        out = list( lzxd.decompFrames( ( f for f,size in frames ), len(byts) ) )
+        self.assertEqual( [ len(o) for o in out ], [ size for f,size in frames ] )
+        self.assertEqual( b''.join(out), byts )
+
+    def test_lzx_verbatim(self):
+        # a 32k window wraps several times within the stream
+        self._checkLzx(LZX_VERBATIM, 15)
+        self._checkLzx(LZX_VERBATIM, 17)
+
+    def test_lzx_aligned(self):
+        self._checkLzx(LZX_ALIGNED, 15)
+        self._checkLzx(LZX_ALIGNED, 17)
+
+    def test_lzx_wincopy(self):
+        lzxd = lzx.Lzx( 3 | (15 << 8) )
+        lzxd._setWinView(0, b'abc')
+        lzxd.winpos = 3
+
+        # overlapping matches repeat the pattern
+        lzxd._winCopy(3, 8)
+        lzxd._winCopy(1, 3)
+        self.assertEqual( lzxd.winpos, 14 )
+        self.assertEqual( bytes(lzxd._getWinView(-14, 14)), b'abcabcabcabbbb' )
+
+    def test_lzx_state(self):
+        # a single uncompressed block spanning several frames
+        byts = bytes( (i * 7) & 0xff for i in range(100000) )
+        hdr = (lzx.BTYPE_UNCOMPRESSED << 28) | (len(byts) << 4)
+        strm = struct.pack('<HH', hdr >> 16, hdr & 0xffff) + struct.pack('<III', 1, 1, 1) + byts
+        chunks = [ strm[i:i + 20000] for i in range(0, len(strm), 20000) ]
+
+        comp_type = 3 | (16 << 8)
+        lzxd = lzx.Lzx(comp_type)
+        frames = lzxd.decompFrames(iter(chunks), len(byts))
+
+        first = next(frames)
+        state = lzxd.getState()
+        self.assertEqual( first + b''.join(frames), byts )
+
+        resume = lzx.Lzx(comp_type)
+        resume.setState(state)
+        off = resume.getStateOffset(state)
+        rest = b''.join( resume.decompFrames([ strm[off:] ], len(byts) - len(first)) )
+        self.assertEqual( rest, byts[len(first):] )
+
+    @unittest.skipUnless(os.environ.get('DISSECT_BENCH'), 'set DISSECT_BENCH=1 to run benchmarks')
+    def test_lzx_intel_bench(self):
+        rand = random.Random(0x4c5a58)
+        fsize = lzx.LZX_FRAME_SIZE
+        iters = 200
+
+        dense = bytearray( rand.getrandbits(8) for i in range(fsize) )
+        for i in range(0, fsize - 10, 40):
+            dense[i] = 0xe8
+
+        inputs = (
+            ('random data', bytes( rand.getrandbits(8) for i in range(fsize) )),
+            ('E8 every 40 bytes', bytes(dense)),
+        )
+
+        print('')
+        print('32k frames, %d iterations (old -> new):' % (iters,))
+        for name,frame in inputs:
+
+            rates = []
+            for func in (oldIntelFrame, lzx.decIntelFrame):
+                t0 = time.perf_counter()
+                for i in range(iters):
+                    func(bytearray(frame), i * fsize, 12000000)
+                rates.append( fsize * iters / (time.perf_counter() - t0) / 1e6 )
+
+            print('  %-18s %6.1f MB/s -> %6.1f MB/s  (x%.1f)' % (name, rates[0], rates[1], rates[1] / rates[0]))
+            self.assertTrue( rates[1] > rates[0] )
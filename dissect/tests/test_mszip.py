@@ -0,0 +1,37 @@
+import unittest
+
+import dissect.algos.inflate as inflate
+import dissect.algos.mszip as mszip
+
+from dissect.tests.common import deflate, mkMsZipFrames
+
+class MsZipTest(unittest.TestCase):
+
+    text = b''.join( b'woot %d hehe haha %d\n' % (i, i * 7) for i in range(8000) )
+
+    def test_mszip_frames(self):
+        frames = mkMsZipFrames(self.text)
+        self.assertTrue( len(frames) > 2 )
+
+        for backend in (inflate.BACKEND_PYTHON, inflate.BACKEND_ZLIB):
+            mszipd = mszip.MsZip(backend=backend)
+            views = ( memoryview(bytearray(f)) for f in frames )
+            self.assertEqual( b''.join(mszipd.decompFrames(views)), self.text )
+
+    def test_mszip_dictionary(self):
+        frames = mkMsZipFrames(self.text)
+
+        mszipd = mszip.MsZip()
+        first = mszipd.decompFrame(frames[0])
+
+        resume = mszip.MsZip()
+        resume.setDictionary( mszipd.getDictionary() )
+        self.assertEqual( resume.decompFrame(frames[1]), self.text[len(first):len(first) + mszip.MSZIP_FRAME_MAX] )
+
+    def test_mszip_errors(self):
+        mszipd = mszip.MsZip()
+        self.assertRaises( mszip.MsZipError, mszipd.decompFrame, b'XX\x03\x00' )
+
+        # frames may not decompress to more than 32k
+        byts = b'CK' + deflate(b'A' * 40000)
+        self.assertRaises( mszip.MsZipError, mszipd.decompFrame, byts )
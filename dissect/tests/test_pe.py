@@ -1,5 +1,12 @@
+import io
+import math
+import time
+import random
+import struct
+import hashlib
 import unittest
 
+import dissect.bexlab as d_bexlab
 import dissect.formats.pe as d_pe
 import dissect.tests.files as d_files
 
@@ -86,3 +93,421 @@ class CabTest(DisTest):
             self.eq( lab.get('bex:arch'), 'amd64')
             self.eq( lab.get('bex:ptr:size'), 8 )
 
+
+    def test_pe_rvatooff(self):
+
+        def refRvaToOff(maps, rva):
+            for memrva,meminfo in maps:
+                off = meminfo.get('off')
+                if off == None:
+                    continue
+                if rva >= memrva and rva < memrva + meminfo.get('size'):
+                    return off + (rva - memrva)
+
+        with d_files.getTestFd('putty32.exe') as fd:
+
+            lab = d_pe.PeLab(fd)
+            maps = lab.get('bex:mem:maps')
+
+            rvas = list( range(0, 0x90000, 0x3f) )
+            offs = [ refRvaToOff(maps, rva) for rva in rvas ]
+
+            self.eq( [ lab.rvaToOff(rva) for rva in rvas ], offs )
+            self.eq( lab.rvasToOffs(rvas), offs )
+            self.eq( lab.rvasToOffs(reversed(rvas)), offs[::-1] )
+
+        class FooLab(d_bexlab.BexLab):
+            def __init__(self, fd, maps):
+                d_bexlab.BexLab.__init__(self, fd)
+                self.add('bex:mem:maps', lambda: maps)
+
+        # overlapping maps resolve to the first map in the list
+        maps = [
+            (0x100, {'size':0x100, 'off':0x1000}),
+            (0x000, {'size':0x400, 'off':0x2000}),
+            (0x800, {'size':0x100}),
+            (0x900, {'size':0x100, 'off':0x3000}),
+        ]
+        lab = FooLab(io.BytesIO(b''), maps)
+
+        rvas = [ -1, 0, 0xff, 0x100, 0x1ff, 0x200, 0x3ff, 0x400, 0x800, 0x9ff, 0xa00, 1 << 70 ]
+        offs = [ None, 0x2000, 0x20ff, 0x1000, 0x10ff, 0x2200, 0x23ff, None, None, 0x30ff, None, None ]
+        self.eq( [ lab.rvaToOff(rva) for rva in rvas ], offs )
+        self.eq( lab.rvasToOffs(rvas), offs )
+
+        maps.append( (0x400, {'size':0x10, 'off':0x10}) )
+        lab.invalidate('bex:mem:maps')
+        self.eq( lab.rvaToOff(0x400), 0x10 )
+
+    def test_pe_rvaindex_manymaps(self):
+
+        class FooLab(d_bexlab.BexLab):
+            def __init__(self, fd, maps):
+                d_bexlab.BexLab.__init__(self, fd)
+                self.add('bex:mem:maps', lambda: maps)
+
+        # a hostile pe may declare up to 65535 overlapping sections,
+        # listed in reverse order so every map overlaps a later one.
+        maps = [ (i * 0x10, {'size':0x1000, 'off':i * 0x100}) for i in range(16000, 0, -1) ]
+        lab = FooLab(io.BytesIO(b''), maps)
+
+        t0 = time.time()
+        lab.get('bex:mem:index')
+        self.true( time.time() - t0 < 2.0 )
+
+        # the first listed map ( highest rva ) still wins
+        self.eq( lab.rvaToOff(16000 * 0x10), 16000 * 0x100 )
+        self.eq( lab.rvaToOff(16000 * 0x10 - 1), 15999 * 0x100 + 0xf )
+        self.eq( lab.rvaToOff(0x10), 0x100 )
+        self.eq( lab.rvaToOff(0), None )
+
+        # randomized overlaps agree with a linear first-match scan
+        rand = random.Random(0x4142)
+        maps = []
+        for i in range(500):
+            size = rand.choice( (0, -0x10, rand.randint(1, 0x400)) )
+            maps.append( (rand.randint(0, 0x4000), {'size':size, 'off':rand.randint(0, 0x10000)}) )
+
+        def refRvaToOff(rva):
+            for memrva,meminfo in maps:
+                size = meminfo.get('size')
+                if rva >= memrva and rva < memrva + size:
+                    return meminfo.get('off') + (rva - memrva)
+
+        lab = FooLab(io.BytesIO(b''), maps)
+        rvas = list( range(-1, 0x4500, 7) )
+        self.eq( lab.rvasToOffs(rvas), [ refRvaToOff(rva) for rva in rvas ] )
+
+    def test_pe_directories(self):
+
+        with d_files.getTestFd('putty32.exe') as fd:
+
+            lab = d_pe.PeLab(fd)
+
+            imps = lab.get('bex:imports')
+            self.eq( len(imps), 328 )
+            self.eq( imps[0], (0x7c000, {'lib':'ADVAPI32.dll','name':'RegCloseKey','ord':None}) )
+            self.eq( imps[1][0], 0x7c004 )
+
+            self.eq( lab.get('bex:exports'), [] )
+
+            relocs = lab.get('bex:relocs')
+            self.eq( len(relocs), 11500 )
+            self.eq( relocs[0], (0x1024, d_pe.IMAGE_REL_BASED_HIGHLOW) )
+            self.eq( relocs[1], (0x10b1, d_pe.IMAGE_REL_BASED_HIGHLOW) )
+
+        with d_files.getTestFd('hello64.dll') as fd:
+
+            lab = d_pe.PeLab(fd)
+
+            self.eq( len(lab.get('bex:imports')), 65 )
+            self.eq( lab.get('bex:exports'), [
+                (0x1050, {'name':'bar','ord':1,'fwd':None}),
+                (0x1000, {'name':'foo','ord':2,'fwd':None}),
+            ])
+
+            relocs = list( lab.iterRelocs() )
+            self.eq( len(relocs), 163 )
+            self.eq( relocs[0], (0x9228, d_pe.IMAGE_REL_BASED_DIR64) )
+
+    def test_pe_exports(self):
+
+        with d_files.getTestFd('hello64.dll') as fd:
+            byts = bytearray( fd.read() )
+
+        lab = d_pe.PeLab(byts)
+
+        exps = lab.getExports()
+        self.eq( len(exps), 2 )
+        self.eq( exps.getOrdByName('foo'), 2 )
+        self.eq( exps.getRvaByName('bar'), 0x1050 )
+        self.eq( exps.getRvaByOrd(1), 0x1050 )
+        self.eq( exps.getRvaByOrd(3), None )
+        self.eq( exps.getNameByRva(0x1000), 'foo' )
+        self.eq( exps.getNameByRva(0x1001), None )
+        self.eq( exps.getForwarder(1), None )
+
+        # point "bar" at a string in the export directory ( a forwarder )
+        edir = lab.get('pe:IMAGE_EXPORT_DIRECTORY')
+        off = lab.rvaToOff(edir.AddressOfFunctions)
+        byts[off:off + 4] = edir.Name.to_bytes(4, 'little')
+
+        exps = d_pe.PeLab(byts).getExports()
+        self.eq( exps.getForwarder(1), 'hellodll_amd64.dll' )
+        self.eq( exps.getNameByRva(edir.Name), None )
+        self.eq( list(exps)[0], (edir.Name, {'name':'bar','ord':1,'fwd':'hellodll_amd64.dll'}) )
+
+        with d_files.getTestFd('putty32.exe') as fd:
+            self.eq( d_pe.PeLab(fd).getExports(), None )
+
+    def test_pe_headerinfo(self):
+
+        for name in ('putty32.exe','putty64.exe','hello32.dll','hello64.dll'):
+
+            with d_files.getTestFd(name) as fd:
+
+                info = d_pe.getPeHeaderInfo(fd)
+
+                fd.seek(0)
+                lab = d_pe.PeLab(fd)
+                self.eq( lab.getHeaderInfo(), info )
+
+                dos = lab.get('pe:IMAGE_DOS_HEADER')
+                nt = lab.get('pe:IMAGE_NT_HEADERS')
+                opt = nt.OptionalHeader
+
+                self.eq( info.lfanew, dos.e_lfanew )
+                self.eq( info.machine, nt.FileHeader.Machine )
+                self.eq( info.nsects, nt.FileHeader.NumberOfSections )
+                self.eq( info.timestamp, nt.FileHeader.TimeDateStamp )
+                self.eq( info.entry, opt.AddressOfEntryPoint )
+                self.eq( info.imagebase, opt.ImageBase )
+                self.eq( info.sizeofimage, opt.SizeOfImage )
+                self.eq( info.sizeofheaders, opt.SizeOfHeaders )
+                self.eq( info.checksum, opt.CheckSum )
+                self.eq( info.subsystem, opt.Subsystem )
+                self.eq( info.dllchars, opt.DllCharacteristics )
+                self.eq( info.sectoff, dos.e_lfanew + len(nt) )
+
+                dirs = [ (d.VirtualAddress,d.Size) for i,d in opt.DataDirectory ]
+                self.eq( list(info.dirs), dirs )
+
+                self.eq( lab.get('bex:ptr:base'), opt.ImageBase )
+
+        self.false( d_pe.isMimePe( io.BytesIO(b'MZ') ) )
+        self.false( d_pe.isMimePe( io.BytesIO(b'MZ' + b'\x00' * 58 + b'\xff\xff\x00\x00') ) )
+        self.false( d_pe.isMimePe( io.BytesIO(b'\x7fELF' + b'\x00' * 2000) ) )
+        self.assertRaises( d_pe.PeHeaderError, d_pe.PeLab, io.BytesIO(b'\x7fELF' + b'\x00' * 2000) )
+
+        # NT headers beyond the initial header read
+        with d_files.getTestFd('hello64.dll') as fd:
+            byts = fd.read()
+
+        info = d_pe.getPeHeaderInfo( io.BytesIO(byts) )
+        nthdrs = byts[info.lfanew:info.sectoff]
+        far = byts[:0x3c] + (4096).to_bytes(4, 'little') + b'\x00' * (4096 - 0x40) + nthdrs
+
+        finfo = d_pe.getPeHeaderInfo( io.BytesIO(far) )
+        self.eq( finfo.lfanew, 4096 )
+        self.eq( finfo.imagebase, info.imagebase )
+        self.eq( finfo.dirs, info.dirs )
+
+    def test_pe_header_magic(self):
+
+        with d_files.getTestFd('hello64.dll') as fd:
+            byts = bytearray( fd.read() )
+
+        amd64 = d_pe.PeLab( bytes(byts) )
+        info = amd64.getHeaderInfo()
+
+        # a PE32+ image for a machine other than amd64 / ia64
+        struct.pack_into('<H', byts, info.lfanew + 4, d_pe.IMAGE_FILE_MACHINE_ARM64)
+        arm64 = d_pe.PeLab( bytes(byts) )
+        ainfo = arm64.getHeaderInfo()
+
+        self.eq( ainfo.machine, d_pe.IMAGE_FILE_MACHINE_ARM64 )
+        self.eq( ainfo.magic, d_pe.IMAGE_NT_OPTIONAL_HDR64_MAGIC )
+        self.eq( ainfo.imagebase, info.imagebase )
+        self.eq( ainfo.dirs, info.dirs )
+        self.eq( ainfo.dirsoff, info.dirsoff )
+        self.eq( ainfo.checksum, info.checksum )
+
+        self.eq( arm64.get('bex:arch'), 'arm64' )
+        self.eq( arm64.get('bex:ptr:size'), 8 )
+        self.eq( arm64.get('bex:ptr:base'), info.imagebase )
+        self.eq( arm64.get('bex:imports'), amd64.get('bex:imports') )
+        self.eq( arm64.get('bex:exports'), amd64.get('bex:exports') )
+        self.eq( arm64.get('pe:IMAGE_NT_HEADERS').OptionalHeader.ImageBase, info.imagebase )
+
+        # unknown optional header magic
+        struct.pack_into('<H', byts, info.optoff, 0x107)
+        self.false( d_pe.isMimePe( io.BytesIO(bytes(byts)) ) )
+        self.assertRaises( d_pe.PeHeaderError, d_pe.PeLab, bytes(byts) )
+
+    def test_pe_sections(self):
+
+        with d_files.getTestFd('putty32.exe') as fd:
+            byts = fd.read()
+
+        lab = d_pe.PeLab(byts)
+
+        hashes = lab.hashSections(algos=('md5','sha1'), chunk=10000)
+        sects = list( lab.get('pe:sections') )
+        self.eq( len(hashes), len(sects) )
+
+        for (idx,sect),(name,info) in zip(sects,hashes):
+
+            self.eq( name, sect.Name )
+
+            data = byts[sect.PointerToRawData:sect.PointerToRawData + sect.SizeOfRawData]
+            self.eq( b''.join( lab.iterSectionData(name, chunk=1000) ), data )
+
+            self.eq( info['size'], len(data) )
+            self.eq( info['md5'], hashlib.md5(data).hexdigest() )
+            self.eq( info['sha1'], hashlib.sha1(data).hexdigest() )
+
+            ent = 0.0
+            for i in range(256):
+                p = data.count(i) / len(data)
+                if p:
+                    ent -= p * math.log2(p)
+
+            self.assertAlmostEqual( info['entropy'], ent )
+
+        self.eq( list( lab.iterSectionData('.woot') ), [] )
+
+    def test_pe_authentihash(self):
+
+        for name in ('putty32.exe','putty64.exe'):
+
+            with d_files.getTestFd(name) as fd:
+
+                lab = d_pe.PeLab(fd)
+
+                # the signed digests are embedded in the pkcs7 blob
+                off,size = lab.getDataDirectory(d_pe.IMAGE_DIRECTORY_ENTRY_SECURITY)
+                blob = bytes( lab.readAtOff(off, size) )
+
+                self.true( lab.getAuthentihash('sha1') in blob )
+                self.true( lab.getAuthentihash('sha256', chunk=4096) in blob )
+
+        with d_files.getTestFd('hello64.dll') as fd:
+            byts = fd.read()
+
+        lab = d_pe.PeLab(byts)
+        info = lab.getHeaderInfo()
+
+        csum = info.optoff + 64
+        cdir = info.dirsoff + 32
+        self.eq( byts[cdir:cdir + 8], b'\x00' * 8 )
+
+        data = byts[:csum] + byts[csum + 4:cdir] + byts[cdir + 8:]
+        self.eq( lab.getAuthentihash(), hashlib.sha256(data).digest() )
+
+    def test_pe_checksum(self):
+
+        def refChecksum(byts, csumoff):
+            size = len(byts)
+            byts = bytearray(byts)
+            byts[csumoff:csumoff + 4] = b'\x00' * 4
+            if len(byts) % 2:
+                byts.append(0)
+
+            csum = 0
+            for i in range(0, len(byts), 2):
+                csum += byts[i] | (byts[i + 1] << 8)
+                csum = (csum & 0xffff) + (csum >> 16)
+
+            return (csum + size) & 0xffffffff
+
+        for name in ('putty32.exe','putty64.exe'):
+            with d_files.getTestFd(name) as fd:
+                lab = d_pe.PeLab(fd)
+                self.eq( lab.computeChecksum(), lab.getHeaderInfo().checksum )
+                # chunks smaller than ( or not a multiple of ) a word
+                for chunk in (1, 4, 7, 8, 13):
+                    self.eq( lab.computeChecksum(chunk=chunk), lab.getHeaderInfo().checksum )
+
+        with d_files.getTestFd('hello32.dll') as fd:
+            byts = fd.read()
+
+        csumoff = d_pe.PeLab(byts).getHeaderInfo().optoff + 64
+
+        # include a tail which is not a multiple of 8 ( or 2 ) bytes
+        for extra in (b'', b'\x01', b'\xff\xfe\xfd'):
+            lab = d_pe.PeLab( io.BytesIO(byts + extra) )
+            csum = refChecksum(byts + extra, csumoff)
+            self.eq( lab.computeChecksum(), csum )
+            self.eq( lab.computeChecksum(chunk=1000), csum )
+
+    def test_pe_runtime_functions(self):
+
+        with d_files.getTestFd('putty64.exe') as fd:
+
+            lab = d_pe.PeLab(fd)
+
+            begins,ends,unwinds = lab.get('pe:runtime_functions')
+            self.eq( len(begins), 1699 )
+            self.eq( (begins[0],ends[0],unwinds[0]), (0x1000, 0x107a, 0xbb2a4) )
+
+            funcs = list( zip(begins,ends,unwinds) )
+            for rva in range(0, 0xc0000, 0x3f):
+                func = None
+                for f in funcs:
+                    if rva >= f[0] and rva < f[1]:
+                        func = f
+                        break
+
+                self.eq( lab.getFunctionByRva(rva), func )
+
+            uinfo = lab.getUnwindInfo(0xbb2a4)
+            self.eq( uinfo.version, 1 )
+            self.eq( uinfo.flags, 0 )
+            self.eq( uinfo.prolog, 15 )
+            self.eq( uinfo.codes, (
+                (15, d_pe.UWOP_SAVE_NONVOL, 6, 56),
+                (15, d_pe.UWOP_SAVE_NONVOL, 3, 48),
+                (15, d_pe.UWOP_ALLOC_SMALL, 3, 32),
+                (11, d_pe.UWOP_PUSH_NONVOL, 7, None),
+            ))
+
+            for unwind in set(unwinds):
+
+                uinfo = lab.getUnwindInfo(unwind)
+
+                vsinfo = lab.getStruct( lab.rvaToOff(unwind), d_pe.UNWIND_INFO )
+                self.eq( uinfo.version, vsinfo.VerFlags & 0x7 )
+                self.eq( uinfo.flags, vsinfo.VerFlags >> 3 )
+                self.eq( uinfo.prolog, vsinfo.SizeOfProlog )
+
+                if uinfo.flags & d_pe.UNW_FLAG_CHAININFO:
+                    self.eq( uinfo.handler, None )
+                    self.nn( lab.getFunctionByRva(uinfo.chained[0]) )
+
+                elif uinfo.flags:
+                    self.nn( uinfo.handler )
+
+        with d_files.getTestFd('putty32.exe') as fd:
+            lab = d_pe.PeLab(fd)
+            self.eq( lab.getFunctionByRva(0x1000), None )
+
+    def test_pe_resources(self):
+
+        with d_files.getTestFd('putty64.exe') as fd:
+            byts = bytearray( fd.read() )
+
+        lab = d_pe.PeLab(byts)
+
+        ress = lab.get('pe:resources')
+        self.eq( len(ress), 20 )
+        self.eq( ress[0], d_pe.PeResource(d_pe.RT_ICON, 1, 0x409, 0xca450, 0x128, 0) )
+
+        types = set( r.type for r in ress )
+        self.eq( types, set([d_pe.RT_ICON, d_pe.RT_DIALOG, d_pe.RT_GROUP_ICON, d_pe.RT_VERSION, d_pe.RT_MANIFEST]) )
+
+        man = [ r for r in ress if r.type == d_pe.RT_MANIFEST ][0]
+        self.eq( (man.rva,man.size), (0xcc9e8, 0x4cf) )
+
+        data = b''.join( lab.iterResourceData(man, chunk=100) )
+        self.eq( len(data), 0x4cf )
+        self.true( data.startswith(b'<?xml') )
+
+        vinfo = lab.getVersionInfo()
+        self.eq( vinfo.fixed.Signature, 0xfeef04bd )
+        self.eq( vinfo.strings.get('ProductName'), 'PuTTY suite' )
+        self.eq( vinfo.strings.get('FileVersion'), 'Release 0.68' )
+        self.eq( vinfo.translations, [(0x809, 1200)] )
+
+        # point an RT_ICON name entry back at the root directory and
+        # a lang entry at a sub directory ( both must be skipped )
+        base = lab.rvaToOff( lab.getDataDirectory(d_pe.IMAGE_DIRECTORY_ENTRY_RESOURCE)[0] )
+        byts[base + 0x4c:base + 0x50] = (0x80000000).to_bytes(4, 'little')
+        byts[base + 0x154:base + 0x158] = (0x80000158).to_bytes(4, 'little')
+
+        ress = list( d_pe.PeLab(byts).iterResources() )
+        self.eq( len(ress), 18 )
+
+        with d_files.getTestFd('hello64.dll') as fd:
+            lab = d_pe.PeLab(fd)
+            self.eq( lab.get('pe:resources'), [] )
+            self.eq( lab.getVersionInfo(), None )
@@ -10,6 +10,8 @@ def main(argv):
     p = argparse.ArgumentParser()
     p.add_argument('--list',default=False, action='store_true', help='list files within the cab file')
     p.add_argument('--catfile',help='cat a file from cab to stdout')
+    p.add_argument('--extract',help='extract all files from the cab to a directory')
+    p.add_argument('--jobs',default=1,type=int,help='number of processes to use for --extract')
     p.add_argument('cabfiles',nargs='+',help='ms cab files')
 
     args = p.parse_args(argv)
@@ -32,6 +34,14 @@ def main(argv):
             print( colify( rows, titles=titles) )
             continue
 
+        if args.extract:
+            for info in cab.getSpanningFiles():
+                print('skipped ( spans cabinets ): %s' % (info.name,))
+
+            for path in cab.extractAll( args.extract, workers=args.jobs ):
+                print('extracted: %s' % (path,))
+            continue
+
         if args.catfile:
             cab['CFHEADER'].vsPrint()
             fd = cab.openCabFile( args.catfile )